@@ -0,0 +1,208 @@
+"""Pipelined data taking for repeated measurements.
+
+A reader thread owns the serial port: it sends the trigger, reads the FIFO A
+data of one capture into a buffer and hands the buffer to the GUI thread, which
+parses it, writes it to file and redraws the plots at most every plot_interval
+seconds. The reader starts on capture N+1 while capture N is being processed,
+so a run is limited by the USB link rather than by the sum of all the steps.
+
+Buffers are taken from a fixed pool of queue_depth buffers. When the GUI thread
+falls behind, the reader waits for a buffer to be handed back, which bounds the
+memory used and the number of captures waiting to be processed.
+
+With decode_workers set, the buffers are shared memory blocks and the captures
+are decoded by a pool of processes (ParallelAcquisition). Only the name of the
+block is sent to a process, not the data, and the GUI thread gets the decoded
+captures back in measurement order.
+
+name: acquisitionMod.py
+date: 17 October 2026
+"""
+
+import configparser
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import shared_memory
+import dataParser
+
+def loadSettings(coluta,configFile):
+    """Reads the [Acquisition] settings. Falls back to sequential data taking."""
+    config = configparser.ConfigParser()
+    config.read(configFile)
+    section = config['Acquisition'] if config.has_section('Acquisition') else config['DEFAULT']
+    coluta.pipelined = section.getboolean('pipelined',fallback=False)
+    coluta.queueDepth = max(2,section.getint('queue_depth',fallback=4))
+    coluta.plotInterval = section.getfloat('plot_interval',fallback=0.25)
+    workers = section.get('decode_workers',fallback='0').strip()
+    coluta.decodeWorkers = os.cpu_count() if workers=='all' else int(workers or 0)
+    # Held by whichever thread talks to the board, for a whole status/read sequence
+    if getattr(coluta,'serialLock',None) is None:
+        coluta.serialLock = threading.RLock()
+
+def getDecodePool(coluta):
+    """Returns the pool of decoding processes, started on first use and kept until closeDecodePool"""
+    if getattr(coluta,'decodePool',None) is None:
+        # Spawned rather than forked, as the GUI process runs Qt and other threads
+        coluta.decodePool = ProcessPoolExecutor(coluta.decodeWorkers,mp_context=multiprocessing.get_context('spawn'))
+    return coluta.decodePool
+
+def closeDecodePool(coluta):
+    if getattr(coluta,'decodePool',None) is not None:
+        coluta.decodePool.shutdown()
+        coluta.decodePool = None
+
+class PipelinedAcquisition:
+    """Takes nCaptures measurements, reading and processing them in parallel.
+
+    trigger is called by the reader thread before each read, e.g. to send a
+    calibration pulse. process(measurementTime,dataByteArray,isLast) is called
+    by the GUI thread for each capture, in order. The byte array is only valid
+    during the call, as its buffer is reused afterwards. archive(dataByteArray),
+    e.g. dataParser.archiveCapture, is then called with the readout bytes.
+    """
+
+    def __init__(self,coluta,nCaptures,process,trigger=None,queueDepth=4,archive=None):
+        self.coluta = coluta
+        self.nCaptures = nCaptures
+        self.process = process
+        self.trigger = trigger
+        self.archive = archive
+        self.stopEvent = threading.Event()
+        self.readyQueue = queue.Queue()
+        self.freeBuffers = queue.Queue()
+        self.buffers = []
+        nBytes = coluta.dataWords*coluta.dualPortBufferDepth
+        for _ in range(queueDepth):
+            self.buffers.append(self.makeBuffer(nBytes))
+            self.freeBuffers.put(self.buffers[-1])
+        self.reader = threading.Thread(target=self.read,name='acquisition reader',daemon=True)
+
+    def makeBuffer(self,nBytes):
+        return bytearray(nBytes)
+
+    def readCapture(self,buffer):
+        """Reads one capture into the buffer, returning what is queued for the GUI thread"""
+        return self.coluta.fifoAReadData(self.coluta.nSamples,buffer=buffer)
+
+    def resolve(self,capture):
+        """Turns what the reader queued into what process() is called with"""
+        return capture
+
+    def archiveCapture(self,capture,buffer):
+        self.archive(capture)
+
+    def close(self):
+        pass
+
+    def read(self):
+        """Reader thread: triggers and reads each capture, then queues its buffer"""
+        try:
+            for _ in range(self.nCaptures):
+                buffer = self.freeBuffers.get()
+                # The trigger and the read are one sequence on the port, which the GUI
+                # thread must not interleave with its own writes
+                with self.coluta.serialLock:
+                    # Checked right before each trigger, the run may have stopped while waiting
+                    if self.stopEvent.is_set():
+                        break
+                    if self.trigger is not None:
+                        self.trigger()
+                    measurementTime = datetime.now().strftime("%y_%m_%d_%H_%M_%S.%f")
+                    capture = self.readCapture(buffer)
+                self.readyQueue.put((measurementTime,capture,buffer))
+        except Exception as error:
+            self.readyQueue.put(error)
+        finally:
+            self.readyQueue.put(None)
+
+    def run(self):
+        """Runs the acquisition and processes the captures as they arrive. Returns the number processed."""
+        self.reader.start()
+        nProcessed = 0
+        try:
+            while True:
+                item = self.readyQueue.get()
+                if item is None:
+                    break
+                if isinstance(item,Exception):
+                    raise item
+                measurementTime,capture,buffer = item
+                nProcessed += 1
+                try:
+                    self.process(measurementTime,self.resolve(capture),nProcessed==self.nCaptures)
+                    if self.archive is not None:
+                        self.archiveCapture(capture,buffer)
+                except BaseException:
+                    # Stopped before the buffer is handed back, which would let the reader go on
+                    self.stopEvent.set()
+                    raise
+                finally:
+                    self.freeBuffers.put(buffer)
+        finally:
+            # On an error, let the reader finish its current read and stop
+            self.stopEvent.set()
+            self.freeBuffers.put(None)
+            self.reader.join()
+            self.close()
+        return nProcessed
+
+class ParallelAcquisition(PipelinedAcquisition):
+    """Pipelined acquisition whose captures are decoded by the processes of pool.
+
+    The reader reads each capture into a shared memory block and submits it to
+    the pool with the DecodePlan and calibration weights of the parser.
+    process(measurementTime,decoded,isLast) is called in measurement order with
+    the output of dataParser.decodeFrames, which dataParser.setDecodedData() loads.
+    """
+
+    def __init__(self,coluta,nCaptures,process,pool,plan,weights,trigger=None,queueDepth=4,archive=None):
+        self.pool = pool
+        self.plan = plan
+        self.weights = weights
+        super().__init__(coluta,nCaptures,process,trigger=trigger,queueDepth=queueDepth,archive=archive)
+
+    def makeBuffer(self,nBytes):
+        return shared_memory.SharedMemory(create=True,size=nBytes)
+
+    def readCapture(self,sharedBlock):
+        # fifoAReadData returns the bytes after the discarded samples
+        start = int(self.coluta.discarded*self.coluta.dataWords)
+        with self.coluta.fifoAReadData(self.coluta.nSamples,buffer=sharedBlock.buf) as dataByteArray:
+            stop = start+len(dataByteArray)
+        return (self.pool.submit(dataParser.decodeCapture,sharedBlock.name,start,stop,
+                                 self.coluta.nSamples,self.plan,self.weights),start,stop)
+
+    def resolve(self,capture):
+        return capture[0].result()
+
+    def archiveCapture(self,capture,sharedBlock):
+        _,start,stop = capture
+        with sharedBlock.buf[start:stop] as dataByteArray:
+            self.archive(dataByteArray)
+
+    def close(self):
+        for sharedBlock in self.buffers:
+            sharedBlock.unlink()
+            try:
+                sharedBlock.close()
+            except BufferError:
+                pass # still viewed from the traceback of an error, the memory is freed with it
+
+class PlotThrottle:
+    """Limits redraws to one every interval seconds. The first and last captures are always drawn"""
+
+    def __init__(self,interval):
+        self.interval = interval
+        self.lastDraw = None
+
+    def isDue(self,isLast=False):
+        now = time.monotonic()
+        if isLast or self.lastDraw is None or now-self.lastDraw >= self.interval:
+            self.lastDraw = now
+            return True
+        return False
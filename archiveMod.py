@@ -0,0 +1,96 @@
+"""Raw archive of the readout, so that a run can be decoded again with another configuration.
+
+The bytes returned by fifoAReadData for each measurement are appended as they are to
+Run_####_Raw.bin, a flat file that is read back memory-mapped. Run_####_Raw.idx holds one
+fixed-size record per measurement (indexDtype): the offset and length of its bytes, the number
+of samples, the measurement time and the hash of the dataConfig.cfg it was taken with. Each
+configuration used is copied once to Run_####_Raw_<hash>.cfg. Run_####_Raw.jsonl holds one line
+per measurement with what the HDF5 file needs and the board cannot give back: the run and
+channel conditions, the arithmetic mode of each channel and the board settings.
+
+replayArchive.py decodes an archive again and writes the HDF5 file of the run.
+
+name: archiveMod.py
+date: 17 October 2026
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import numpy
+
+indexDtype = numpy.dtype([('offset','<u8'),('length','<u8'),('n_samples','<f8'),
+                          ('time','S24'),('config_hash','S16')])
+
+def configHash(configFile):
+    """Short hash of the contents of a configuration file"""
+    with open(configFile,'rb') as inFile:
+        return hashlib.sha1(inFile.read()).hexdigest()[:16]
+
+def archiveBase(path):
+    """Run_####_Raw from the path of any of the files of an archive"""
+    for suffix in ('.bin','.idx','.jsonl'):
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+class ArchiveWriter:
+    """Appends measurements to the raw archive basePath.bin/.idx/.jsonl"""
+
+    def __init__(self,basePath):
+        self.basePath = basePath
+        self.dataFile = open(basePath+'.bin','ab')
+        self.indexFile = open(basePath+'.idx','ab')
+        self.recordFile = open(basePath+'.jsonl','a')
+        self.offset = self.dataFile.tell()
+
+    def saveConfig(self,configHash,configFile):
+        """Keeps a copy of each configuration the measurements are taken with"""
+        configCopy = '{0}_{1}.cfg'.format(self.basePath,configHash)
+        if not os.path.isfile(configCopy):
+            shutil.copyfile(configFile,configCopy)
+
+    def append(self,dataFromChip,nSamples,measurementTime,configHash,record):
+        """Appends the bytes of one measurement, its index entry and its record"""
+        nBytes = self.dataFile.write(dataFromChip)
+        entry = numpy.array([(self.offset,nBytes,nSamples,measurementTime,configHash)],dtype=indexDtype)
+        # The data is on disk before the index points to it
+        self.dataFile.flush()
+        self.indexFile.write(entry.tobytes())
+        self.indexFile.flush()
+        self.recordFile.write(json.dumps(record,default=str)+'\n')
+        self.recordFile.flush()
+        self.offset += nBytes
+
+    def close(self):
+        for outFile in (self.dataFile,self.indexFile,self.recordFile):
+            outFile.close()
+
+class RawArchive:
+    """Reads a raw archive. archive[i] is a read-only view of the bytes of measurement i"""
+
+    def __init__(self,path):
+        self.basePath = archiveBase(path)
+        self.dataPath = self.basePath+'.bin'
+        self.index = numpy.fromfile(self.basePath+'.idx',dtype=indexDtype)
+        with open(self.basePath+'.jsonl') as recordFile:
+            self.records = [json.loads(line) for line in recordFile if line.strip()]
+        # Measurements whose index entry or record was not written completely are left out
+        nMeasurements = min(len(self.index),len(self.records))
+        self.index = self.index[:nMeasurements]
+        self.records = self.records[:nMeasurements]
+        self.data = numpy.memmap(self.dataPath,dtype=numpy.uint8,mode='r') if os.path.getsize(self.dataPath) else numpy.zeros(0,numpy.uint8)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self,i):
+        entry = self.index[i]
+        return self.data[int(entry['offset']):int(entry['offset']+entry['length'])]
+
+    def configFile(self,configHash):
+        """Path of the copy of the configuration with this hash"""
+        if isinstance(configHash,bytes):
+            configHash = configHash.decode()
+        return '{0}_{1}.cfg'.format(self.basePath,configHash)
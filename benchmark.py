@@ -0,0 +1,227 @@
+"""Times the acquisition chain of the GUI against the emulated board.
+
+Each capture goes through the same steps as testBoardGUI.takeSamples:
+    read:    fifoAReadData (trigger and USB read, see emulatorMod.py)
+    display: byteArrayToString of the readout, shown in the control text box
+    parse:   dataParser.parseData
+    write:   dataParser.writeDataToFile
+    plot:    MPLCanvas.updateFigure of the plotted channel
+Every stage is timed separately for each combination of the number of samples,
+the number of channels written per COLUTA, and the output format. The results
+are saved as JSON, with the time of every capture so that slow-downs over
+repeated captures show up.
+
+With --pipelined, the captures are taken as in takeSamplesPipelined instead:
+the reads run in the reader thread of acquisitionMod, overlapping the parse and
+write of the previous capture, and the plot is throttled. Only the stages run
+by the GUI thread are timed; the total time gives the captures per second.
+With --workers, the pipelined captures are decoded by that many processes.
+
+name: benchmark.py
+date: 17 October 2026
+
+Usage: python benchmark.py [options]
+"""
+
+import os,sys,json,time,optparse,platform,subprocess,tempfile,shutil
+from datetime import datetime
+import numpy as np
+
+# The GUI is drawn offscreen unless a platform is requested
+os.environ.setdefault('QT_QPA_PLATFORM','offscreen')
+from PyQt5 import QtWidgets
+import testBoardGUI
+import colutaMod
+import acquisitionMod
+
+stages = ['read','display','parse','write','plot']
+pipelinedStages = ['parse','write','plot']
+channelOrder = ['channel1','channel2','frame']
+formats = {'none':(False,False),'hdf5':(True,False),'csv':(False,True),'hdf5+csv':(True,True)}
+
+def directorySize(directory):
+    """Total size in bytes of the files below directory"""
+    return sum(os.path.getsize(os.path.join(path,name))
+               for path,_,names in os.walk(directory) for name in names)
+
+def gitCommit():
+    try:
+        return subprocess.check_output(['git','rev-parse','HEAD'],stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+def summarize(times):
+    times = np.array(times)
+    return {'mean':times.mean(),'min':times.min(),'max':times.max(),
+            'std':times.std(),'per_capture':times.tolist()}
+
+def takeCapture(gui,saveHDF5,csv,plotChip,plotChannel):
+    """One capture, as in takeSamples, returning the time spent in each stage"""
+    times = {}
+    start = time.perf_counter()
+    gui.measurementTime = datetime.now().strftime("%y_%m_%d_%H_%M_%S.%f")
+    dataByteArray = gui.fifoAReadData(gui.nSamples)
+    times['read'] = time.perf_counter()-start
+
+    start = time.perf_counter()
+    dataString = colutaMod.byteArrayToString(dataByteArray)
+    gui.controlTextBox.setPlainText("\n".join([dataString[i:i+32] for i in range(0,len(dataString),32)]))
+    times['display'] = time.perf_counter()-start
+
+    start = time.perf_counter()
+    gui.ODP.parseData('coluta',gui.nSamples,dataByteArray)
+    times['parse'] = time.perf_counter()-start
+
+    start = time.perf_counter()
+    gui.ODP.writeDataToFile(writeHDF5File=saveHDF5,writeCSVFile=csv)
+    times['write'] = time.perf_counter()-start
+
+    start = time.perf_counter()
+    adcData = getattr(gui.ODP,plotChip+'DecimalDict')[plotChannel]
+    gui.dataDisplay.updateFigure(adcData,np.arange(len(adcData)))
+    gui.qApp.processEvents()
+    times['plot'] = time.perf_counter()-start
+    return times
+
+def takeCapturesPipelined(gui,nRepeats,saveHDF5,csv,plotChip,plotChannel,stageTimes):
+    """nRepeats captures, as in takeSamplesPipelined, timing the stages run by the GUI thread"""
+    throttle = acquisitionMod.PlotThrottle(gui.plotInterval)
+
+    def process(measurementTime,capture,isLast):
+        gui.measurementTime = measurementTime
+        start = time.perf_counter()
+        if gui.decodeWorkers > 0:
+            gui.ODP.setDecodedData(capture)
+        else:
+            gui.ODP.parseData('coluta',gui.nSamples,capture)
+        stageTimes['parse'].append(time.perf_counter()-start)
+
+        start = time.perf_counter()
+        gui.ODP.writeDataToFile(writeHDF5File=saveHDF5,writeCSVFile=csv)
+        stageTimes['write'].append(time.perf_counter()-start)
+
+        start = time.perf_counter()
+        if throttle.isDue(isLast):
+            adcData = getattr(gui.ODP,plotChip+'DecimalDict')[plotChannel]
+            gui.dataDisplay.updateFigure(adcData,np.arange(len(adcData)))
+            gui.qApp.processEvents()
+        stageTimes['plot'].append(time.perf_counter()-start)
+
+    if gui.decodeWorkers > 0:
+        acquisitionMod.ParallelAcquisition(gui,nRepeats,process,acquisitionMod.getDecodePool(gui),
+                                           gui.ODP.getDecodePlan(),gui.ODP.channelWeights(),
+                                           queueDepth=gui.queueDepth).run()
+    else:
+        acquisitionMod.PipelinedAcquisition(gui,nRepeats,process,queueDepth=gui.queueDepth).run()
+
+def runCase(gui,nSamples,nChannels,formatName,nRepeats,outputDirectory,pipelined=False):
+    """Times nRepeats captures with the given settings"""
+    saveHDF5,csv = formats[formatName]
+    gui.nSamples = nSamples
+    # Restrict the channels written for each COLUTA
+    groups = gui.ODP.general.getSetting('data_channels')
+    savedChannels = {group:getattr(gui.ODP,group).getSetting('data_channels') for group in groups}
+    for group in groups:
+        getattr(gui.ODP,group).settings['data_channels'] = channelOrder[:nChannels]
+    gui.ODP.markConditionsDirty()
+    # Each case writes to its own directory, so the bytes written can be counted
+    caseDirectory = os.path.join(outputDirectory,'{0}_{1}_{2}'.format(nSamples,nChannels,formatName))
+    os.makedirs(caseDirectory)
+    gui.ODP.outputDirectory = caseDirectory+'/'
+
+    caseStages = pipelinedStages if pipelined else stages
+    stageTimes = {stage:[] for stage in caseStages}
+    start = time.perf_counter()
+    try:
+        if pipelined:
+            takeCapturesPipelined(gui,nRepeats,saveHDF5,csv,groups[0],'channel1',stageTimes)
+        for _ in range(0 if pipelined else nRepeats):
+            captureTimes = takeCapture(gui,saveHDF5,csv,groups[0],'channel1')
+            for stage in stages:
+                stageTimes[stage].append(captureTimes[stage])
+    finally:
+        for group in groups:
+            getattr(gui.ODP,group).settings['data_channels'] = savedChannels[group]
+        gui.ODP.markConditionsDirty()
+    totalTime = time.perf_counter()-start
+
+    return {'n_samples':nSamples,
+            'n_channels':nChannels,
+            'format':formatName,
+            'pipelined':pipelined,
+            'n_captures':nRepeats,
+            'total_time':totalTime,
+            'captures_per_second':nRepeats/totalTime,
+            'bytes_read':int(gui.dataWords*nSamples)*nRepeats,
+            'bytes_written':directorySize(caseDirectory),
+            'stages':{stage:summarize(stageTimes[stage]) for stage in caseStages}}
+
+def printCase(result):
+    means = '  '.join('{0} {1:7.1f}'.format(stage,1e3*result['stages'][stage]['mean']) for stage in result['stages'])
+    print('{0:5d} samples {1} ch {2:9s} | {3} ms | {4:6.2f} captures/s | {5:10d} bytes written'.format(
+          result['n_samples'],result['n_channels'],result['format'],means,
+          result['captures_per_second'],result['bytes_written']))
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage='Usage: %prog [options]')
+    parser.add_option('-s','--samples',default='256,1024,4093',
+                      help='Comma-separated numbers of samples per capture [%default]')
+    parser.add_option('-c','--channels',default='1,2,3',
+                      help='Comma-separated numbers of channels written per COLUTA [%default]')
+    parser.add_option('-f','--formats',default=','.join(formats),
+                      help='Comma-separated output formats, from {0} [%default]'.format(', '.join(formats)))
+    parser.add_option('-r','--repeats',type='int',default=10,
+                      help='Captures per combination [%default]')
+    parser.add_option('-o','--output',default='benchmark_{}.json'.format(datetime.now().strftime('%y_%m_%d_%H_%M_%S')),
+                      help='JSON file for the results [%default]')
+    parser.add_option('-p','--pipelined',action='store_true',
+                      help='Take the captures with the pipelined acquisition.')
+    parser.add_option('-w','--workers',type='int',default=0,
+                      help='Processes decoding the pipelined captures [%default]')
+    parser.add_option('-k','--keep',action='store_true',
+                      help='Keep the data files written during the benchmark.')
+    parser.add_option('-d','--debug',action='store_true',
+                      help='Enter debug mode.')
+    options, args = parser.parse_args()
+    for formatName in options.formats.split(','):
+        if formatName not in formats:
+            parser.error('Unknown format {}'.format(formatName))
+
+    # Everything is written to a temporary directory, outside data_files
+    outputDirectory = tempfile.mkdtemp(prefix='benchmark_')
+    # Same options as testBoard.py, always on the emulated board
+    guiOptions = optparse.Values({'no_connect':False,'emulate':True,
+                                  'debug':options.debug,'instruments':False,
+                                  'output_directory':os.path.join(outputDirectory,'gui')})
+    app = QtWidgets.QApplication(sys.argv)
+    gui = testBoardGUI.testBoardGUI(app,guiOptions,[])
+    try:
+        gui.decodeWorkers = options.workers
+
+        results = {'date':datetime.now().isoformat(),
+                   'commit':gitCommit(),
+                   'python':platform.python_version(),
+                   'numpy':np.__version__,
+                   'platform':platform.platform(),
+                   'emulator':{'usb_rate':gui.serial.usbRate,'usb_latency':gui.serial.usbLatency,
+                               'signal':gui.serial.signal},
+                   'decode_workers':options.workers if options.pipelined else 0,
+                   'cases':[]}
+        for nSamples in [int(n) for n in options.samples.split(',')]:
+            for nChannels in [int(n) for n in options.channels.split(',')]:
+                for formatName in options.formats.split(','):
+                    result = runCase(gui,nSamples,nChannels,formatName,options.repeats,outputDirectory,
+                                     pipelined=options.pipelined)
+                    printCase(result)
+                    results['cases'].append(result)
+
+        with open(options.output,'w') as outFile:
+            json.dump(results,outFile,indent=2)
+        print('Results saved in {}'.format(options.output))
+    finally:
+        gui.closeConnections()
+        if options.keep:
+            print('Data files kept in {}'.format(outputDirectory))
+        else:
+            shutil.rmtree(outputDirectory,ignore_errors=True)
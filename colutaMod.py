@@ -9,6 +9,7 @@ date: 2 February 2019
 import sys,os
 import numpy as np
 import serialMod
+import qaMod
 from math import ceil,floor
 from PyQt5.QtCore import QThread
 import Thread
@@ -59,10 +60,8 @@ def resourcePath(relativePath):
 
 def byteArrayToString(inputByteArray):
     '''Convert raw data readout to a python string object.'''
-    outputString = ''
-    for byte in inputByteArray:
-        outputString += '{0:08b}'.format(byte)
-    return outputString
+    bits = np.unpackbits(np.frombuffer(inputByteArray,dtype=np.uint8))
+    return (bits+ord('0')).tobytes().decode('ascii')
 
 def decimalToBinaryString(decimal,length):
     '''Converts an int to bin to python string object.'''
@@ -163,10 +162,11 @@ def i2cInitCommand(coluta):
     dataBitsToSend = makei2cInitCommand('001','0',dataBitsSubset)
     reversedBitList = [dataBitsToSend[i:i+8] for i in range(0,len(dataBitsToSend),8)][::-1]
     reversedString = ''.join(reversedBitList)
-    coluta.status.sendFifoAOperation(coluta,1,nByte,address)
-    serialResult = serialMod.writeToChip(coluta,'A',reversedString)
-    coluta.status.sendI2Ccommand(coluta)
-    coluta.status.send(coluta)
+    with coluta.status.transaction(coluta):
+        coluta.status.sendFifoAOperation(coluta,1,nByte,address)
+        serialResult = serialMod.writeToChip(coluta,'A',reversedString)
+        coluta.status.sendI2Ccommand(coluta)
+        coluta.status.send(coluta)
     return serialResult
 
 def i2cReadControl(coluta,tenBitMode='11110',
@@ -194,12 +194,13 @@ def i2cReadControl(coluta,tenBitMode='11110',
 
     nBits = len(bitsToSend)
     nByte = int(nBits/8) # should be 14
-    coluta.status.send(coluta)
-    serialMod.flushBuffer(coluta)
-    coluta.status.sendFifoAOperation(coluta,1,nByte,0)
-    serialResult = serialMod.writeToChip(coluta,'A',bitsToSend)
-    coluta.status.sendI2Ccommand(coluta)
-    coluta.status.send(coluta)
+    with coluta.status.transaction(coluta):
+        coluta.status.send(coluta)
+        serialMod.flushBuffer(coluta)
+        coluta.status.sendFifoAOperation(coluta,1,nByte,0)
+        serialResult = serialMod.writeToChip(coluta,'A',bitsToSend)
+        coluta.status.sendI2Ccommand(coluta)
+        coluta.status.send(coluta)
     time.sleep(0.1)
     
     nBytesExpected = 8 if i2cAddress==8 else 6
@@ -390,18 +391,18 @@ def i2cReadLpGBT(coluta,i2cWR='010',
 
     nBits = len(bitsToSend)
     nByte = int(nBits/8) # should be 8
-    coluta.status.send(coluta)
-    serialMod.flushBuffer(coluta)
-    coluta.status.sendFifoAOperation(coluta,1,nByte,0)
-    serialResult = serialMod.writeToChip(coluta,'A',bitsToSend)
-    coluta.status.sendI2Ccommand(coluta)
-    coluta.status.send(coluta)
+    with coluta.status.transaction(coluta):
+        coluta.status.send(coluta)
+        serialMod.flushBuffer(coluta)
+        coluta.status.sendFifoAOperation(coluta,1,nByte,0)
+        serialResult = serialMod.writeToChip(coluta,'A',bitsToSend)
+        coluta.status.sendI2Ccommand(coluta)
+        coluta.status.send(coluta)
     nWordsExpected = 1
     # Read the I2C ouput
     serialMod.flushBuffer(coluta)
     coluta.status.sendFifoAOperation(coluta,2,nWordsExpected,0)
     # i2cOutput = serialMod.readFromChip(coluta,'A',nBits-6*8)
-    time.sleep(0.01) # Wait for the buffer to fill
     i2cOutput = serialMod.readFromChip(coluta,'A',8) # Need to think about nBytes argument for readFromChip()
     # Read the relevant bytes
     if type(i2cOutput) is not bool:
@@ -457,10 +458,11 @@ def i2cWriteLpGBT(coluta,
     nAttempts = 0
     # while not ackReceived and nAttempts<maxWriteAttempts:
     #while not serialResult:
-    coluta.status.send(coluta)
-    coluta.status.sendFifoAOperation(coluta,1,nByte,address)
-    serialResult = serialMod.writeToChip(coluta,'A',bitsToSend)
-    coluta.status.sendI2Ccommand(coluta)
+    with coluta.status.transaction(coluta):
+        coluta.status.send(coluta)
+        coluta.status.sendFifoAOperation(coluta,1,nByte,address)
+        serialResult = serialMod.writeToChip(coluta,'A',bitsToSend)
+        coluta.status.sendI2Ccommand(coluta)
         # serialResult = attemptWrite(coluta,dataBitsToSend,i2cAddress,address)
 
         # ackReceived = coluta.checkControl('misc__','Last_I2C_ACK__')
@@ -548,19 +550,19 @@ def i2cRead(coluta,chip,categoryName,
     nBits = len(bitsToSend)
     nByte = int(nBits/8) # should be 8 for lpgbt, 14 for coluta
     # nByte = 1
-    coluta.status.send(coluta)
-    serialMod.flushBuffer(coluta)
-    coluta.status.sendFifoAOperation(coluta,1,nByte,0)
-    serialResult = serialMod.writeToChip(coluta,'A',bitsToSend)
-    coluta.status.sendI2Ccommand(coluta)
-    coluta.status.send(coluta)
+    with coluta.status.transaction(coluta):
+        coluta.status.send(coluta)
+        serialMod.flushBuffer(coluta)
+        coluta.status.sendFifoAOperation(coluta,1,nByte,0)
+        serialResult = serialMod.writeToChip(coluta,'A',bitsToSend)
+        coluta.status.sendI2Ccommand(coluta)
+        coluta.status.send(coluta)
     time.sleep(0.1)
 
     # Read the I2C ouput
     # serialMod.flushBuffer(coluta)
     coluta.status.sendFifoAOperation(coluta,2,nWordsExpected,0)
     # i2cOutput = serialMod.readFromChip(coluta,'A',nBits-6*8)
-    time.sleep(0.1)
     i2cOutput = serialMod.readFromChip(coluta,'A',8) # Need to think about nBytes argument for readFromChip()
     # Read the relevant bytes
     if type(i2cOutput) is not bool:
@@ -667,10 +669,11 @@ def attemptWriteNew(coluta,chip,dataBitsToSend,i2cAddress,address,lpgbtRegAddres
     bitsToSend = makeWishboneCommandNew(dataBitsToSend,chip,'010','1',nDataBytesStr,'0','11110','00','1',
                                         i2cAddressStr,'1110000',lpgbtRegAddressStr)
     nByte = int(len(bitsToSend)/8) # should be 12 for coluta, 6 for lpgbt
-    coluta.status.send(coluta)
-    coluta.status.sendFifoAOperation(coluta,1,nByte,address)
-    serialResult = serialMod.writeToChip(coluta,'A',bitsToSend)
-    coluta.status.sendI2Ccommand(coluta)
+    with coluta.status.transaction(coluta):
+        coluta.status.send(coluta)
+        coluta.status.sendFifoAOperation(coluta,1,nByte,address)
+        serialResult = serialMod.writeToChip(coluta,'A',bitsToSend)
+        coluta.status.sendI2Ccommand(coluta)
 
     return serialResult
 
@@ -762,72 +765,20 @@ def attemptWrite(coluta,dataBitsToSend,i2cAddress,address):
     # nByte = int(len(bitsToSend)/8) - 1 
     # bitsToSend = bitsToSend[8:]
 
-    coluta.status.send(coluta)
-    # time.sleep(1)
-    coluta.status.sendFifoAOperation(coluta,1,nByte,address)
-    # time.sleep(2)
-    serialResult = serialMod.writeToChip(coluta,'A',bitsToSend)
-    # time.sleep(1)
-    coluta.status.sendI2Ccommand(coluta)
-    coluta.status.send(coluta)
+    with coluta.status.transaction(coluta):
+        coluta.status.send(coluta)
+        # time.sleep(1)
+        coluta.status.sendFifoAOperation(coluta,1,nByte,address)
+        # time.sleep(2)
+        serialResult = serialMod.writeToChip(coluta,'A',bitsToSend)
+        # time.sleep(1)
+        coluta.status.sendI2Ccommand(coluta)
+        coluta.status.send(coluta)
     return serialResult
 
 ########################################################################################
 # FFT-related functions
 
 def doFFT(coluta,adcData):
-    fourier = list(map(lambda x: np.sqrt(x.real**2 + x.imag**2), np.fft.fft(adcData)[2:-2]))
-    fourier = fourier[:round(len(fourier)/2)]
-    fourier = fourier/np.max(fourier)
-
-    psd = 20*np.log10(fourier)
-    freq = np.linspace(0,coluta.frequency/2,len(fourier))
-    QA = performance(fourier,coluta.frequency)
-    return freq,psd,QA
-
-def performance(fourier,fs):
-    '''Calculates performance measures of FFT.'''
-    return {'SINAD': SINAD(fourier),
-            'SNR': SNR(fourier,fs),
-            'ENOB': ENOB(fourier),
-            'SFDR': SFDR(fourier)}
-
-def SINAD(fourier):
-    sum2 = 0
-    for normBin in fourier:
-        if normBin==1: continue
-        sum2 += normBin**2
-    return -10*np.log10(sum2)
-
-def SFDR(fourier):
-    #print(np.delete(fourier,np.where(fourier==1)))
-    return -20*np.log10(np.max(np.delete(fourier,np.where(fourier==1))))
-
-def SNR(fourier,fs,K=2):
-    try:
-        freq = np.linspace(0,fs/2,len(fourier))
-        fa = freq[np.argmax(fourier)]
-        fr = fs/fa
-    except:
-        print("Error: Division by 0")
-        fr = 0
-
-    noHarmonics = np.array(fourier,copy=True)
-    harmList = harmonics(fs,fa)
-    for i,k in enumerate(freq):
-        for h in harmList:
-            if abs(k-h)<1e-6:
-                noHarmonics[i]=0
-    return SINAD(noHarmonics)
-
-def ENOB(fourier):
-    return (SINAD(fourier)-1.76)/6.02
-
-def harmonics(fs,fa,K=2):
-    fr = fs/fa
-    fn = fs/2
-    try:
-        harmList = [((k*fa+fn)%fs)-fn for k in np.arange(2,int(fr*K))]
-    except:
-        harmList = []
-    return harmList
+    """Frequencies, PSD and QA of a capture, with the settings of config/qaConfig.cfg"""
+    return qaMod.analyzeSpectrum(adcData,coluta.frequency,getattr(coluta,'qaSettings',qaMod.defaultSettings))
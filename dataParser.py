@@ -10,7 +10,8 @@ date: 8 August 2018"""
 
 import configparser
 import numpy
-from collections import defaultdict
+from collections import defaultdict,namedtuple
+from types import MappingProxyType
 import os
 import time
 import csv
@@ -19,6 +20,22 @@ from datetime import datetime
 from ast import literal_eval
 import h5py
 from itertools import product
+from multiprocessing import shared_memory
+import archiveMod
+import qaMod
+import pulseMod
+
+# How the samples of one channel are unpacked from the lpGBT frames, compiled from dataConfig.cfg
+# wordIndex counts the data words (WORD1 is 0), the sample is (word>>shift)&mask and has nBits bits
+# roll is the bit roll of the stream of samples, barrel the byte order of barrelWords or 'none'
+ChannelSlot = namedtuple('ChannelSlot',['chip','channel','wordIndex','shift','mask','nBits','roll','barrel'])
+DecodePlan = namedtuple('DecodePlan',['bytesPerFrame','bytesPerWord','nWords','channels'])
+# How the FPGA histogram buffer is unpacked, compiled from [HISTOGRAM] in dataConfig.cfg
+# Each word holds a bin number, (word>>binShift)&binMask, and its count, (word>>countShift)&countMask
+HistogramLayout = namedtuple('HistogramLayout',['bytesPerWord','countShift','countMask','binShift','binMask','nBins'])
+# Read-only snapshot of the conditions saved with the measurements, see dataParser.getRunConditions
+# run: the run conditions, channels: {(coluta,channel): conditions}, modes: {(coluta,channel): arithmetic mode}
+RunConditions = namedtuple('RunConditions',['run','channels','modes'])
 
 ############# General helper function
 def barrelRoll(dataList,order):
@@ -35,35 +52,45 @@ def barrelRoll(dataList,order):
     # This aligns the two consecutive subgroups 
     # For e.g., if we had coluta1 and coluta2 bits in dataList,
     # then we would align frame_coluta1_s[i] with frame_coluta1_s[i+1] in these two lists
-    intialSampleList = [sample[i:i+wordLength] for sample in dataList for i in range(0,len(sample),wordLength)]
-    nextSampleList = list(numpy.roll(intialSampleList,-16)) 
-    
-    # Loop through elements of the consecutive sample list to align the data bits
-    barrelRolledList = []
-    for s1,s2 in zip(intialSampleList,nextSampleList):
-        # Join the LSByte of s[i] and MSByte of s[i+1]
-        if order=='lsbmsb':
-            serializedWord1 = s1[:8]+s2[8:]
-            # serializedWord2 = s1[8:]+s2[:8]
-        # Join the MSByte of s[i] and LSByte of s[i+1]
-        elif order=='msblsb':
-            serializedWord1 = s1[8:]+s2[:8]
-            # serializedWord2 = s1[:8]+s2[8:]
-        # Join the LSByte of s[i] and LSByte of s[i+1]
-        elif order=='lsblsb':
-            serializedWord1 = s1[:8]+s2[:8]
-            # serializedWord2 = s1[8:]+s2[8:]
-        # Join the MSByte of s[i] and MSByte of s[i+1]
-        elif order=='msbmsb':
-            serializedWord1 = s1[8:]+s2[8:]
-            # serializedWord2 = s1[:8]+s2[:8] 
-
-        barrelRolledList.append(serializedWord1)
-        # barrelRolledList.append(serializedWord2)
+    intialSamples = binaryStringsToWords([sample[i:i+wordLength] for sample in dataList for i in range(0,len(sample),wordLength)])
+    barrelRolled = barrelWords(intialSamples,order,numpy.roll(intialSamples,-16))
 
     # Now make each element of the new list 32-bit long
-    barrelRolledList = [barrelRolledList[i]+barrelRolledList[i+1] for i in range(0,len(barrelRolledList)-1)]
-    return barrelRolledList
+    barrelRolled = (barrelRolled[:-1].astype(numpy.uint32)<<wordLength)|barrelRolled[1:]
+    return wordsToBinaryStrings(barrelRolled,2*wordLength)
+
+def frameWords(dataFromChip,bytesPerFrame,bytesPerWord=4):
+    """View the raw readout bytes as an (nFrames,wordsPerFrame) array of 32-bit lpGBT words.
+    Bytes arrive MSB first, so each word is read big-endian. Incomplete trailing frames are dropped"""
+    nFrames = len(dataFromChip)//bytesPerFrame
+    wordsPerFrame = bytesPerFrame//bytesPerWord
+    words = numpy.frombuffer(dataFromChip,dtype='>u{}'.format(bytesPerWord),count=nFrames*wordsPerFrame)
+    return words.reshape(nFrames,wordsPerFrame).astype('u{}'.format(bytesPerWord))
+
+def wordsToBinaryStrings(words,nBits=16):
+    """Format an array of integer words as a list of '0'/'1' strings, MSB first"""
+    bitShifts = numpy.arange(nBits-1,-1,-1,dtype=numpy.uint16)
+    characters = ((words[:,None]>>bitShifts)&1).astype(numpy.uint8)+ord('0')
+    return characters.view('S{}'.format(nBits)).ravel().astype('U{}'.format(nBits)).tolist()
+
+def binaryStringsToWords(binaryStrings,nBits=16):
+    """Packs a list of '0'/'1' strings, MSB first, into an array of unsigned integers"""
+    characters = numpy.array(binaryStrings,dtype='S{}'.format(nBits)).view(numpy.uint8).reshape(-1,nBits)
+    bitShifts = numpy.arange(nBits-1,-1,-1,dtype=numpy.uint32)
+    return ((characters-ord('0')).astype(numpy.uint32)<<bitShifts).sum(axis=1).astype(numpy.uint16)
+
+def unpackRawData(rawData,nBits=16):
+    """Expands packed samples to the bit layout, one int8 per bit with the MSB first. 
+
+    Works on any shape, e.g. (sample,) -> (sample,16) or (measurement,sample) -> (measurement,sample,16)"""
+    bitShifts = numpy.arange(nBits-1,-1,-1,dtype=numpy.uint32)
+    return ((numpy.asarray(rawData)[...,None].astype(numpy.uint32)>>bitShifts)&1).astype(numpy.int8)
+
+def readRawBits(dataset):
+    """Reads a raw_data dataset in the bit layout, whether it was saved packed or not"""
+    if dataset.attrs.get('packing','')=='uint16':
+        return unpackRawData(dataset[()])
+    return dataset[()]
 
 def isSequence(arg):
     """Determines if arg is a sequence. See https://stackoverflow.com/questions/1835018/"""
@@ -86,13 +113,217 @@ def stringRoll(words, shift):
 
     return new_words
 
+def rollWords(words,shift,nBits=16,out=None):
+    """Rolls the bit stream of an array of nBits words by shift bits, as stringRoll does with strings.
+    Whole words are rolled first, then the remaining bits carry over from the previous word.
+    out may be words itself, to align the samples in place"""
+    if out is None:
+        out = numpy.empty_like(words)
+    if len(words)==0:
+        return out
+    wordShift,bitShift = divmod(shift,nBits)
+    rolled = numpy.roll(words,wordShift)
+    if bitShift==0:
+        out[:] = rolled
+        return out
+    # The low bits of the previous word become the high bits of this one
+    numpy.left_shift(numpy.roll(rolled,1),nBits-bitShift,out=out)
+    numpy.right_shift(rolled,bitShift,out=rolled)
+    numpy.bitwise_or(out,rolled,out=out)
+    numpy.bitwise_and(out,(1<<nBits)-1,out=out)
+    return out
+
+# Which half of a sample and of the next one barrelWords joins, for each order of barrelRoll.
+# "lsb" is the first half of the string, i.e. the high byte of the word
+barrelOrders = {'lsbmsb':(True,False),'msblsb':(False,True),'lsblsb':(True,True),'msbmsb':(False,False)}
+
+def barrelWords(words,order,nextWords=None,nBits=16,out=None):
+    """Joins half of each sample with half of the next one (nextWords, by default the sample
+    that follows), in the byte order of barrelRoll. out may be words itself"""
+    if nextWords is None:
+        nextWords = numpy.roll(words,-1)
+    if out is None:
+        out = numpy.empty_like(words)
+    firstHigh,secondHigh = barrelOrders[order]
+    halfBits = nBits//2
+    halfMask = (1<<halfBits)-1
+    second = (nextWords>>halfBits if secondHigh else nextWords&halfMask).astype(words.dtype)
+    if firstHigh:
+        numpy.right_shift(words,halfBits,out=out)
+    else:
+        numpy.bitwise_and(words,halfMask,out=out)
+    numpy.left_shift(out,halfBits,out=out)
+    numpy.bitwise_or(out,second,out=out)
+    return out
+
+def alignWords(words,slot):
+    """Applies the roll, then the barrel shift if any, of a ChannelSlot to its samples in place"""
+    rollWords(words,slot.roll,slot.nBits,out=words)
+    if slot.barrel!='none':
+        barrelWords(words,slot.barrel,nBits=slot.nBits,out=words)
+    return words
+
+def convertWords(words,weights,overflowWeights=None,nBits=16):
+    """Converts an array of nBits words to ADC counts in one (N,nBits).(nBits,) product.
+    Words with the overflow bit (bit 2 from the MSB) set use overflowWeights, if given"""
+    bits = unpackRawData(words,nBits).astype(numpy.int64)
+    decimals = bits.dot(numpy.asarray(weights,dtype=numpy.int64))
+    if overflowWeights is not None and not numpy.array_equal(weights,overflowWeights):
+        decimals = numpy.where(bits[:,2]==1,bits.dot(numpy.asarray(overflowWeights,dtype=numpy.int64)),decimals)
+    return decimals
+
+def dataWordFrames(frames,plan):
+    """Keeps the data words of the frames (words 1 to nWords), dropping the frames where they are all empty"""
+    dataFrames = frames[:,1:plan.nWords+1]
+    return dataFrames[dataFrames.any(axis=1)]
+
+def unpackSlot(dataFrames,slot):
+    """Shifts and masks the samples of one channel out of its data word"""
+    return ((dataFrames[:,slot.wordIndex]>>slot.shift)&slot.mask).astype(numpy.uint16)
+
+def decodeFrames(frames,plan,weights):
+    """Decodes an (nFrames,8) array of lpGBT words with a DecodePlan and the calibration weights
+    of dataParser.channelWeights(). Returns {(chip,channel):(words,decimals)} with the rolled
+    16-bit words and their ADC counts"""
+    dataFrames = dataWordFrames(frames,plan)
+    decoded = {}
+    for slot in plan.channels:
+        words = alignWords(unpackSlot(dataFrames,slot),slot)
+        channelWeights,overflowWeights = weights[(slot.chip,slot.channel)]
+        decoded[(slot.chip,slot.channel)] = (words,convertWords(words,channelWeights,overflowWeights,slot.nBits))
+    return decoded
+
+def decodeHistogramWords(dataFromChip,nWords,layout):
+    """Decodes nWords words of the FPGA histogram buffer with a HistogramLayout.
+    Returns the bin numbers and their counts as int64 arrays"""
+    nWords = min(int(nWords),len(dataFromChip)//layout.bytesPerWord)
+    words = numpy.frombuffer(dataFromChip,dtype='<u{}'.format(layout.bytesPerWord),count=nWords)
+    # The buffer repeats some of its words, each is counted once
+    words = numpy.unique(words)
+    counts = (words>>numpy.uint64(layout.countShift))&numpy.uint64(layout.countMask)
+    bins = (words>>numpy.uint64(layout.binShift))&numpy.uint64(layout.binMask)
+    # get rid of empty words and of the zero bin number
+    isFilled = (counts!=0)&(bins!=0)
+    return bins[isFilled].astype(numpy.int64),counts[isFilled].astype(numpy.int64)
+
+def decodeCapture(sharedName,start,stop,nSamples,plan,weights):
+    """Decodes the readout bytes [start:stop] of a shared memory block. Runs in the decoding processes"""
+    sharedBlock = shared_memory.SharedMemory(name=sharedName)
+    try:
+        with sharedBlock.buf[start:stop] as dataFromChip:
+            frames = frameWords(dataFromChip,plan.bytesPerFrame,plan.bytesPerWord)
+        return decodeFrames(frames[:int(nSamples)],plan,weights)
+    finally:
+        sharedBlock.close()
+
+class ChannelStream:
+    """Aligns the samples of one channel as they arrive, keeping only the words the next ones need.
+
+    The roll of the slot takes bits from up to |roll|//nBits+1 words before or after each sample,
+    and the barrel shift from the next one. Samples are released once the words they need have
+    arrived, so each block can come out a few samples later than its input. Bits from before
+    the first or after the last sample are zero, where alignWords wraps them around the capture.
+    """
+    def __init__(self,slot):
+        self.slot = slot
+        wordShift,bitShift = divmod(slot.roll,slot.nBits)
+        # Words needed after each sample, and the words of context kept around each block
+        self.lookahead = max(-wordShift+(slot.barrel!='none'),0)
+        self.context = abs(wordShift)+2
+        self.words = numpy.zeros(self.context,dtype=numpy.uint16) # words from index self.start on
+        self.start = -self.context
+        self.nIn = 0
+        self.nOut = 0
+
+    def push(self,words,isLast=False):
+        """Adds the next words of the channel. Returns the aligned samples that are now complete"""
+        self.words = numpy.concatenate((self.words,words))
+        self.nIn += len(words)
+        stop = self.nIn if isLast else max(self.nIn-self.lookahead,self.nOut)
+        # Zeros stand in for the words after the last one, which the kept samples do not depend on
+        padded = numpy.concatenate((self.words,numpy.zeros(self.context,dtype=numpy.uint16)))
+        window = padded[self.nOut-self.context-self.start:stop+self.context-self.start]
+        aligned = alignWords(window,self.slot)[self.context:self.context+stop-self.nOut]
+        self.nOut = stop
+        self.words = self.words[stop-self.context-self.start:]
+        self.start = stop-self.context
+        return aligned
+
+class StreamDecoder:
+    """Decodes a readout that arrives in blocks of any size, e.g. a capture larger than memory or
+    captures read one after the other, with a DecodePlan and the weights of channelWeights().
+
+    feed(block) returns {(chip,channel):(words,decimals)} as decodeFrames does, for the samples
+    complete so far, and finish() the last ones. Only an incomplete frame and a few words of each
+    channel are kept between blocks. The rolls are those of the plan, they are not searched again.
+
+    The rolls apply to the whole stream, not circularly to each capture as in parseData: the
+    first and last |roll|//nBits+1 samples of a channel, and with a barrel shift its last
+    sample, take zeros where parseData takes bits from the other end of the capture. The
+    samples in between are the same.
+    """
+    def __init__(self,plan,weights):
+        self.plan = plan
+        self.weights = weights
+        self.channels = [ChannelStream(slot) for slot in plan.channels]
+        self.partialFrame = b''
+
+    def feed(self,dataFromChip,isLast=False):
+        data = self.partialFrame+bytes(dataFromChip)
+        nBytes = len(data)-len(data)%self.plan.bytesPerFrame
+        self.partialFrame = data[nBytes:]
+        dataFrames = dataWordFrames(frameWords(data[:nBytes],self.plan.bytesPerFrame,self.plan.bytesPerWord),self.plan)
+        decoded = {}
+        for stream in self.channels:
+            slot = stream.slot
+            words = stream.push(unpackSlot(dataFrames,slot),isLast)
+            channelWeights,overflowWeights = self.weights[(slot.chip,slot.channel)]
+            decoded[(slot.chip,slot.channel)] = (words,convertWords(words,channelWeights,overflowWeights,slot.nBits))
+        return decoded
+
+    def finish(self):
+        """Returns the samples held back for the words after them. An incomplete last frame is dropped"""
+        self.partialFrame = b''
+        return self.feed(b'',isLast=True)
+
+def iterDecodedBlocks(blocks,plan,weights):
+    """Generator decoding an iterable of readout blocks, see StreamDecoder. The samples at
+    either end of the stream differ from those of parseData, which rolls circularly"""
+    decoder = StreamDecoder(plan,weights)
+    for block in blocks:
+        yield decoder.feed(block)
+    yield decoder.finish()
+
+class BinaryStringDict(dict):
+    """The samples of each channel of a word dictionary as '0'/'1' strings, MSB first.
+    A channel is only formatted the first time it is looked up, e.g. for the CSV files"""
+    def __init__(self,wordDict,nBits=16):
+        super().__init__()
+        self.wordDict = wordDict
+        self.nBits = nBits
+
+    def __missing__(self,channel):
+        if channel not in self.wordDict:
+            return []
+        binaryStrings = wordsToBinaryStrings(self.wordDict[channel],self.nBits)
+        self[channel] = binaryStrings
+        return binaryStrings
+
+def readBlocks(fileObject,blockSize=1<<20):
+    """Generator reading a binary file in blocks of blockSize bytes"""
+    while True:
+        block = fileObject.read(blockSize)
+        if not block:
+            return
+        yield block
 
 class dataParser():
 
-    def __init__(self,coluta,configFile):
+    def __init__(self,coluta,configFile,outputDirectory=None):
         """
         Init function reads the configuration file and creates dictionaries for each
-        version of the data.
+        version of the data. The files are written to a new Run_#### directory of
+        ./data_files/, or to outputDirectory if given.
         """
         self.configFile = configFile
         self.output_directory = './data_files/'
@@ -100,17 +331,45 @@ class dataParser():
 
         # Updated config dict for comment annotation
         self.updatedConfigs = {}
+
+        # Arithmetic modes used instead of the GUI selection, e.g. when replaying a raw archive
+        self.arithmeticModes = {}
+        # Modes read from the GUI mode boxes, again only after a setting changes
+        self.modeCache = {}
+        # Conditions collected from the GUI, again only after a setting changes
+        self.runConditions = None
+        self.conditionsKey = None
+
+        # Rolls found by findAlignment for the connected board, see [ALIGNMENT] in dataConfig.cfg
+        self.alignmentBoard = None
+        self.alignmentRolls = {}
+        # Set when rolls were found but not saved yet, and what findAlignment has to report,
+        # both left for the GUI to act on after the capture
+        self.alignmentChanged = False
+        self.alignmentStatus = None
         
         self.setupConfigurations()
+        self.resetHistogram()
+        self.runWriter = None # keeps the HDF5 file of the run open, see RunWriter
+        self.rawArchive = None # raw readout of the run, see archiveMod
         self.runNumber = 1
         self.outputDirectory = self.output_directory+'Run_'+str(self.runNumber).zfill(4)+'/'
 
         data_groups = self.general.getSetting('data_channels')
         for group in data_groups:
             setattr(self,group+'DecimalDict',defaultdict(list))
-            setattr(self,group+'BinaryDict',defaultdict(list))
+            # The aligned 16-bit words of each channel, formatted as strings only when needed
+            setattr(self,group+'WordDict',{})
+            setattr(self,group+'BinaryDict',BinaryStringDict(getattr(self,group+'WordDict')))
             for channel in getattr(self,group).getSetting('data_channels'):
                 setattr(self,group+channel+'_fileNumber',0)
+        # Sine fits (qaMod.sineFit) of the channels of the last measurement, see getSineFit
+        self.sineFits = {}
+
+        if outputDirectory is not None:
+            self.outputDirectory = outputDirectory
+            os.makedirs(self.outputDirectory,exist_ok=True)
+            return
 
         # Check if the output directory exists, if not, create the directory
         while os.path.exists(self.outputDirectory):
@@ -136,6 +395,162 @@ class dataParser():
             self.readConfigFile(categoryName,categoryTemplate)
             self.configurations.append(categoryName)
 
+        self.decodePlan = self.compileDecodePlan()
+        if hasattr(self,'histogram'):
+            self.histogramLayout = self.compileHistogramLayout()
+        self.weightsCache = {} # weights of each arithmetic mode, see getChannelWeights
+        self.conditionsDirty = True # laurocGain and the run settings come from the configuration
+        self.modeCache = {}
+        self.configTime = os.path.getmtime(self.configFile) if os.path.isfile(self.configFile) else None
+        self.configHash = archiveMod.configHash(self.configFile) if os.path.isfile(self.configFile) else ''
+
+    def compileDecodePlan(self):
+        """Compiles the WORD sections into a DecodePlan, so that parsing needs no setting lookups"""
+        groups = self.general.getSetting('data_words')
+        bitsPerSample = int(self.rootGroup.getSetting('total_bits'))
+        channels = []
+        for (wordIndex,group) in enumerate(groups):
+            configDict = getattr(self,group).settings
+            dataChannels = configDict['data_channels']
+            # The barrel shift is optional, for the channels that need it
+            barrels = configDict.get('barrel',['none']*len(dataChannels))
+            for (chip,channel,lsb,msb,roll,barrel) in zip(configDict['data_chips'],dataChannels,configDict['lsb'],
+                                                          configDict['msb'],configDict['roll'],barrels):
+                if barrel!='none' and barrel not in barrelOrders:
+                    self.coluta.showError('DATA PARSER: Unknown barrel order {0} in {1}'.format(barrel,group))
+                    barrel = 'none'
+                # lsb and msb are string indices counted from the MSB, so [16:32] of a 32-bit word
+                #  are its 16 lowest bits
+                nBits = int(msb)-int(lsb)
+                roll = self.alignmentRolls.get((chip,channel),int(roll))
+                channels.append(ChannelSlot(chip,channel,wordIndex,bitsPerSample-int(msb),(1<<nBits)-1,nBits,
+                                            roll,barrel))
+        return DecodePlan(int(self.general.getSetting('word_length'))//8,bitsPerSample//8,len(groups),tuple(channels))
+
+    def compileHistogramLayout(self):
+        """Compiles [HISTOGRAM] into a HistogramLayout"""
+        totalBits = int(self.histogram.getSetting('total_bits'))
+        fields = dict(zip(self.histogram.getSetting('data_channels'),
+                          zip(self.histogram.getSetting('lsb'),self.histogram.getSetting('msb'))))
+        (countLSB,countMSB),(binLSB,binMSB) = [(int(lsb),int(msb)) for lsb,msb in (fields['bin_count'],fields['bin_number'])]
+        return HistogramLayout(totalBits//8,totalBits-countMSB,(1<<(countMSB-countLSB))-1,
+                               totalBits-binMSB,(1<<(binMSB-binLSB))-1,int(self.histogram.getSetting('n_bins')))
+
+    def getDecodePlan(self):
+        """Returns the DecodePlan, reading the configuration file again if it has changed
+        and loading the saved alignment when the board changes"""
+        if os.path.isfile(self.configFile) and os.path.getmtime(self.configFile)!=self.configTime:
+            self.setupConfigurations()
+        board = str(getattr(self.coluta,'serial_number',None))
+        if board!=self.alignmentBoard:
+            self.loadAlignment(board)
+        return self.decodePlan
+
+    def getHistogramAddress(self):
+        """Control register of the FPGA histogram buffer, None if there is no [HISTOGRAM] or it
+        gives none. The address takes the 3 bits of the chip address in the status word, an
+        address outside 0-7 would spill into colutaReset: it raises ValueError"""
+        if not hasattr(self,'histogram'):
+            return None
+        address = str(self.histogram.settings.get('fpga_address','')).strip()
+        if not address:
+            return None
+        try:
+            value = int(address,0)
+        except ValueError:
+            value = None
+        if value is None or not 0<=value<=7:
+            raise ValueError('DATA PARSER: fpga_address {} of [HISTOGRAM] is not a control register address from 0 to 7'.format(address))
+        return value
+
+    def getHistogramLayout(self):
+        """Returns the HistogramLayout, reading the configuration file again if it has changed"""
+        if os.path.isfile(self.configFile) and os.path.getmtime(self.configFile)!=self.configTime:
+            self.setupConfigurations()
+        return self.histogramLayout
+
+    def isAutoAligned(self):
+        return hasattr(self,'alignment') and self.alignment.getSetting('auto')=='1'
+
+    def getAlignmentFile(self):
+        return os.path.join(os.path.dirname(self.configFile),self.alignment.getSetting('cache_file'))
+
+    def loadAlignment(self,board):
+        """Uses the rolls saved for board, if any, in place of those of the WORD sections"""
+        self.alignmentBoard = board
+        self.alignmentRolls = {}
+        self.alignmentWarned = False
+        self.alignmentChanged = False
+        if self.isAutoAligned():
+            config = configparser.ConfigParser()
+            config.optionxform=str
+            config.read(self.getAlignmentFile())
+            if config.has_section(board):
+                for key,roll in config.items(board):
+                    chip,channel = key.split('.')
+                    self.alignmentRolls[(chip,channel)] = int(roll)
+        self.decodePlan = self.compileDecodePlan()
+
+    def saveAlignment(self):
+        """Saves the rolls found by findAlignment under the board serial number. Called by the
+        GUI after the capture, so that parsing never writes to the config directory"""
+        config = configparser.ConfigParser()
+        config.optionxform=str
+        alignmentFile = self.getAlignmentFile()
+        config.read(alignmentFile)
+        config[self.alignmentBoard] = {'{0}.{1}'.format(chip,channel):str(roll) 
+                                       for (chip,channel),roll in self.alignmentRolls.items()}
+        with open(alignmentFile,'w') as configFile:
+            config.write(configFile)
+        self.alignmentChanged = False
+
+    def isFrameAligned(self,alignedWords):
+        """Checks that the aligned frame channels carry the frame pattern"""
+        framePattern = int(self.alignment.getSetting('frame_pattern'),0)
+        minMatch = float(self.alignment.getSetting('min_frame_match'))
+        return all(numpy.mean(words==framePattern) >= minMatch
+                   for slot,words in alignedWords.items() if slot.channel=='frame' and len(words))
+
+    def findAlignment(self,dataFrames):
+        """Searches the roll of every channel on one capture, keeping the current roll on ties.
+
+        Each bit phase of the samples is tried, as rolls within half a sample of the current
+        one. Frame channels take the roll that matches frame_pattern best. Data channels take
+        the one giving the smallest total variation of their raw words read as integers, not
+        of their ADC counts: in a wrong phase, bits of the neighbouring sample land in the
+        high bits and the words jump. If a frame channel cannot be matched, the plan is left
+        as it was. What was found is left in alignmentStatus, and alignmentChanged is set when
+        the rolls are new, for the GUI to show and save them (see saveAlignment).
+        Returns the DecodePlan"""
+        plan = self.decodePlan
+        framePattern = int(self.alignment.getSetting('frame_pattern'),0)
+        minMatch = float(self.alignment.getSetting('min_frame_match'))
+        rolls = {}
+        for slot in plan.channels:
+            words = unpackSlot(dataFrames,slot)
+            # Rolls of whole samples do not change the phase, so one per bit is enough. Staying
+            # near the current roll keeps the samples lost at the ends of the capture few
+            shifts = [0]+[shift for shift in range(-(slot.nBits//2)+1,slot.nBits//2+1) if shift]
+            candidates = [slot.roll+shift for shift in shifts]
+            rolled = numpy.stack([alignWords(words.copy(),slot._replace(roll=roll)) for roll in candidates])
+            if slot.channel=='frame':
+                scores = -numpy.mean(rolled==framePattern,axis=1)
+                if -scores.min() < minMatch:
+                    if not self.alignmentWarned:
+                        self.alignmentStatus = 'No alignment of {0} {1} matches the frame pattern'.format(slot.chip,slot.channel)
+                        self.alignmentWarned = True
+                    return plan
+            else:
+                scores = numpy.abs(numpy.diff(rolled.astype(numpy.int64),axis=1)).sum(axis=1)
+            # argmin returns the first minimum, i.e. the current roll on a tie
+            rolls[(slot.chip,slot.channel)] = candidates[int(numpy.argmin(scores))]
+        self.alignmentRolls = rolls
+        self.decodePlan = self.compileDecodePlan()
+        self.alignmentChanged = True
+        self.alignmentStatus = 'New alignment for board {0}: {1}'.format(self.alignmentBoard,
+            ', '.join('{0} {1} {2}'.format(chip,channel,roll) for (chip,channel),roll in rolls.items()))
+        return self.decodePlan
+
     def readConfigFile(self,categoryName,categoryTemplate):
         """Read sections of the config file"""
         config = configparser.ConfigParser()
@@ -168,133 +583,139 @@ class dataParser():
                     hdf5File.attrs.create(key,value)
 
     def parseData(self,dTypetoParse,nSamplesToParse,dataFromChip):
-        """Group input binary data into chunks and call relevant parser functions"""
+        """Split the raw readout bytes into lpGBT frames and call relevant parser functions"""
 
-        bitsPerMeasurement = int(self.general.getSetting('word_length'))
-        dataChunks = [dataFromChip[i:i+bitsPerMeasurement] for i in range(0,len(dataFromChip),bitsPerMeasurement)]
         if dTypetoParse=='coluta':
-            for group in self.general.getSetting('data_channels'):
-                getattr(self,group+'BinaryDict').clear()
-                getattr(self,group+'DecimalDict').clear()
-            self.parseADC(dataChunks[:nSamplesToParse])
+            self.clearChannelData()
+            plan = self.getDecodePlan()
+            frames = frameWords(dataFromChip,plan.bytesPerFrame,plan.bytesPerWord)
+            self.parseADC(frames[:int(nSamplesToParse)])
         elif dTypetoParse=='histogram':
-            pass
-
-    def parseADC(self,binaryData):
-        """Parse and sort binary ADC data into data groups"""
-
-        # Now we parse both the COLUTA chip data at once
-        # Ask Jaro: Order of chips within one 256-bit word
-
-        # Get the names of the data sources, i.e., coluta1,coluta2
-        groups = self.general.getSetting('data_words')
-
-        # Total bits for one measurement of data source 
-        bitsPerSample = int(getattr(self,'rootGroup').settings['total_bits'])
-
-        # Group the binaryList into 32-bit long words
-        # Here I reverse the order to align them MSB->LSB. 
-        # Chances are you might not need to reverse ...
-        # dataSamples = [sample[i:i+bitsPerSample][::-1] for sample in binaryData for i in range(0,len(sample),bitsPerSample)]
-        dataSamples = [sample[i:i+bitsPerSample] for sample in binaryData for i in range(0,len(sample),bitsPerSample)]
-        # If the data need to be aligned, then uncomment this line
-        # dataSamples = barrelRoll(dataSamples,order='msblsb')
+            # The counts of every read are added to self.histogramSum until resetHistogram
+            self.histogramBins,self.histogramCounts = self.parseHistogram(nSamplesToParse,dataFromChip)
+            if len(self.histogramSum)!=self.histogramLayout.nBins:
+                self.resetHistogram()
+            isInRange = self.histogramBins < len(self.histogramSum)
+            numpy.add.at(self.histogramSum,self.histogramBins[isInRange],self.histogramCounts[isInRange])
+            self.histogramReads += 1
+
+    def clearChannelData(self):
+        """Empties the word, binary and decimal dictionaries before the next measurement"""
+        for group in self.general.getSetting('data_channels'):
+            getattr(self,group+'WordDict').clear()
+            getattr(self,group+'BinaryDict').clear()
+            getattr(self,group+'DecimalDict').clear()
+        self.sineFits.clear()
+
+    def resetHistogram(self):
+        """Empties the accumulated histogram"""
+        nBins = self.histogramLayout.nBins if hasattr(self,'histogramLayout') else 0
+        self.histogramSum = numpy.zeros(nBins,dtype=numpy.int64)
+        self.histogramBins = numpy.zeros(0,dtype=numpy.int64)
+        self.histogramCounts = numpy.zeros(0,dtype=numpy.int64)
+        self.histogramReads = 0
+
+    def parseADC(self,frames):
+        """Parse and sort ADC data into data groups. Frames is an (nFrames,8) array of lpGBT words"""
 
         # The data from the lpGBT is packaged into 8 32-bit words called "groups"
         # In testboard v1.1, we are sending data in groups 1, 2, and 3 (groups are 0-indexed)
         # Within each group there are two channels. The mapping of where each channel is
-        #  stored within each group is listed in dataConfig.cfg. This mapping can change
-        #  between testboard revisions, but should be the same within a given revision
-        for samples in zip(*[dataSamples[i::8] for i in range(8)]): # take all 8 lpGBT output words
-            samples = samples[1:4] # but only keeps words 1, 2, and 3; where are data is
-            # Verify that at least one sample isn't empty. May want to change all to any
-            if all( sample=='0'*bitsPerSample for sample in samples ): continue
-            # Loop over groups and their corresponding samples, and each channel within each group
-            for (sample,group) in zip(samples,groups):
-                # Get the parser settings
-                configDict = getattr(self,group).settings
-                # Get the names of the subgroups, e.g. frame, channel1
-                dataChips = configDict['data_chips']
-                dataChannels = configDict['data_channels']
-                # Get the bit positions for the data subgroups
-                lsbList = configDict['lsb']
-                msbList = configDict['msb']
-                # Take a 16-bit sample and store it in its proper channel list
-                for (chip,channel,lsb,msb) in zip(dataChips,dataChannels,lsbList,msbList):
-                    binaryDict = getattr(self,chip+'BinaryDict')
-                    decodedWord = sample[int(lsb):int(msb)]
-                    binaryDict[channel].append(decodedWord)
+        #  stored within each group is listed in dataConfig.cfg and compiled into the decode plan.
+        #  This mapping can change between testboard revisions, but should be the same within a 
+        #  given revision
+        plan = self.getDecodePlan()
+        dataFrames = dataWordFrames(frames,plan)
 
         # A problem with the alignment of the data coming from the COLUTAs to the lpGBT can arise
-        # The misalignment for each channel is (currently) determined via trial and error, then
-        #  stored in dataConfig.cfg as the "roll" attribute
-        # This loop rolls the data for each channel so that they are all properly aligned
-        for word in groups:
-            configDict = getattr(self,word).settings
-            dataChips = configDict['data_chips']
-            dataChannels = configDict['data_channels']
-            dataRoll = configDict['roll']
-            for (chip,channel,roll) in zip(dataChips,dataChannels,dataRoll):
-                binaryDict = getattr(self,chip+'BinaryDict')
-                decimalDict = getattr(self,chip+'DecimalDict')
-                binaryData = stringRoll(binaryDict[channel],int(roll))#[:-1]
-                decimalData = [self.convertColutaBits(chip,channel,decodedWord) for decodedWord in binaryData]
-                binaryDict[channel] = binaryData
-                decimalDict[channel] = decimalData
-
-    def parseHistogram(self,nSamplesToParse,binaryData):
-        channelSettings = getattr(self,'histogram').settings
-        dataChannels = channelSettings['data_channels']
-        lsbList,msbList = channelSettings['lsb'],channelSettings['msb']
-        nBytes = int(channelSettings['bytesPerBuffer'])
-
-        dataSamples = [''.join(binaryData[i:i+nBytes][::-1]) for i in range(0,len(binaryData),nBytes)]
-        uniqueDataSamples = list(set(dataSamples))
-        binarySamples = {channelName:[] for channelName in dataChannels}
-        decimalSamples = {channelName:[] for channelName in dataChannels}
-
-        for sample in uniqueDataSamples:
-            countMSB,valueMSB = int(msbList[0]),int(msbList[1])
-            countLSB,valueLSB = int(lsbList[0]),int(lsbList[1])
-            countDecoded = sample[countLSB:countMSB]
-            valueDecoded = sample[valueLSB:valueMSB]
-            if countDecoded=='' or valueDecoded=='': continue
-            countDecimal = int(countDecoded,2)
-            valueDecimal = int(valueDecoded,2)
-            # get rid of zero bin number
-            if countDecimal==0 or valueDecimal==0: continue
-            binarySamples['bin_count'].append(countDecoded)
-            binarySamples['bin_number'].append(valueDecoded)
-            decimalSamples['bin_count'].append(countDecimal)
-            decimalSamples['bin_number'].append(valueDecimal)
-        
-        return binarySamples,decimalSamples
-
-    def getWeightsArray(self,group,channel,overflow=0):
-        """gets the current ADC weights"""
+        # The misalignment for each channel is stored in dataConfig.cfg as the "roll" attribute,
+        #  or found by findAlignment when the frame channels show that it has changed
+        # Each channel is unpacked from its word, then rolled so that they are all properly aligned
+        alignedWords = {slot:alignWords(unpackSlot(dataFrames,slot),slot) for slot in plan.channels}
+        if self.isAutoAligned() and not self.isFrameAligned(alignedWords):
+            plan = self.findAlignment(dataFrames)
+            alignedWords = {slot:alignWords(unpackSlot(dataFrames,slot),slot) for slot in plan.channels}
+        # The weights are resolved once per channel, then all the samples are converted at once
+        for slot,decodedWords in alignedWords.items():
+            weights,overflowWeights = self.getChannelWeights(slot.chip,slot.channel)
+            decimalData = convertWords(decodedWords,weights,overflowWeights,slot.nBits)
+            getattr(self,slot.chip+'WordDict')[slot.channel] = decodedWords
+            getattr(self,slot.chip+'DecimalDict')[slot.channel] = decimalData.tolist()
+
+    def channelWeights(self):
+        """The calibration weights of each channel, as selected in the GUI, for decodeFrames.
+        Returns {(chip,channel):(weights,overflowWeights)} as lists"""
+        weights = {}
+        for slot in self.getDecodePlan().channels:
+            channelWeights,overflowWeights = self.getChannelWeights(slot.chip,slot.channel)
+            weights[(slot.chip,slot.channel)] = (channelWeights.tolist(),overflowWeights.tolist())
+        return weights
+
+    def streamData(self,blocks):
+        """Decodes the readout blocks one at a time with the current DecodePlan and weights,
+        yielding {(chip,channel):(words,decimals)} for each, see StreamDecoder. The rolls are
+        applied to the whole stream, so the samples at either end differ from parseData"""
+        return iterDecodedBlocks(blocks,self.getDecodePlan(),self.channelWeights())
+
+    def setDecodedData(self,decoded):
+        """Fills the word and decimal dictionaries from the output of decodeFrames, as parseData does"""
+        self.clearChannelData()
+        for (chip,channel),(words,decimals) in decoded.items():
+            getattr(self,chip+'WordDict')[channel] = words
+            getattr(self,chip+'DecimalDict')[channel] = decimals.tolist()
+
+    def parseHistogram(self,nWordsToParse,dataFromChip):
+        """Decodes the FPGA histogram buffer. Returns the bin numbers and counts of this read"""
+        return decodeHistogramWords(dataFromChip,nWordsToParse,self.getHistogramLayout())
+
+    def getArithmeticMode(self,group,channel):
+        """Name of the calibration selected for a channel. The mode box is read again only
+        after markConditionsDirty"""
+        if (group,channel) in self.arithmeticModes:
+            return self.arithmeticModes[(group,channel)]
+        if (group,channel) not in self.modeCache:
+            self.modeCache[(group,channel)] = self.readArithmeticMode(group,channel)
+        return self.modeCache[(group,channel)]
+
+    def readArithmeticMode(self,group,channel):
+        """Name of the calibration selected in the GUI for a channel, raw_data if it has no mode box"""
         ch = channel[:2]+channel[-1]
-
         try:
             boxName = group+ch+'ArithmeticModeBox'
             measurementMode = getattr(self.coluta,boxName).currentText()
-            calibration = (measurementMode.replace(' ','_')).lower()
-            if overflow == 1 and calibration=='normal_mode':
-                weights = [0,0,4095,0,0,0,0,0,0,0,0,0,0,0,0,0]
-            else:
-                weights = self.calibration.getSetting(calibration)
-
+            return (measurementMode.replace(' ','_')).lower()
         except Exception:
+            return 'raw_data'
+
+    def getCalibrationWeights(self,calibration,overflow=0):
+        """Weights of a calibration in [CALIBRATION]. In normal mode, overflowing samples read 4095"""
+        if overflow == 1 and calibration=='normal_mode':
+            weights = [0,0,4095,0,0,0,0,0,0,0,0,0,0,0,0,0]
+        elif calibration in self.calibration.settings:
+            weights = self.calibration.getSetting(calibration)
+        else:
             weights = self.calibration.getSetting('raw_data')
 
-        weightsArr = numpy.array(weights,dtype=int)
+        return numpy.array(weights,dtype=int)
+
+    def getWeightsArray(self,group,channel,overflow=0):
+        """gets the current ADC weights"""
+        return self.getCalibrationWeights(self.getArithmeticMode(group,channel),overflow)
 
-        return weightsArr
+    def getChannelWeights(self,group,channel):
+        """(weights,overflowWeights) of a channel. The mode box is read once, and the weights of each 
+        mode are only built again when [CALIBRATION] is read again"""
+        calibration = self.getArithmeticMode(group,channel)
+        if calibration not in self.weightsCache:
+            self.weightsCache[calibration] = (self.getCalibrationWeights(calibration),
+                                              self.getCalibrationWeights(calibration,overflow=1))
+        return self.weightsCache[calibration]
 
     def convertColutaBits(self,group,channel,binaryWord):
         """Convert COLUTA bits based on calibration mode selected"""
         wordArr = numpy.array(list(map(int,binaryWord)))
-        weightsArr = self.getWeightsArray(group,channel,overflow=wordArr[2])
-        decimalWord = numpy.sum(numpy.dot(wordArr,weightsArr))
+        weightsArr,overflowWeightsArr = self.getChannelWeights(group,channel)
+        decimalWord = numpy.dot(wordArr,overflowWeightsArr if wordArr[2] else weightsArr)
 
         return decimalWord
     
@@ -322,29 +743,183 @@ class dataParser():
 
         return '\n'.join([timestamp,configFile,commentBoxString])
 
-    def writeDataToFile(self,writeHDF5File=False,writeCSVFile=False,**kwargs):
-        """Write the data to its corresponding file"""        
+    def markConditionsDirty(self,*args):
+        """Slot of the GUI widgets the conditions are read from: collects them again on next use"""
+        self.conditionsDirty = True
+        self.modeCache.clear()
+
+    def getConditionsKey(self):
+        """The conditions the GUI and the instruments set as plain attributes, without a signal,
+        and the channels written, which the snapshot has one entry for each"""
+        coluta = self.coluta
+        try:
+            dc_offset = coluta.function_generator.getSetting('offset')
+        except Exception:
+            dc_offset = 0.0
+        dataChannels = tuple((group,tuple(getattr(self,group).getSetting('data_channels')))
+                             for group in self.general.getSetting('data_channels'))
+        return (coluta.runType,coluta.nSamples,coluta.awgFreq,coluta.pulseLength,dc_offset,dataChannels)
+
+    def getRunConditions(self):
+        """Returns the RunConditions of the current measurement. The GUI widgets are only read
+        again after one of them, the configuration, or the attributes of getConditionsKey changed.
+        To be called from the GUI thread, which then hands the snapshot to writeDataToFile"""
+        conditionsKey = self.getConditionsKey()
+        if self.conditionsDirty or conditionsKey!=self.conditionsKey:
+            channels,modes = {},{}
+            for group in self.general.getSetting('data_channels'):
+                for channel in getattr(self,group).getSetting('data_channels'):
+                    modes[(group,channel)] = self.readArithmeticMode(group,channel)
+                    if channel!='frame':
+                        channels[(group,channel)] = MappingProxyType(self.collectChannelConditions(group,channel))
+            self.runConditions = RunConditions(MappingProxyType(self.collectRunConditions()),
+                                               MappingProxyType(channels),MappingProxyType(modes))
+            self.conditionsKey = conditionsKey
+            self.conditionsDirty = False
+        return self.runConditions
+
+    def collectRunConditions(self):
+        """Conditions of the current measurement, saved with its data in the HDF5 file"""
+        coluta = self.coluta
+        dynamicRanges = ['2mA', '5mA', '10mA']
+        dynamicRangeIdx = coluta.controlLAUROCDynamicRangeBox.currentIndex()
+        try:
+            dc_offset = coluta.function_generator.getSetting('offset')
+        except Exception:
+            dc_offset = 0.0
+        ### TO SAVE NEW ATTRIBUTES FOR CUTS, PUT THEM HERE ###
+        conditions = dict(run_type = coluta.runType,
+                          laurocDynamicRange = dynamicRanges[dynamicRangeIdx],
+                          dc_offset = dc_offset,
+                          n_samples = coluta.nSamples,
+                          awg_freq = coluta.awgFreq,
+                          pulse_length = coluta.pulseLength,
+                          pulser_amp = int(coluta.controlSPIInstructionBox.toPlainText()),
+                          # shaper_constants = rcS1+'_'+crS1+'_'+rcS2,
+                          dac_vdc_lg = coluta.lauroc1slowcontrolch1dacVdcLGBox.toPlainText(),
+                          dac_vdc_hg = coluta.lauroc1slowcontrolch1dacVdcHGBox.toPlainText())
+        if coluta.runType == 'pulse': # probably not the best way to check this
+            conditions.update(self.pulseRun.settings)
+        elif coluta.runType == 'sine':
+            conditions.update(self.sineRun.settings)
+        elif coluta.runType == 'ramp':
+            conditions.update(self.rampRun.settings)
+        return conditions
+
+    def collectChannelConditions(self,group,channel):
+        """Gain and arithmetic mode of one channel for the current measurement"""
+        gainSelectBox = group+'ch'+channel[-1]+'GSBox'
+        manualSelectBox = group+'ch'+channel[-1]+'MSBox'
+        isGainSelect = getattr(self.coluta,gainSelectBox).isChecked()
+        isManualSelect = getattr(self.coluta,manualSelectBox).isChecked()
+        if not isManualSelect:
+            gainNum = 0 # AG
+        elif isManualSelect and not isGainSelect:
+            gainNum = 1 # 4x
+        elif isManualSelect and isGainSelect:
+            gainNum = 2 # 1x
+        runMode = getattr(self.coluta,group+channel[:2]+channel[-1]+'ArithmeticModeBox').currentText()
+        laurocGain = getattr(self,group).getSetting('laurocGain')[int(channel[-1])-1]
+        return dict(gain=gainNum,run_mode=runMode,laurocGain=laurocGain)
+
+    def getHDF5Filters(self):
+        """Compression options of the datasets, from hdf5_compression, _level and hdf5_shuffle.
+        Unless hdf5_shuffle is set, the legacy layout is not shuffled, as it has always been"""
+        compression = self.general.settings.get('hdf5_compression','gzip').lower()
+        shuffle = self.general.settings.get('hdf5_shuffle','').strip()
+        if not shuffle:
+            shuffle = '0' if self.general.settings.get('hdf5_layout','legacy')=='legacy' else '1'
+        filters = dict(shuffle=shuffle=='1')
+        if compression=='gzip':
+            filters.update(compression='gzip',compression_opts=int(self.general.settings.get('hdf5_compression_level',4)))
+        elif compression=='lzf':
+            filters.update(compression='lzf')
+        elif compression!='none':
+            self.coluta.showError('DATA PARSER: Unknown hdf5_compression {}'.format(compression))
+        if not filters['shuffle']: del filters['shuffle']
+        return filters
+
+    def getRunWriter(self,hdf5FilePath):
+        """Returns the writer of the run file, opening it if the file changed"""
+        if self.runWriter is not None and self.runWriter.filePath != hdf5FilePath:
+            self.runWriter.close()
+            self.runWriter = None
+        if self.runWriter is None:
+            self.runWriter = RunWriter(hdf5FilePath,
+                                       flushEvery=int(self.general.settings.get('hdf5_flush_every',10)),
+                                       filters=self.getHDF5Filters(),
+                                       fileAttributes=dict(n_adcs=2,
+                                                           adc_freq=self.coluta.frequency,
+                                                           serial_number=str(self.coluta.serial_number)))
+        return self.runWriter
+
+    def closeRunFile(self):
+        """Flushes and closes the HDF5 file and the raw archive of the run, e.g. when the GUI stops"""
+        if self.runWriter is not None:
+            self.runWriter.close()
+            self.runWriter = None
+        if self.rawArchive is not None:
+            self.rawArchive.close()
+            self.rawArchive = None
+
+    def archiveCapture(self,dataFromChip,conditions=None):
+        """Appends the readout of the current measurement to the raw archive of the run, if
+        raw_archive is set, with the conditions replayArchive.py needs to write it again"""
+        if self.general.settings.get('raw_archive','0').strip()!='1':
+            return
+        basePath = os.path.join(self.outputDirectory,'Run_'+str(self.runNumber).zfill(4)+'_Raw')
+        if self.rawArchive is not None and self.rawArchive.basePath != basePath:
+            self.rawArchive.close()
+            self.rawArchive = None
+        if self.rawArchive is None:
+            self.rawArchive = archiveMod.ArchiveWriter(basePath)
+        self.rawArchive.saveConfig(self.configHash,self.configFile)
+        # The rolls of the plan include those found by findAlignment, which the archived config lacks
+        rolls = {slot.chip+'/'+slot.channel:slot.roll for slot in self.getDecodePlan().channels}
+        if conditions is None:
+            conditions = self.getRunConditions()
+        record = dict(run=dict(conditions.run),rolls=rolls,
+                      channels={group+'/'+channel:dict(values) for (group,channel),values in conditions.channels.items()},
+                      modes={group+'/'+channel:mode for (group,channel),mode in conditions.modes.items()},
+                      board=dict(frequency=self.coluta.frequency,serial_number=str(self.coluta.serial_number),
+                                 debug=bool(self.coluta.debug)))
+        self.rawArchive.append(dataFromChip,self.coluta.nSamples,self.coluta.measurementTime,self.configHash,record)
+
+    def writeDataToFile(self,writeHDF5File=False,writeCSVFile=False,conditions=None,**kwargs):
+        """Write the data to its corresponding file, with the RunConditions given, e.g. the
+        snapshot taken by the GUI for the measurement or those recorded in the raw archive"""        
 
         # commentString = self.makeComments(**kwargs)
         commentString = " "
-        dynamicRanges = ['2mA', '5mA', '10mA']
+        hdf5Layout = self.general.settings.get('hdf5_layout','legacy')
+        hdf5Storage = self.general.settings.get('hdf5_storage','bits')
+        hdf5Decoded = self.general.settings.get('hdf5_decoded','0').strip()=='1'
+        hdf5_outFile = 'Run_'+str(self.runNumber).zfill(4)+'_Output.hdf5'
+        hdf5FilePath = os.path.join(self.outputDirectory,hdf5_outFile)
+        # Data of every channel of this measurement, appended to the run file at once
+        channelData = {}
+        if writeHDF5File:
+            if conditions is None:
+                conditions = self.getRunConditions()
+            runConditions = dict(conditions.run)
+            if self.coluta.debug:
+                runConditions['timestamp'] = self.coluta.measurementTime
 
         # Create filenames based on the data type 
         for group in self.general.getSetting('data_channels'):
             for channel in getattr(self,group).getSetting('data_channels'):
 
                 fileNumber = getattr(self,group+channel+'_fileNumber')
+                wordData = getattr(self,group+'WordDict')
                 binaryData = getattr(self,group+'BinaryDict')
                 decimalData = getattr(self,group+'DecimalDict')
 
                 decimal_outFile = group.upper()+'_'+channel.upper()+'_'+str(fileNumber).zfill(4)+'_Decimal.txt'
                 binary_outFile = group.upper()+'_'+channel.upper()+'_'+str(fileNumber).zfill(4)+'_Binary.txt'
-                hdf5_outFile = 'Run_'+str(self.runNumber).zfill(4)+'_Output.hdf5'
                 csv_outFile = group.upper()+'_'+channel.upper()+'_'+str(fileNumber).zfill(4)+'_Binary.csv'
                 
                 binaryFilePath  = os.path.join(self.outputDirectory,binary_outFile)
                 decimalFilePath = os.path.join(self.outputDirectory,decimal_outFile)
-                hdf5FilePath    = os.path.join(self.outputDirectory,hdf5_outFile)
                 csvFilePath     = os.path.join(self.outputDirectory,csv_outFile)
 
                 if self.coluta.debug:
@@ -374,119 +949,340 @@ class dataParser():
                     continue
 
                 if writeHDF5File:
-                    dynamicRangeIdx = self.coluta.controlLAUROCDynamicRangeBox.currentIndex()
-
-                    gainSelectBox = group+'ch'+channel[-1]+'GSBox'
-                    manualSelectBox = group+'ch'+channel[-1]+'MSBox'
-                    isGainSelect = getattr(self.coluta,gainSelectBox).isChecked()
-                    isManualSelect = getattr(self.coluta,manualSelectBox).isChecked()
-                    if not isManualSelect:
-                        gain = 'AG'
-                        gainNum = 0
-                    elif isManualSelect and not isGainSelect:
-                        gain = '4x'
-                        gainNum = 1
-                    elif isManualSelect and isGainSelect:
-                        gain = '1x'
-                        gainNum = 2
-
-                    runMode = getattr(self.coluta,group+channel[:2]+channel[-1]+'ArithmeticModeBox').currentText()
+                    # A channel added to data_channels after the snapshot was taken is read now
+                    if (group,channel) in conditions.channels:
+                        channelConditions = dict(conditions.channels[(group,channel)])
+                    else:
+                        channelConditions = self.collectChannelConditions(group,channel)
+                    words = wordData.get(channel,numpy.zeros(0,dtype=numpy.uint16))
 
                     # gain bit is now bit 4, not bit 2
-                    if runMode == 'Raw Data':
-                        decisionBits = numpy.array([int(sample[1]) for sample in binaryData[channel]]).astype(bool)
+                    if channelConditions['run_mode'] == 'Raw Data':
+                        decisionBits = ((words>>14)&1).astype(bool)
                     else: # only decision bit if runMode is normal_mode
-                        decisionBits = numpy.array([int(sample[3]) for sample in binaryData[channel]]).astype(bool)
-
-                    rawDataList = []
-                    for sampleWord in binaryData[channel]:
-                        tmpList = []
-                        for sampleBit in sampleWord:
-                            tmpList.append(int(sampleBit))
-                        rawDataList.append(tmpList)
-                    rawDataBits = numpy.array(rawDataList)
-
-                    pulser_amp = int(self.coluta.controlSPIInstructionBox.toPlainText())
-                    ### TO SAVE NEW ATTRIBUTES FOR CUTS, PUT THEM HERE, AND ONCE MORE LATER ###
-                    rcS1 = self.coluta.lauroc1slowcontrolrcHGs1Box.toPlainText()
-                    crS1 = self.coluta.lauroc1slowcontrolcrHGs1Box.toPlainText()
-                    rcS2 = self.coluta.lauroc1slowcontrolrcHGs2Box.toPlainText()
-                    hg_lg_c2 = self.coluta.lauroc1slowcontrolch1C2Box.toPlainText()
-                    ONg20 = self.coluta.lauroc1slowcontrolbiasAmpliG20ONBox.isChecked()
-                    SWIBOg20 = self.coluta.lauroc1slowcontrolbiasAmpliG20swiboBox.isChecked()
-                    DACIBIg20 = self.coluta.lauroc1slowcontrolbiasAmpliG20dacIBIBox.toPlainText()
-                    DAC_VDC_LG = self.coluta.lauroc1slowcontrolch1dacVdcLGBox.toPlainText() 
-                    DAC_VDC_HG = self.coluta.lauroc1slowcontrolch1dacVdcHGBox.toPlainText()
-
-                    with h5py.File(hdf5FilePath) as outFile:
-                        measurement_group = outFile.require_group('Measurement_'+str(fileNumber)) # create group if it doesn't already exist
-                        adc_subgroup = measurement_group.require_group(group)
-                        channel_subgroup = adc_subgroup.create_group(channel)
-                        channel_subgroup.create_dataset('raw_data',data=rawDataBits,dtype='int8',compression='gzip')
-                        if self.coluta.debug:
-                            channel_subgroup.create_dataset('samples',data=decimalData[channel])
-                            channel_subgroup.create_dataset('bits',data=decisionBits) # save decision bits as booleans
-                        if 'n_adcs' not in outFile.attrs:
-                            self.setHDF5Attributes( outFile, # will make all these values correct/editable when pulser is implemented
-                                                    n_adcs=2,
-                                                    adc_freq=self.coluta.frequency,
-                                                    serial_number = self.coluta.serial_number)
-                                                    # chip_number=self.coluta.boardConfigFileBox.currentText(),
-                                                    # config_file=self.coluta.configFileNameBox.toPlainText()
-                        # Save the SAR weights for each channel once per run 
-                        if f'{group}_{channel}_SAR_weights' not in outFile.attrs:
-                            self.setHDF5Attributes( outFile, 
-                                                    **{f'{group}_{channel}_SAR_weights': self.getWeightsArray(group,channel)})
-
-                        if 'run_type' not in measurement_group.attrs:
-                            try:
-                                dc_offset=self.coluta.function_generator.getSetting('offset')
-                            except Exception:
-                                dc_offset = 0.0
-                            self.setHDF5Attributes( measurement_group,
-                                                    run_type=self.coluta.runType,
-                                                    laurocDynamicRange=dynamicRanges[dynamicRangeIdx],
-                                                    dc_offset=dc_offset,
-                                                    n_samples = self.coluta.nSamples,
-                                                    awg_freq = self.coluta.awgFreq,
-                                                    pulse_length = self.coluta.pulseLength,
-                                                    pulser_amp = pulser_amp,
-                                                    ### ALSO PUT NEW ATTRIBUTES HERE TO SAVE THEM ###
-                                                    # shaper_constants = rcS1+'_'+crS1+'_'+rcS2,
-                                                    # hg_lg_c2 = hg_lg_c2,
-                                                    # on_g20 = ONg20,
-                                                    # sw_ibo_g20 = SWIBOg20,
-                                                    # dac_ibi_g20 = DACIBIg20,
-                                                    dac_vdc_lg = DAC_VDC_LG,
-                                                    dac_vdc_hg = DAC_VDC_HG)
-                            if self.coluta.debug:
-                                self.setHDF5Attributes(measurement_group, timestamp=self.coluta.measurementTime)
-                            if self.coluta.runType == 'pulse': # probably not the best way to check this
-                                attributes = self.pulseRun.settings
-                            elif self.coluta.runType == 'sine':
-                                attributes = self.sineRun.settings
-                            elif self.coluta.runType == 'ramp':
-                                attributes = self.rampRun.settings
-                            elif self.coluta.runType == 'pedestal' or self.coluta.runType == 'onboard':
-                                attributes = None
-                            if attributes: self.setHDF5Attributes(measurement_group, **attributes)
-
-                        if 'channels' not in adc_subgroup.attrs:
-                            self.setHDF5Attributes( adc_subgroup,
-                                                    channels = getattr(self,group).getSetting('data_channels'))
-
-                        laurocGain = getattr(self,group).getSetting('laurocGain')[int(channel[-1])-1]
-                        self.setHDF5Attributes( channel_subgroup,
-                                                gain=gainNum,
-                                                run_mode = runMode,
-                                                laurocGain=laurocGain)
-                        self.setHDF5Attributes( outFile,
-                                                n_measurements = fileNumber+1)
-
+                        decisionBits = ((words>>12)&1).astype(bool)
+
+                    # packed: one uint16 per sample, bits: one int8 per bit (sample,16)
+                    datasets = {}
+                    if hdf5Storage == 'bits':
+                        datasets['raw_data'] = unpackRawData(words)
+                    else:
+                        datasets['raw_data'] = words
+                    if self.coluta.debug or hdf5Decoded:
+                        datasets['samples'] = numpy.array(decimalData[channel],dtype=numpy.int32)
+                    if self.coluta.debug:
+                        datasets['bits'] = decisionBits # save decision bits as booleans
+
+                    if hdf5Layout == 'legacy':
+                        self.writeLegacyHDF5(hdf5FilePath,fileNumber,group,channel,datasets,channelConditions,runConditions)
+                    else:
+                        channelData[(group,channel)] = (datasets,channelConditions)
 
                 fileNumber += 1
                 setattr(self,group+channel+'_fileNumber',fileNumber)
 
+        if channelData:
+            runWriter = self.getRunWriter(hdf5FilePath)
+            for (group,channel) in channelData:
+                # Save the SAR weights for each channel once per run 
+                weights,overflowWeights = self.getChannelWeights(group,channel)
+                runWriter.setFileAttribute(f'{group}_{channel}_SAR_weights',weights)
+                runWriter.setFileAttribute(f'{group}_{channel}_SAR_overflow_weights',overflowWeights)
+            runWriter.appendMeasurement(runConditions,channelData)
+            if getattr(self.coluta,'saveQA',False) and runConditions.get('run_type')=='sine':
+                self.writeQA(runWriter,list(channelData))
+            if getattr(self.coluta,'savePulses',False) and runConditions.get('run_type') in ('pulse','onboard'):
+                self.writePulses(runWriter,list(channelData),runConditions)
+
+    def writePulses(self,runWriter,channels,runConditions):
+        """Appends the pulses folded from the channels of the measurement to the run file"""
+        samples = self.getChannelSamples(channels)
+        if samples is None:
+            return
+        period = pulseMod.pulsePeriod(float(runConditions['pulse_length']),self.coluta.frequency)
+        try:
+            folded = pulseMod.foldPulses(samples,period,getattr(self.coluta,'pulseSettings',pulseMod.defaultSettings))
+        except ValueError as error:
+            print(error)
+            return
+        runWriter.appendPulses(channels,folded,period)
+
+    def writeQA(self,runWriter,channels):
+        """Appends the QA of the channels of the measurement to the run file, from one rfft"""
+        samples = self.getChannelSamples(channels)
+        if samples is None:
+            return
+        table = qaMod.analyzeBatch(samples,self.coluta.frequency,
+                                   getattr(self.coluta,'qaSettings',qaMod.defaultSettings))
+        sineFit = None
+        if getattr(self.coluta,'doSineFit',False):
+            sineFit = qaMod.sineFit(samples,self.coluta.frequency,self.coluta.sineFitIterations)
+            self.sineFits.update(zip(channels,sineFit))
+        runWriter.appendQA([group+'/'+channel for group,channel in channels],table,sineFit)
+
+    def getSineFit(self,group,channel):
+        """Sine fit (qaMod.sineFit) of a channel of the last measurement, fitted once per
+        measurement, e.g. by writeQA. None if the channel is empty"""
+        if (group,channel) not in self.sineFits:
+            samples = self.getChannelSamples([(group,channel)])
+            if samples is None:
+                return None
+            self.sineFits[(group,channel)] = qaMod.sineFit(samples[0],self.coluta.frequency,self.coluta.sineFitIterations)
+        return self.sineFits[(group,channel)]
+
+    def dataChannels(self):
+        """(coluta,channel) of every channel read, but the frame channels"""
+        return [(group,channel) for group in self.general.getSetting('data_channels')
+                for channel in getattr(self,group).getSetting('data_channels') if channel!='frame']
+
+    def getChannelSamples(self,channels):
+        """ADC counts of the last measurement of the (coluta,channel) given, as a (channel,sample)
+        array, None if a channel is empty or their numbers of samples differ"""
+        samples = [getattr(self,group+'DecimalDict')[channel] for group,channel in channels]
+        if not samples or len(set(map(len,samples)))!=1 or len(samples[0])==0:
+            return None
+        return numpy.array(samples)
+
+    def writeSpectrumToFile(self,spectrumAverage):
+        """Appends the spectra averaged over a repeat run (qaMod.SpectrumAverage) to the run file"""
+        hdf5_outFile = 'Run_'+str(self.runNumber).zfill(4)+'_Output.hdf5'
+        runWriter = self.getRunWriter(os.path.join(self.outputDirectory,hdf5_outFile))
+        conditions = dict(self.getRunConditions().run)
+        # The number of samples of the spectra, which sets their bins
+        conditions.update(n_captures=spectrumAverage.nCaptures,n_samples=spectrumAverage.plan.nSamples,
+                          window=spectrumAverage.settings.window)
+        runWriter.appendSpectrum(spectrumAverage.channels,spectrumAverage.meanPower,spectrumAverage.maxPower,conditions)
+
+    def writeHistogramToFile(self):
+        """Appends the accumulated histogram to the run file, with the number of reads summed in it"""
+        hdf5_outFile = 'Run_'+str(self.runNumber).zfill(4)+'_Output.hdf5'
+        runWriter = self.getRunWriter(os.path.join(self.outputDirectory,hdf5_outFile))
+        runWriter.appendHistogram(self.histogramSum,dict(n_reads=self.histogramReads,**self.getRunConditions().run))
+
+    def writeLegacyHDF5(self,hdf5FilePath,fileNumber,group,channel,datasets,channelConditions,runConditions):
+        """Writes one channel of one measurement in its own Measurement_# group (hdf5_layout: legacy)"""
+        filters = self.getHDF5Filters()
+        with h5py.File(hdf5FilePath,'a') as outFile:
+            measurement_group = outFile.require_group('Measurement_'+str(fileNumber)) # create group if it doesn't already exist
+            adc_subgroup = measurement_group.require_group(group)
+            channel_subgroup = adc_subgroup.create_group(channel)
+            for name,data in datasets.items():
+                dataset = channel_subgroup.create_dataset(name,data=data,**(filters if len(data) else {}))
+                if name=='raw_data' and data.dtype==numpy.uint16:
+                    dataset.attrs['packing'] = 'uint16'
+            if 'n_adcs' not in outFile.attrs:
+                self.setHDF5Attributes( outFile, # will make all these values correct/editable when pulser is implemented
+                                        n_adcs=2,
+                                        adc_freq=self.coluta.frequency,
+                                        serial_number = self.coluta.serial_number)
+            # Save the SAR weights for each channel once per run 
+            if f'{group}_{channel}_SAR_weights' not in outFile.attrs:
+                weights,overflowWeights = self.getChannelWeights(group,channel)
+                self.setHDF5Attributes( outFile, 
+                                        **{f'{group}_{channel}_SAR_weights': weights,
+                                           f'{group}_{channel}_SAR_overflow_weights': overflowWeights})
+
+            if 'run_type' not in measurement_group.attrs:
+                self.setHDF5Attributes(measurement_group,**runConditions)
+
+            if 'channels' not in adc_subgroup.attrs:
+                self.setHDF5Attributes( adc_subgroup,
+                                        channels = getattr(self,group).getSetting('data_channels'))
+
+            self.setHDF5Attributes(channel_subgroup,**channelConditions)
+            self.setHDF5Attributes( outFile,
+                                    n_measurements = fileNumber+1)
+
+
+class RunWriter:
+    """Keeps the HDF5 file of a run open and appends every measurement to it.
+
+    Layout (hdf5_layout: run):
+        /                     attributes n_adcs, adc_freq, serial_number, n_measurements,
+                              <coluta>_<channel>_SAR_weights, <coluta>_<channel>_SAR_overflow_weights
+        /measurements/<name>  one entry per measurement for each run condition
+        /<coluta>/<channel>/raw_data    (measurement, sample), resizable and chunked with
+                                        one measurement per chunk. (measurement, sample, bit)
+                                        int8, or packed uint16 samples for hdf5_storage: packed
+        /<coluta>/<channel>/samples     decoded ADC counts, if saved
+        /<coluta>/<channel>/n_samples   number of valid samples of each measurement
+        /<coluta>/<channel>/<name>      one entry per measurement for each channel condition
+        /histogram/counts     (histogram, bin) int64 counts of the FPGA histograms
+        /histogram/<name>     one entry per histogram for n_reads and each run condition
+        /qa/table             (row, channel) qaMod.qaDtype metrics of the sine measurements,
+                              attribute channels, the <coluta>/<channel> of each column
+        /qa/measurement       measurement of each row
+        /qa/mean, /qa/std     (channel) qaDtype mean and standard deviation of the table,
+                              written when the writer is closed
+        /qa/sine_fit          (row, channel) qaMod.sineFitDtype sine fits, with sine_fit
+        /qa/sine_fit_mean, /qa/sine_fit_std    their mean and standard deviation
+        /spectrum/<coluta>/<channel>/mean      (spectrum, bin) float32 mean of the bin powers
+                                               |rfft|^2 of the captures of a repeat run
+        /spectrum/<coluta>/<channel>/max_hold  their maximum, with max_hold
+        /spectrum/<name>      one entry per spectrum for n_captures, n_samples and each run condition
+        /pulses/<coluta>/<channel>/mean_pulse  (row, sample) float32 average folded pulse of the
+                                               pulse measurements, see pulseMod.foldPulses
+        /pulses/<coluta>/<channel>/peak, pedestal, peak_time   (row, pulse) float32 of each pulse
+        /pulses/<coluta>/<channel>/<name>      one entry per row for measurement, period,
+                                               offset and n_pulses
+
+    Measurements shorter than the longest one are padded with zeros. A condition missing
+    from a measurement is left empty (0, or '' for strings). The file is flushed every
+    flushEvery measurements and when the writer is closed.
+    """
+    def __init__(self,filePath,flushEvery=10,fileAttributes=None,filters=None):
+        self.filePath = filePath
+        self.flushEvery = flushEvery
+        self.filters = filters if filters is not None else dict(compression='gzip')
+        self.outFile = h5py.File(filePath,'a')
+        self.nMeasurements = int(self.outFile.attrs.get('n_measurements',0))
+        self.nUnflushed = 0
+        for key,value in (fileAttributes or {}).items():
+            self.setFileAttribute(key,value)
+
+    def setFileAttribute(self,key,value):
+        """Attach a file attribute, once per run"""
+        if key not in self.outFile.attrs:
+            if isinstance(value,str):
+                self.outFile.attrs.create(key,value,dtype=h5py.special_dtype(vlen=str))
+            else:
+                self.outFile.attrs.create(key,value)
+
+    def appendMeasurement(self,conditions,channelData):
+        """Append one measurement
+
+        conditions: {name: value} of the run conditions
+        channelData: {(coluta,channel): ({name: array}, {name: value})}, the datasets and
+                     the conditions of each channel
+        """
+        index = self.nMeasurements
+        measurementGroup = self.outFile.require_group('measurements')
+        self.appendColumns(measurementGroup,index,conditions)
+        for (group,channel),(datasets,channelConditions) in channelData.items():
+            channelGroup = self.outFile.require_group(group).require_group(channel)
+            nSamples = 0
+            for name,data in datasets.items():
+                self.appendArray(channelGroup,name,index,numpy.asarray(data))
+                nSamples = max(nSamples,len(data))
+            self.appendColumns(channelGroup,index,dict(n_samples=nSamples,**channelConditions))
+
+        self.nMeasurements += 1
+        self.outFile.attrs['n_measurements'] = self.nMeasurements
+        self.nUnflushed += 1
+        if self.nUnflushed >= self.flushEvery:
+            self.flush()
+
+    def appendHistogram(self,counts,conditions):
+        """Append one accumulated histogram and its conditions"""
+        histogramGroup = self.outFile.require_group('histogram')
+        index = len(histogramGroup['counts']) if 'counts' in histogramGroup else 0
+        self.appendArray(histogramGroup,'counts',index,numpy.asarray(counts))
+        self.appendColumns(histogramGroup,index,conditions)
+        self.flush()
+
+    def appendSpectrum(self,channels,meanPower,maxPower,conditions):
+        """Append the averaged spectrum of each channel of a repeat run and its conditions"""
+        spectrumGroup = self.outFile.require_group('spectrum')
+        index = int(spectrumGroup.attrs.get('n_spectra',0))
+        for i,(group,channel) in enumerate(channels):
+            channelGroup = spectrumGroup.require_group(group).require_group(channel)
+            self.appendArray(channelGroup,'mean',index,meanPower[i].astype(numpy.float32))
+            if maxPower is not None:
+                self.appendArray(channelGroup,'max_hold',index,maxPower[i].astype(numpy.float32))
+        self.appendColumns(spectrumGroup,index,conditions)
+        spectrumGroup.attrs['n_spectra'] = index+1
+        self.flush()
+
+    def appendPulses(self,channels,folded,period):
+        """Append the pulses folded from the channels of the last measurement (pulseMod.FoldedPulses)"""
+        pulseGroup = self.outFile.require_group('pulses')
+        for i,(group,channel) in enumerate(channels):
+            channelGroup = pulseGroup.require_group(group).require_group(channel)
+            index = len(channelGroup['measurement']) if 'measurement' in channelGroup else 0
+            for name,data in (('mean_pulse',folded.meanPulse),('peak',folded.peak),
+                              ('pedestal',folded.pedestal),('peak_time',folded.peakTime)):
+                self.appendArray(channelGroup,name,index,data[i].astype(numpy.float32))
+            self.appendColumns(channelGroup,index,dict(measurement=self.nMeasurements-1,period=period,
+                                                       offset=int(folded.offset[i]),n_pulses=folded.peak.shape[-1]))
+
+    def appendQA(self,channels,table,sineFit=None):
+        """Append the QA row (qaMod.analyzeBatch) of the channels of the last measurement,
+        and the row of their sine fits (qaMod.sineFit)"""
+        qaGroup = self.outFile.require_group('qa')
+        if 'measurement' not in qaGroup:
+            qaGroup.create_dataset('measurement',shape=(0,),maxshape=(None,),dtype=numpy.int64,chunks=(256,))
+        index = len(qaGroup['measurement'])
+        qaGroup['measurement'].resize((index+1,))
+        qaGroup['measurement'][index] = self.nMeasurements-1
+        for name,rows in (('table',table),('sine_fit',sineFit)):
+            if rows is None:
+                continue
+            if name not in qaGroup:
+                qaGroup.create_dataset(name,shape=(0,len(channels)),maxshape=(None,len(channels)),
+                                       dtype=rows.dtype,chunks=(256,len(channels)),**self.filters)
+                qaGroup[name].attrs.create('channels',channels,dtype=h5py.special_dtype(vlen=str))
+            qaGroup[name].resize((index+1,len(channels)))
+            qaGroup[name][index] = rows
+
+    def summarizeQA(self):
+        """Mean and standard deviation over the measurements of each channel of the QA tables"""
+        if 'qa' not in self.outFile:
+            return
+        qaGroup = self.outFile['qa']
+        for tableName,prefix in (('table',''),('sine_fit','sine_fit_')):
+            if tableName not in qaGroup:
+                continue
+            for name,summary in zip(['mean','std'],qaMod.summarizeQA(qaGroup[tableName][()])):
+                if prefix+name in qaGroup:
+                    del qaGroup[prefix+name]
+                qaGroup.create_dataset(prefix+name,data=summary)
+
+    def appendColumns(self,group,index,values):
+        """Write row index of the 1-D datasets of group, padding every column to index+1"""
+        for name,value in values.items():
+            if isinstance(value,(list,tuple)):
+                value = ','.join(map(str,value))
+            if name not in group:
+                if isinstance(value,str):
+                    dtype = h5py.special_dtype(vlen=str)
+                elif isinstance(value,(bool,numpy.bool_)):
+                    dtype = bool
+                elif isinstance(value,(int,numpy.integer)):
+                    dtype = numpy.int64
+                else:
+                    dtype = numpy.float64
+                group.create_dataset(name,shape=(index,),maxshape=(None,),dtype=dtype,chunks=(256,))
+            column = group[name]
+            column.resize((index+1,))
+            column[index] = value
+        for name,column in group.items():
+            if isinstance(column,h5py.Dataset) and column.ndim==1 and len(column)<index+1:
+                column.resize((index+1,))
+
+    def appendArray(self,group,name,index,data):
+        """Write data as row index of a (measurement,sample,...) dataset"""
+        if name not in group:
+            group.create_dataset(name,shape=(index,)+data.shape,maxshape=(None,)*(data.ndim+1),
+                                 dtype=data.dtype,chunks=(1,)+tuple(max(n,1) for n in data.shape),
+                                 **self.filters)
+            if name=='raw_data' and data.dtype==numpy.uint16:
+                group[name].attrs['packing'] = 'uint16'
+        dataset = group[name]
+        nSamples = max(dataset.shape[1],len(data))
+        dataset.resize((index+1,nSamples)+dataset.shape[2:])
+        dataset[index,:len(data)] = data
+
+    def flush(self):
+        if self.outFile:
+            self.outFile.flush()
+        self.nUnflushed = 0
+
+    def close(self):
+        if self.outFile:
+            self.summarizeQA()
+            self.flush()
+            self.outFile.close()
+
 
 class Setting:
     def __init__(self,configDict):
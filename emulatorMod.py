@@ -0,0 +1,406 @@
+"""Software stand-in for the test board, used in place of the serial port.
+
+The emulator speaks the same protocol as the FPGA: it decodes the status words
+sent to FIFO B, collects the payloads written to FIFO A, keeps the control
+registers at addresses 1-6, answers control-register and I2C reads, and returns
+synthetic lpGBT frames for data reads. Reads are throttled to a USB byte rate,
+so the GUI and scripted acquisitions can be run and timed without a board.
+
+name: emulatorMod.py
+date: 17 October 2026
+"""
+
+import configparser
+import os
+import time
+import numpy
+
+class TestBoardEmulator:
+    """Emulates the FPGA and chips behind the USB port.
+
+    Implements the subset of the pySerial interface used by serialMod: write(),
+    readinto(), read(), in_waiting, flush(), reset_input_buffer(),
+    reset_output_buffer(), isOpen() and close(), and a settable timeout.
+
+    Status words are six bytes, [254,status1,counterLo,counterHi,status4,255].
+    Operations start on the rising edge of their bit in status4, as on the board:
+        startFifoAOperation: operation 1 routes the following payload bytes to the
+                             register at chipAddress, operation 2 queues a read
+                             of counter words from that address
+        startControlOperation: with address 0, runs the I2C command in register 0
+        startMeasurement: takes a new measurement
+        softwareReset, colutaReset: clear the FPGA and COLUTA state
+    """
+    isEmulator = True
+
+    def __init__(self,configFile,dataConfigFile,timeout=None):
+        self.configFile = configFile
+        self.dataConfigFile = dataConfigFile
+        self.timeout = timeout
+        self.readSettings()
+        self.readDataLayout()
+        self.rng = numpy.random.default_rng(self.seed)
+        self.isPortOpen = True
+        self.reset()
+
+    def readSettings(self):
+        """Reads the [Emulator] section of the emulator configuration file"""
+        config = configparser.ConfigParser(inline_comment_prefixes=('#',))
+        config.optionxform=str
+        config.read(self.configFile)
+        section = config['Emulator'] if config.has_section('Emulator') else config['DEFAULT']
+        self.usbRate = section.getfloat('usb_rate',fallback=8e6) # bytes/s
+        self.usbLatency = section.getfloat('usb_latency',fallback=0.001) # s per transfer
+        self.signal = section.get('signal',fallback='sine')
+        self.calibration = section.get('calibration',fallback='normal_mode')
+        self.samplingFrequency = section.getfloat('sampling_frequency',fallback=40.) # MHz
+        self.sineFrequency = section.getfloat('sine_frequency',fallback=1.) # MHz
+        self.amplitude = section.getfloat('amplitude',fallback=1800.) # ADC counts
+        self.offset = section.getfloat('offset',fallback=2048.) # ADC counts
+        self.noise = section.getfloat('noise',fallback=2.) # ADC counts
+        self.pulsePeriod = section.getint('pulse_period',fallback=64) # samples
+        self.pulseShaping = section.getfloat('pulse_shaping',fallback=2.) # samples
+        self.framePattern = int(section.get('frame_pattern',fallback='0xFF00'),0)
+        self.linkReady = section.getboolean('link_ready',fallback=True)
+        self.histogramSamples = section.getint('histogram_samples',fallback=65536)
+        seed = section.get('seed',fallback='')
+        self.seed = int(seed) if seed else None
+
+    def readDataLayout(self):
+        """Reads the frame layout, the channel rolls and the SAR weights from dataConfig.cfg
+
+        The frames are built to be the inverse of what dataParser does with them: every
+        channel is misaligned by the opposite of its configured roll and is encoded with
+        the weights of the configured calibration mode.
+        """
+        config = configparser.ConfigParser()
+        config.optionxform=str
+        if not os.path.isfile(self.dataConfigFile):
+            raise FileNotFoundError('EMULATOR: data configuration {} not found'.format(self.dataConfigFile))
+        config.read(self.dataConfigFile)
+        categories = dict(config.items('Categories'))
+        toList = lambda value: [item.strip() for item in value.split(',')]
+
+        self.bytesPerFrame = config.getint(categories['general'],'word_length')//8
+        self.channels = [] # (word index, chip, channel, roll, lsb, msb, word length)
+        for wordIndex,word in enumerate(toList(config.get(categories['general'],'data_words'))):
+            section = config[categories[word]]
+            wordLength = section.getint('total_bits')
+            for chip,channel,roll,lsb,msb in zip(toList(section['data_chips']),
+                                                 toList(section['data_channels']),
+                                                 toList(section['roll']),
+                                                 toList(section['lsb']),
+                                                 toList(section['msb'])):
+                self.channels.append((wordIndex+1,chip,channel,int(roll),int(lsb),int(msb),wordLength))
+
+        weights = toList(config.get(categories['calibration'],self.calibration))
+        self.weights = numpy.array([int(weight) for weight in weights])
+
+        # FPGA histogram buffer: address, word length and (shift,width) of the bin number and count
+        self.histogramAddress = None
+        if 'histogram' in categories:
+            section = config[categories['histogram']]
+            address = section.get('fpga_address',fallback='').strip()
+            self.histogramAddress = int(address,0) if address else None
+            self.histogramBits = section.getint('total_bits')
+            self.histogramFields = {name:(self.histogramBits-int(msb),int(msb)-int(lsb))
+                                    for name,lsb,msb in zip(toList(section['data_channels']),
+                                                            toList(section['lsb']),
+                                                            toList(section['msb']))}
+
+    def reset(self):
+        """Power-on state of the FPGA"""
+        self.inputBuffer = bytearray() # bytes written by the GUI, not yet decoded
+        self.outputBuffer = bytearray() # bytes waiting to be read by the GUI
+        self.registers = {address:bytearray() for address in range(8)}
+        self.lastStatus = [0]*6
+        self.writeAddress = None # register receiving the FIFO A payload
+        self.payloadRemaining = 0 # payload bytes announced by the last FIFO A write
+        self.i2cResponse = bytearray()
+        self.lpgbtMemory = bytearray(0x200)
+        self.colutaMemory = {} # (chip,i2c address) -> last 8 data bytes, MSB first
+        self.colutaSubMemory = {} # (chip,i2c address,subaddress) -> 64-bit sub-data word
+        self.i2cPointer = None
+        self.nMeasurements = 0
+        self.phase = 0.
+
+    ############################################################################
+    # pySerial interface
+
+    def write(self,data):
+        self.checkOpen()
+        time.sleep(self.usbLatency+len(data)/self.usbRate)
+        self.inputBuffer += data
+        self.decode()
+        return len(data)
+
+    def readinto(self,buffer):
+        """Reads at most len(buffer) bytes, waiting for them as the port would, up to its timeout"""
+        self.checkOpen()
+        view = memoryview(buffer).cast('B')
+        nBytes = min(len(view),len(self.outputBuffer))
+        if self.timeout is not None:
+            nBytes = min(nBytes,int(self.timeout*self.usbRate))
+        if nBytes==0:
+            # Nothing else will arrive while the caller is blocked, so wait out the timeout
+            if self.timeout: time.sleep(self.timeout)
+            return 0
+        time.sleep(self.usbLatency+nBytes/self.usbRate)
+        view[:nBytes] = self.outputBuffer[:nBytes]
+        del self.outputBuffer[:nBytes]
+        return nBytes
+
+    def read(self,size=1):
+        buffer = bytearray(size)
+        nBytes = self.readinto(buffer)
+        return bytes(buffer[:nBytes])
+
+    @property
+    def in_waiting(self):
+        return len(self.outputBuffer)
+
+    @property
+    def out_waiting(self):
+        return 0
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        self.outputBuffer.clear()
+
+    def reset_output_buffer(self):
+        pass
+
+    def isOpen(self):
+        return self.isPortOpen
+
+    @property
+    def is_open(self):
+        return self.isPortOpen
+
+    def close(self):
+        self.isPortOpen = False
+
+    def checkOpen(self):
+        if not self.isPortOpen:
+            raise IOError('EMULATOR: port is closed')
+
+    ############################################################################
+    # FIFO A/B protocol
+
+    @staticmethod
+    def isStatusWord(word):
+        """Status words are framed by 254 and 255, and the unused status bits are 0"""
+        return word[0]==254 and word[5]==255 and not word[1]&0xC0 and not word[4]&0x10
+
+    def decode(self):
+        """Splits the input stream into status words and FIFO A payload bytes.
+
+        The counter of the status word starting a FIFO A write gives the length of its
+        payload, which is taken as is even where it contains 254. Bytes beyond it, as
+        written where the counter falls short of the payload, still go to the register up
+        to the next status word.
+        """
+        data = self.inputBuffer
+        payloadStart = 0
+        i = 0
+        while i < len(data):
+            if self.payloadRemaining > 0:
+                nPayload = min(self.payloadRemaining,len(data)-i)
+                self.payloadRemaining -= nPayload
+                i += nPayload
+                continue
+            if data[i]!=254:
+                nextStatus = data.find(254,i)
+                i = len(data) if nextStatus<0 else nextStatus
+                continue
+            if len(data)-i < 6:
+                break # keep a possibly incomplete status word for the next write
+            if self.isStatusWord(data[i:i+6]):
+                self.receivePayload(data[payloadStart:i])
+                self.receiveStatus(list(data[i:i+6]))
+                i += 6
+                payloadStart = i
+                continue
+            i += 1
+        self.receivePayload(data[payloadStart:i])
+        del data[:i]
+
+    def receivePayload(self,payload):
+        if len(payload)==0 or self.writeAddress is None: return
+        self.registers[self.writeAddress] += payload
+
+    def receiveStatus(self,status):
+        """Acts on the bits of status4 that rose since the previous status word"""
+        rising = status[4] & ~self.lastStatus[4]
+        risingReset = status[1] & ~self.lastStatus[1] & 0x20
+        self.lastStatus = status
+        operation = status[1]&0x3
+        address = (status[1]>>2)&0x7
+        counter = status[2]+(status[3]<<8)
+
+        if rising & 0x20: # softwareReset
+            self.reset()
+            self.lastStatus = status
+            return
+        if risingReset: # colutaReset
+            self.colutaMemory.clear()
+            self.colutaSubMemory.clear()
+        if rising & 0x40: # startFifoAOperation
+            if operation==1:
+                self.writeAddress = address
+                self.registers[address] = bytearray()
+                self.payloadRemaining = counter
+            elif operation==2:
+                self.writeAddress = None
+                self.outputBuffer += self.readRegister(address,counter)
+        if rising & 0x01: # startControlOperation
+            if operation==1 and address==0:
+                self.runI2C(bytes(self.registers[0]))
+            self.writeAddress = None
+        if rising & 0x04: # startMeasurement
+            self.nMeasurements += 1
+            self.phase = self.rng.uniform(0,2*numpy.pi)
+
+    def readRegister(self,address,counter):
+        """Answer to a FIFO A read of counter words from the given address"""
+        if address==1: # ADC data, 16 bytes per count
+            return self.makeFrames(counter*16)
+        nBytes = counter*8 # control registers, 8 bytes per count
+        if address==self.histogramAddress:
+            return self.makeHistogram(nBytes)
+        if address==0:
+            response = self.i2cResponse
+        elif address==4: # link status, bit 3 is link ready
+            response = bytearray([0x08 if self.linkReady else 0x00])
+        else:
+            response = self.registers[address]
+        return bytes(response[:nBytes]).ljust(nBytes,b'\x00')
+
+    ############################################################################
+    # I2C
+
+    def runI2C(self,payload):
+        """Runs the Wishbone I2C command loaded in register 0
+
+        The command is sent last byte first. Each transfer starts with a byte
+        {i2cWR[3],STP,counter[4]}, followed by counter bytes: the chip address, then
+        the register address and data for a write (010) or the data read back for a
+        read (100). Operation 001 configures the I2C master and is accepted as is.
+        """
+        command = payload[::-1]
+        self.i2cResponse = bytearray()
+        selected = self.registers[6][0]&0x3 if len(self.registers[6]) else 0
+        chip = {0:'lpgbt',1:'coluta1',2:'coluta2'}.get(selected,'lpgbt')
+        position = 0
+        while position < len(command):
+            i2cOperation = command[position]>>5
+            count = command[position]&0xF
+            transfer = command[position+1:position+1+count]
+            position += 1+count
+            if i2cOperation==0b010 and len(transfer):
+                self.i2cWrite(chip,transfer)
+            elif i2cOperation==0b100 and len(transfer):
+                self.i2cResponse += self.i2cRead(chip,count-1)
+            else:
+                break
+
+    def i2cWrite(self,chip,transfer):
+        if chip=='lpgbt':
+            # lpGBT address, register address LSB and MSB, then data
+            if len(transfer) < 3: return
+            register = transfer[1]+(transfer[2]<<8)
+            data = transfer[3:]
+            self.lpgbtMemory[register:register+len(data)] = data
+            self.i2cPointer = (chip,register)
+        else:
+            # 10-bit address mode: {11110,chipIdHi,wr}, {chipIdLo,i2cAddress}, then data LSB first
+            if len(transfer) < 2: return
+            i2cAddress = transfer[1]&0x7F
+            self.i2cPointer = (chip,i2cAddress)
+            data = bytes(transfer[2:][::-1])
+            if len(data)==0: return
+            word = int.from_bytes(data,'big')
+            wrFlag,readBackMux,subAddress = (word>>15)&1,(word>>14)&1,(word>>8)&0x3F
+            if readBackMux and not wrFlag:
+                # Read back request: the next read returns the sub-data stored at subAddress
+                stored = self.colutaSubMemory.get((chip,i2cAddress,subAddress),0)
+                self.colutaMemory[(chip,i2cAddress)] = stored.to_bytes(len(data),'big')
+                return
+            if wrFlag:
+                self.colutaSubMemory[(chip,i2cAddress,subAddress)] = word
+            self.colutaMemory[(chip,i2cAddress)] = data
+
+    def i2cRead(self,chip,nBytes):
+        if self.i2cPointer is None or self.i2cPointer[0]!=chip:
+            return bytes(nBytes)
+        if chip=='lpgbt':
+            register = self.i2cPointer[1]
+            return bytes(self.lpgbtMemory[register:register+nBytes]).ljust(nBytes,b'\x00')
+        return self.colutaMemory.get(self.i2cPointer,b'')[:nBytes].ljust(nBytes,b'\x00')
+
+    ############################################################################
+    # ADC data
+
+    def makeSamples(self,nSamples):
+        """ADC codes of one channel for the configured signal"""
+        n = numpy.arange(nSamples)
+        if self.signal=='sine':
+            omega = 2*numpy.pi*self.sineFrequency/self.samplingFrequency
+            codes = self.offset+self.amplitude*numpy.sin(omega*n+self.phase)
+        elif self.signal=='pulse':
+            # CR-RC shaped pulses, one every pulsePeriod samples, starting at a random delay
+            t = (n+self.phase/(2*numpy.pi)*self.pulsePeriod)%self.pulsePeriod/self.pulseShaping
+            codes = self.offset+self.amplitude*t*numpy.exp(1-t)
+        else:
+            codes = numpy.full(nSamples,self.offset)
+        if self.noise > 0:
+            codes = codes+self.rng.normal(0,self.noise,nSamples)
+        return numpy.clip(numpy.rint(codes),0,self.weights.sum()).astype(numpy.int64)
+
+    def encode(self,codes):
+        """Inverse of the SAR weighting: sets each bit, MSB first, whose weight still fits"""
+        remaining = codes.copy()
+        words = numpy.zeros(len(codes),dtype=numpy.uint32)
+        for bit,weight in enumerate(self.weights):
+            if weight <= 0: continue
+            isSet = remaining >= weight
+            words |= isSet.astype(numpy.uint32) << (len(self.weights)-1-bit)
+            remaining -= isSet*weight
+        return words
+
+    @staticmethod
+    def misalign(words,roll):
+        """Rolls the 16-bit stream by -roll, so that dataParser's roll by roll undoes it"""
+        if roll==0: return words
+        bits = numpy.unpackbits(words.astype('>u2').view(numpy.uint8))
+        bits = numpy.roll(bits,-roll)
+        return numpy.packbits(bits).view('>u2').astype(numpy.uint32)
+
+    def makeFrames(self,nBytes):
+        """Synthetic readout: 32-byte frames of big-endian 32-bit words, data in words 1-3"""
+        nFrames = -(-nBytes//self.bytesPerFrame)
+        frames = numpy.zeros((nFrames,self.bytesPerFrame//4),dtype=numpy.uint32)
+        for (wordIndex,chip,channel,roll,lsb,msb,wordLength) in self.channels:
+            nBits = msb-lsb
+            if channel=='frame':
+                words = numpy.full(nFrames,self.framePattern,dtype=numpy.uint32)
+            else:
+                words = self.encode(self.makeSamples(nFrames))
+            words = self.misalign(words,roll)&((1<<nBits)-1)
+            frames[:,wordIndex] |= words << (wordLength-msb)
+        return frames.astype('>u4').tobytes()[:nBytes]
+
+    def makeHistogram(self,nBytes):
+        """FPGA histogram buffer of histogramSamples codes of the signal: one little-endian
+        word per filled bin with its bin number and count, padded with empty words"""
+        histogram = numpy.bincount(self.makeSamples(self.histogramSamples))
+        bins = numpy.flatnonzero(histogram)
+        counts = histogram[bins]
+        words = numpy.zeros(max(nBytes*8//self.histogramBits,len(bins)),dtype=numpy.uint64)
+        for name,values in (('bin_number',bins),('bin_count',counts)):
+            shift,width = self.histogramFields[name]
+            values = numpy.minimum(values,(1<<width)-1).astype(numpy.uint64)
+            words[:len(bins)] |= values << numpy.uint64(shift)
+        return words.astype('<u{}'.format(self.histogramBits//8)).tobytes()[:nBytes]
@@ -0,0 +1,93 @@
+"""Folding of pulse run captures into pulses: average pulse, and peak, pedestal and peak
+time of every pulse.
+
+A capture of a pulse run holds a pulse every pulse period, pulse_length bunch crossings
+(25 ns), i.e. 64 samples for the AWG physics pulses and 440 for the on-board pulser at
+40 MHz. The capture is folded at that period into a (pulse,sample) array by a reshape,
+starting peak_offset samples before the peak of the average pulse, so that every folded
+pulse starts on its baseline:
+    pedestal:  mean of the pedestal_samples first samples of the pulse
+    peak:      maximum of the pulse above its pedestal
+    peak time: sample of the maximum, interpolated with a parabola through its neighbours
+The settings are read from config/pulseConfig.cfg. With save_pulses set, dataParser saves
+the results of every channel of every pulse measurement in the /pulses group of the run
+file, and amplitudeScan gives the peak against e.g. pulser_amp from those alone.
+
+name: pulseMod.py
+date: 17 October 2026
+"""
+
+import configparser
+from collections import namedtuple
+import numpy as np
+import runReaderMod
+
+# peakOffset:      samples between the start of a folded pulse and the peak of the average pulse
+# pedestalSamples: first samples of each folded pulse averaged for its pedestal
+PulseSettings = namedtuple('PulseSettings',['peakOffset','pedestalSamples'])
+defaultSettings = PulseSettings(peakOffset=16,pedestalSamples=8)
+# Folded pulses of the captures, arrays with the leading axes of the captures:
+# offset: sample of the capture where the first folded pulse starts, meanPulse: (...,sample)
+# average pulse, pedestal, peak, peakTime: (...,pulse), peakTime in samples from the pulse start
+FoldedPulses = namedtuple('FoldedPulses',['offset','meanPulse','pedestal','peak','peakTime'])
+
+def loadSettings(coluta,configFile):
+    """Reads the [Pulses] settings into coluta.pulseSettings"""
+    config = configparser.ConfigParser()
+    config.read(configFile)
+    section = config['Pulses'] if config.has_section('Pulses') else config['DEFAULT']
+    coluta.pulseSettings = PulseSettings(peakOffset=max(0,section.getint('peak_offset',fallback=defaultSettings.peakOffset)),
+                                         pedestalSamples=max(1,section.getint('pedestal_samples',fallback=defaultSettings.pedestalSamples)))
+    coluta.savePulses = section.getboolean('save_pulses',fallback=False)
+
+def pulsePeriod(pulseLength,fs):
+    """Samples between two pulses of pulseLength bunch crossings (25 ns) sampled at fs (MHz)"""
+    return int(round(pulseLength*fs/40.))
+
+def foldPulses(adcData,period,settings=defaultSettings):
+    """Folds each capture along the last axis, e.g. of a (capture,channel,sample) array,
+    at period samples. Returns the FoldedPulses of the complete pulses of the captures"""
+    samples = np.asarray(adcData,dtype=np.float64)
+    nSamples = samples.shape[-1]
+    # Pulses that fit in the capture whatever the offset
+    nPulses = (nSamples-period+1)//period
+    if period<=settings.pedestalSamples or nPulses<1:
+        raise ValueError('PULSES: {0} samples hold no pulse of {1} samples'.format(nSamples,period))
+    # The peak of the average pulse, folded from the first sample, sets the offset of each capture
+    firstFold = samples[...,:(nSamples//period)*period].reshape(samples.shape[:-1]+(-1,period)).mean(axis=-2)
+    offset = (np.argmax(firstFold,axis=-1)-settings.peakOffset)%period
+    index = offset[...,None]+np.arange(nPulses*period)
+    pulses = np.take_along_axis(samples,index,axis=-1).reshape(samples.shape[:-1]+(nPulses,period))
+
+    pedestal = pulses[...,:settings.pedestalSamples].mean(axis=-1)
+    peakSample = np.clip(np.argmax(pulses,axis=-1),1,period-2)
+    below,center,above = (np.take_along_axis(pulses,(peakSample+shift)[...,None],axis=-1)[...,0] for shift in (-1,0,1))
+    curvature = below-2*center+above
+    with np.errstate(divide='ignore',invalid='ignore'):
+        delta = np.where(curvature<0,0.5*(below-above)/curvature,0)
+    return FoldedPulses(offset,pulses.mean(axis=-2),pedestal,center-pedestal,peakSample+np.clip(delta,-0.5,0.5))
+
+def amplitudeScan(filePath,coluta,channel,condition='pulser_amp',**criteria):
+    """Peak of the pulses of one channel against the values of a run condition, e.g. the
+    pulser_amp of a standard amplitude run, from the /pulses group of the run file alone.
+    Returns the values, the mean and standard deviation of the peaks of each, and the
+    average pulse of each"""
+    with runReaderMod.RunReader(filePath) as run:
+        pulseGroup = run.outFile['pulses'][coluta][channel]
+        measurements = pulseGroup['measurement'][()]
+        isSelected = np.isin(measurements,run.select(coluta,channel,**criteria))
+        values = run.conditions[condition][measurements[isSelected]]
+        nPulses = pulseGroup['n_pulses'][()][isSelected]
+        peaks = pulseGroup['peak'][()][isSelected]
+        meanPulses = pulseGroup['mean_pulse'][()][isSelected]
+    # The peaks past the number of pulses of a measurement are padding
+    isPulse = np.arange(peaks.shape[1])<nPulses[:,None]
+    scanValues = np.unique(values)
+    meanPeak,stdPeak,meanPulse = [],[],[]
+    for value in scanValues:
+        isValue = values==value
+        valuePeaks = peaks[isValue][isPulse[isValue]]
+        meanPeak.append(valuePeaks.mean())
+        stdPeak.append(valuePeaks.std())
+        meanPulse.append(meanPulses[isValue].mean(axis=0))
+    return scanValues,np.array(meanPeak),np.array(stdPeak),np.array(meanPulse)
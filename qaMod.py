@@ -0,0 +1,308 @@
+"""Spectral quality of a sine wave capture: SINAD, SNR, SFDR, THD and ENOB from its FFT.
+
+The spectrum is the rfft of the (optionally windowed) samples. The fundamental is the
+largest bin above the dc_bins lowest ones, and its harmonics, including those aliased
+back below Nyquist, are found by bin number:
+    bin of harmonic k = (k*fundamental) % N, folded to N-bin above N/2
+The fundamental and each harmonic spread over signal_bins bins on either side, e.g. with
+a window. All metrics come from the bin powers in one pass, see analyzeSpectrum. The
+settings are read from config/qaConfig.cfg.
+
+What only depends on the capture length, the sampling frequency and the settings (the
+window, the frequency axis and the bin masks of a fundamental) is computed once and kept
+in small LRU caches, so that a run at fixed nSamples only pays for the FFT itself.
+
+analyzeBatch does the same for a (capture, channel, sample) array, or any other leading
+axes, with one rfft along the last axis, and returns a table of the metrics (qaDtype).
+With save_qa set, dataParser appends the table of every sine measurement to the /qa group
+of the run file, with its mean and standard deviation per channel, and with sine_fit set,
+the table of its sine fits.
+
+sineFit fits a sine to each capture instead (IEEE 1241): a 3-parameter least-squares fit
+at the frequency of the FFT peak, interpolated between bins, then iterations of the
+4-parameter fit, which also corrects the frequency. Unlike the FFT metrics, its SINAD and
+ENOB do not depend on the sine being coherently sampled. All captures are fitted together,
+the normal equations of each being solved as one batch of small linear systems.
+
+SpectrumAverage keeps the running mean (and, with max_hold, the maximum) of the power
+spectra of the captures of a repeat run, one spectrum per channel whatever the number of
+captures, so that spurs below the noise of one capture show up as the run goes on.
+
+name: qaMod.py
+date: 17 October 2026
+"""
+
+import configparser
+import functools
+from collections import namedtuple
+import numpy as np
+
+# dcBins:        lowest bins left out of the spectrum (DC and its leakage)
+# signalBins:    bins on either side of the fundamental and of each harmonic counted with it
+# window:        name of the numpy window applied to the samples, e.g. hanning, or none
+# harmonicRange: harmonics k are counted while k*fundamental < harmonicRange*fs
+QASettings = namedtuple('QASettings',['dcBins','signalBins','window','harmonicRange'])
+# The spectrum colutaMod.doFFT has always shown
+defaultSettings = QASettings(dcBins=2,signalBins=0,window='none',harmonicRange=2)
+# Metrics of one capture of one channel, as saved in the run file: dB, except ENOB in bits,
+# fundamental in MHz and amplitude in ADC counts
+qaDtype = np.dtype([(name,np.float32) for name in ['SINAD','SNR','THD','SFDR','ENOB','fundamental','amplitude']])
+# Sine fitted to one capture of one channel, amplitude*cos(2*pi*frequency*t+phase)+offset:
+# amplitude, offset and residual (rms) in ADC counts, phase in radians, frequency in MHz,
+# SINAD in dB and ENOB in bits from the residual
+sineFitDtype = np.dtype([('amplitude',np.float32),('phase',np.float32),('frequency',np.float64),
+                         ('offset',np.float32),('residual',np.float32),('SINAD',np.float32),('ENOB',np.float32)])
+# What the spectra of captures of nSamples at fs have in common, see getSpectrumPlan
+# window: coefficients, None for none, windowSum: their sum, the gain on the amplitude of a sine
+# freq: frequency (MHz) of each rfft bin
+SpectrumPlan = namedtuple('SpectrumPlan',['nSamples','fs','window','windowSum','freq'])
+# Bins of the fundamental (with its spread), of its harmonics and of the noise, see getBinMasks
+BinMasks = namedtuple('BinMasks',['isSignal','isHarmonic','isNoise'])
+
+def loadSettings(coluta,configFile):
+    """Reads the [QA] settings into coluta.qaSettings"""
+    config = configparser.ConfigParser()
+    config.read(configFile)
+    section = config['QA'] if config.has_section('QA') else config['DEFAULT']
+    coluta.qaSettings = QASettings(dcBins=max(1,section.getint('dc_bins',fallback=defaultSettings.dcBins)),
+                                   signalBins=max(0,section.getint('signal_bins',fallback=defaultSettings.signalBins)),
+                                   window=section.get('window',fallback=defaultSettings.window).strip().lower(),
+                                   harmonicRange=section.getint('harmonic_range',fallback=defaultSettings.harmonicRange))
+    coluta.saveQA = section.getboolean('save_qa',fallback=False)
+    coluta.qaMaxHold = section.getboolean('max_hold',fallback=False)
+    coluta.doSineFit = section.getboolean('sine_fit',fallback=False)
+    coluta.sineFitIterations = max(0,section.getint('sine_fit_iterations',fallback=4))
+
+def windowFunction(name,nSamples):
+    """Coefficients of the numpy window called name, None for none"""
+    if name in ('','none'):
+        return None
+    if name not in ('bartlett','blackman','hamming','hanning'):
+        raise ValueError('QA: unknown window {}'.format(name))
+    return getattr(np,name)(nSamples)
+
+def readOnly(array):
+    """The cached arrays are shared by every caller"""
+    if array is not None:
+        array.setflags(write=False)
+    return array
+
+@functools.lru_cache(maxsize=8)
+def getSpectrumPlan(nSamples,fs,windowName):
+    """Window and frequency axis of captures of nSamples at fs (MHz)"""
+    window = readOnly(windowFunction(windowName,nSamples))
+    windowSum = float(window.sum()) if window is not None else float(nSamples)
+    return SpectrumPlan(nSamples,fs,window,windowSum,readOnly(np.fft.rfftfreq(nSamples,1/fs)))
+
+@functools.lru_cache(maxsize=64)
+def getBinMasks(nSamples,fundamental,settings):
+    """Signal, harmonic and noise bins of a spectrum of nSamples with this fundamental bin"""
+    nBins = nSamples//2+1
+    isSignal = np.zeros(nBins,dtype=bool)
+    isSignal[spreadBins([fundamental],settings.signalBins,nBins)] = True
+    isHarmonic = np.zeros(nBins,dtype=bool)
+    isHarmonic[spreadBins(harmonicBins(fundamental,nSamples,settings.harmonicRange),settings.signalBins,nBins)] = True
+    isHarmonic[:settings.dcBins] = False
+    isHarmonic &= ~isSignal
+    isNoise = ~(isSignal|isHarmonic)
+    isNoise[:settings.dcBins] = False
+    return BinMasks(readOnly(isSignal),readOnly(isHarmonic),readOnly(isNoise))
+
+def harmonicBins(fundamental,nSamples,harmonicRange=2):
+    """Bins of harmonics 2, 3, ... of the fundamental bin, aliased below Nyquist"""
+    harmonics = np.arange(2,max(2,harmonicRange*nSamples//fundamental))
+    bins = (harmonics*fundamental)%nSamples
+    return np.minimum(bins,nSamples-bins)
+
+def spreadBins(bins,signalBins,nBins):
+    """The bins and the signalBins bins on either side of each, within the spectrum"""
+    spread = (np.asarray(bins)[:,None]+np.arange(-signalBins,signalBins+1)).ravel()
+    return spread[(spread>=0)&(spread<nBins)]
+
+def spectrumMetrics(power,plan,settings):
+    """Metrics of the spectra in power, (...,bin) bin powers with the DC bins zeroed, as a
+    dict of arrays of shape power.shape[:-1]. The fundamental is a bin number"""
+    # A spectrum without signal peaks at bin 0, which has no harmonics: take the first bin kept
+    fundamental = np.maximum(np.argmax(power,axis=-1),max(settings.dcBins,1))
+    peak = np.take_along_axis(power,fundamental[...,None],axis=-1)[...,0]
+    # The masks of each fundamental found, one per spectrum
+    fundamentals,whichFundamental = np.unique(fundamental,return_inverse=True)
+    masks = [getBinMasks(plan.nSamples,int(bin),settings) for bin in fundamentals]
+    if len(masks)==1:
+        isSignal,isHarmonic,isNoise = masks[0]
+    else:
+        whichFundamental = whichFundamental.reshape(fundamental.shape)
+        isSignal,isHarmonic,isNoise = (np.stack(mask)[whichFundamental] for mask in zip(*masks))
+
+    signalPower = np.sum(power,axis=-1,where=isSignal)
+    harmonicPower = np.sum(power,axis=-1,where=isHarmonic)
+    noisePower = np.sum(power,axis=-1,where=isNoise)
+    spurPower = np.max(power,axis=-1,where=~isSignal,initial=0)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        sinad = 10*np.log10(signalPower/(noisePower+harmonicPower))
+        return {'SINAD': sinad,
+                'SNR': 10*np.log10(signalPower/noisePower),
+                'THD': 10*np.log10(harmonicPower/signalPower),
+                'SFDR': 10*np.log10(peak/spurPower),
+                'ENOB': (sinad-1.76)/6.02,
+                'fundamental': fundamental,
+                'amplitude': 2*np.sqrt(peak)/plan.windowSum}
+
+def powerSpectrum(adcData,fs,settings):
+    """Bin powers of the rfft of the captures along the last axis, with the DC bins zeroed"""
+    samples = np.asarray(adcData,dtype=np.float64)
+    plan = getSpectrumPlan(samples.shape[-1],fs,settings.window)
+    if plan.window is not None:
+        samples = samples*plan.window
+    power = np.abs(np.fft.rfft(samples,axis=-1))**2
+    power[...,:settings.dcBins] = 0
+    return plan,power
+
+def analyzeSpectrum(adcData,fs,settings=defaultSettings):
+    """Spectrum and QA of one capture sampled at fs (MHz). Returns the frequencies (MHz),
+    the PSD in dB relative to the fundamental, and a dict of the metrics"""
+    plan,power = powerSpectrum(adcData,fs,settings)
+    return spectrumQA(power,plan,settings)
+
+def spectrumQA(power,plan,settings):
+    """Frequencies, PSD and QA of the bin powers of one spectrum, see analyzeSpectrum.
+    Without any signal above the DC bins, e.g. a flat capture, the metrics are NaN"""
+    metrics = spectrumMetrics(power,plan,settings)
+    peak = power[metrics['fundamental']]
+    if peak==0:
+        QA = {name:np.nan for name in metrics}
+    else:
+        QA = {name:float(value) for name,value in metrics.items()}
+        QA['fundamental'] = plan.freq[metrics['fundamental']]
+
+    with np.errstate(divide='ignore',invalid='ignore'):
+        psd = 10*np.log10(power[settings.dcBins:]/peak)
+    return plan.freq[settings.dcBins:],psd,QA
+
+def analyzeBatch(adcData,fs,settings=defaultSettings):
+    """QA of many captures sampled at fs (MHz), e.g. a (capture,channel,sample) array.
+    Returns a qaDtype table of shape adcData.shape[:-1], NaN for captures without signal"""
+    plan,power = powerSpectrum(adcData,fs,settings)
+    metrics = spectrumMetrics(power,plan,settings)
+    metrics['fundamental'] = plan.freq[metrics['fundamental']]
+    noSignal = np.max(power,axis=-1)==0
+    table = np.empty(power.shape[:-1],dtype=qaDtype)
+    for name in qaDtype.names:
+        table[name] = np.where(noSignal,np.nan,metrics[name])
+    return table
+
+def peakFrequency(adcData,fs):
+    """Frequency (MHz) of the largest bin above DC of each capture, interpolated between
+    bins from the ratio of the neighbouring bins (Jacobsen)"""
+    spectrum = np.fft.rfft(adcData,axis=-1)
+    peak = np.clip(np.argmax(np.abs(spectrum[...,1:]),axis=-1)+1,1,spectrum.shape[-1]-2)[...,None]
+    below,center,above = (np.take_along_axis(spectrum,peak+shift,axis=-1)[...,0] for shift in (-1,0,1))
+    with np.errstate(divide='ignore',invalid='ignore'):
+        delta = np.nan_to_num(np.real((below-above)/(2*center-below-above)))
+    return (peak[...,0]+np.clip(delta,-0.5,0.5))*fs/adcData.shape[-1]
+
+def fitSine(block,time,omega,previous=None):
+    """Least-squares fit of A*cos(omega*t)+B*sin(omega*t)+C to each capture of block, and of
+    the correction of omega when the previous fit is given (4-parameter fit).
+    Returns the parameters, (capture,3) or (capture,4), and the basis, (capture,3,sample)"""
+    phase = omega[:,None]*time
+    cos,sin = np.cos(phase),np.sin(phase)
+    basis = [cos,sin,np.ones_like(cos)]
+    if previous is not None:
+        # Derivative of the previous fit with respect to omega
+        basis.append(time*(previous[:,1,None]*cos-previous[:,0,None]*sin))
+    basis = np.stack(basis,axis=1)
+    parameters = np.linalg.solve(basis@basis.transpose(0,2,1),basis@block[...,None])[...,0]
+    return parameters,basis[:,:3]
+
+def sineFit(adcData,fs,iterations=4,blockSize=256):
+    """Fits a sine to each capture along the last axis, sampled at fs (MHz). Returns a
+    sineFitDtype table of shape adcData.shape[:-1]. iterations=0 gives the 3-parameter fit
+    at the FFT frequency, else the 4-parameter fit is iterated until the frequency correction
+    shifts the phase by less than 1 urad over the capture, at most iterations times.
+    Captures are fitted blockSize at a time, to bound the memory. Flat captures have no sine
+    to fit: their amplitude and residual are 0 and their phase, frequency, SINAD and ENOB NaN"""
+    samples = np.asarray(adcData,dtype=np.float64)
+    shape,nSamples = samples.shape[:-1],samples.shape[-1]
+    samples = samples.reshape(-1,nSamples)
+    time = np.arange(nSamples)/fs
+    table = np.empty(len(samples),dtype=sineFitDtype)
+    # Their normal equations would be singular, so they are left out of the fit
+    flat = np.ptp(samples,axis=-1)==0
+    for name in sineFitDtype.names:
+        table[name][flat] = np.nan
+    table['amplitude'][flat] = 0
+    table['residual'][flat] = 0
+    table['offset'][flat] = samples[flat,0]
+    fitted = np.flatnonzero(~flat)
+    for start in range(0,len(fitted),blockSize):
+        block = samples[fitted[start:start+blockSize]]
+        omega = 2*np.pi*peakFrequency(block,fs)
+        parameters,basis = fitSine(block,time,omega)
+        for iteration in range(iterations):
+            parameters,basis = fitSine(block,time,omega,parameters)
+            omega = omega+parameters[:,3]
+            if np.max(np.abs(parameters[:,3]))*time[-1]<1e-6:
+                parameters = parameters[:,:3]
+                break
+        else:
+            if iterations:
+                parameters,basis = fitSine(block,time,omega)
+        amplitude = np.hypot(parameters[:,0],parameters[:,1])
+        residual = np.sqrt(np.mean((block-np.einsum('mkn,mk->mn',basis,parameters))**2,axis=-1))
+        rows = np.empty(len(block),dtype=sineFitDtype)
+        rows['amplitude'] = amplitude
+        rows['phase'] = np.arctan2(-parameters[:,1],parameters[:,0])
+        rows['frequency'] = omega/(2*np.pi)
+        rows['offset'] = parameters[:,2]
+        rows['residual'] = residual
+        with np.errstate(divide='ignore',invalid='ignore'):
+            rows['SINAD'] = 20*np.log10(amplitude/np.sqrt(2)/residual)
+        rows['ENOB'] = (rows['SINAD']-1.76)/6.02
+        table[fitted[start:start+blockSize]] = rows
+    return table.reshape(shape)
+
+def summarizeQA(table,axis=0):
+    """Mean and standard deviation of a QA table (qaDtype or sineFitDtype) along axis,
+    e.g. over the captures of a (capture,channel) table, as two tables of its dtype"""
+    mean = np.empty(np.delete(table.shape,axis),dtype=table.dtype)
+    std = np.empty_like(mean)
+    for name in table.dtype.names:
+        values = table[name].astype(np.float64)
+        mean[name] = values.mean(axis=axis)
+        std[name] = values.std(axis=axis)
+    return mean,std
+
+class SpectrumAverage:
+    """Running mean of the power spectra of the captures of a run, per channel, and their
+    maximum with maxHold. Restarts when the channels or the number of samples change"""
+
+    def __init__(self,fs,settings=defaultSettings,maxHold=False):
+        self.fs = fs
+        self.settings = settings
+        self.maxHold = maxHold
+        self.channels = []
+        self.plan = None
+        self.meanPower = None
+        self.maxPower = None
+        self.nCaptures = 0
+
+    def add(self,channels,adcData):
+        """Adds the captures of the channels, a (channel,sample) array, from one rfft"""
+        plan,power = powerSpectrum(adcData,self.fs,self.settings)
+        if self.plan is None or plan.nSamples!=self.plan.nSamples or list(channels)!=self.channels:
+            self.plan = plan
+            self.channels = list(channels)
+            self.meanPower = np.zeros_like(power)
+            self.maxPower = np.zeros_like(power) if self.maxHold else None
+            self.nCaptures = 0
+        self.nCaptures += 1
+        self.meanPower += (power-self.meanPower)/self.nCaptures
+        if self.maxHold:
+            np.maximum(self.maxPower,power,out=self.maxPower)
+
+    def spectrum(self,channel):
+        """Frequencies, PSD and QA of the mean spectrum of a channel, None before its first capture"""
+        if channel not in self.channels:
+            return None
+        return spectrumQA(self.meanPower[self.channels.index(channel)],self.plan,self.settings)
@@ -0,0 +1,141 @@
+"""Decodes a raw archive again and writes the HDF5 file of the run, without the board.
+
+Each measurement is decoded with the dataConfig.cfg and the rolls it was taken with, which
+are kept in the archive, or with the configuration given by --config, e.g. with corrected
+rolls, and the alignment cached next to it.
+The arithmetic mode of each channel is the one recorded, unless --mode sets another one.
+The run and channel conditions are those recorded when the measurement was taken.
+
+With --workers, the measurements are decoded by that many processes, each reading its
+measurements straight from the memory-mapped archive, and written in order, without the
+alignment check. Without, each measurement goes through dataParser.parseData as in the
+GUI, including the alignment check.
+
+name: replayArchive.py
+date: 17 October 2026
+
+Usage: python replayArchive.py [options] data_files/Run_####/Run_####_Raw.bin
+"""
+
+import os,re,optparse,multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy
+import archiveMod
+import dataParser
+import qaMod
+import pulseMod
+
+# Arithmetic modes as named by dataParser and in the GUI mode boxes
+modeNames = {'raw_data':'Raw Data','sar_calibration':'SAR Calibration',
+             'dre_calibration':'DRE Calibration','normal_mode':'Normal Mode'}
+
+class ArchivedBoard:
+    """Stands in for the GUI: the board settings and the measurement being written"""
+    def __init__(self,board):
+        self.frequency = board['frequency']
+        self.serial_number = board['serial_number']
+        self.debug = board['debug']
+        self.nSamples = 0
+        self.measurementTime = ''
+        # The QA of sine measurements and the folded pulses are saved as by the GUI
+        configDirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)),'config')
+        qaMod.loadSettings(self,os.path.join(configDirectory,'qaConfig.cfg'))
+        pulseMod.loadSettings(self,os.path.join(configDirectory,'pulseConfig.cfg'))
+
+    def showError(self,message):
+        print(message)
+
+def decodeArchivedCapture(dataPath,offset,length,nSamples,plan,weights):
+    """Decodes one measurement of the archive. Runs in the decoding processes"""
+    dataFromChip = numpy.memmap(dataPath,dtype=numpy.uint8,mode='r',offset=offset,shape=(length,))
+    frames = dataParser.frameWords(dataFromChip,plan.bytesPerFrame,plan.bytesPerWord)
+    return dataParser.decodeFrames(frames[:int(nSamples)],plan,weights)
+
+def setMeasurement(parser,archive,i,configFile=None,mode=None):
+    """Loads the configuration, arithmetic modes and conditions of measurement i into the parser.
+    Returns its dataParser.RunConditions"""
+    entry,record = archive.index[i],archive.records[i]
+    useRecordedRolls = configFile is None
+    if useRecordedRolls:
+        configFile = archive.configFile(entry['config_hash'])
+    if configFile!=parser.configFile:
+        parser.configFile = configFile
+        parser.setupConfigurations()
+    if useRecordedRolls:
+        parser.alignmentBoard = str(parser.coluta.serial_number)
+        parser.alignmentRolls = {tuple(name.split('/')):roll for name,roll in record['rolls'].items()}
+        parser.decodePlan = parser.compileDecodePlan()
+    channelConditions = {}
+    for name,conditions in record['channels'].items():
+        group,channel = name.split('/')
+        channelConditions[(group,channel)] = dict(conditions)
+        if mode is not None:
+            channelConditions[(group,channel)]['run_mode'] = modeNames[mode]
+    parser.arithmeticModes = {tuple(name.split('/')):(mode or recordedMode) for name,recordedMode in record['modes'].items()}
+    parser.coluta.nSamples = float(entry['n_samples'])
+    parser.coluta.measurementTime = entry['time'].decode()
+    return dataParser.RunConditions(record['run'],channelConditions,parser.arithmeticModes)
+
+def replay(archivePath,outputDirectory,configFile=None,mode=None,workers=0,writeCSVFile=False):
+    """Writes the measurements of the archive to outputDirectory. Returns the number written"""
+    archive = archiveMod.RawArchive(archivePath)
+    if len(archive)==0:
+        return 0
+    firstConfig = configFile or archive.configFile(archive.index[0]['config_hash'])
+    parser = dataParser.dataParser(ArchivedBoard(archive.records[0]['board']),firstConfig,outputDirectory=outputDirectory)
+    match = re.search(r'Run_(\d+)_Raw',os.path.basename(archive.basePath))
+    if match:
+        parser.runNumber = int(match.group(1))
+
+    def write(conditions):
+        parser.writeDataToFile(writeHDF5File=True,writeCSVFile=writeCSVFile,conditions=conditions)
+
+    try:
+        if workers==0:
+            for i in range(len(archive)):
+                conditions = setMeasurement(parser,archive,i,configFile,mode)
+                parser.parseData('coluta',parser.coluta.nSamples,archive[i])
+                write(conditions)
+            return len(archive)
+
+        # At most two measurements per process are decoded ahead of the writer
+        with ProcessPoolExecutor(workers,mp_context=multiprocessing.get_context('spawn')) as pool:
+            pending = deque()
+            for i in range(len(archive)+1):
+                if i<len(archive):
+                    conditions = setMeasurement(parser,archive,i,configFile,mode)
+                    entry = archive.index[i]
+                    future = pool.submit(decodeArchivedCapture,archive.dataPath,int(entry['offset']),
+                                         int(entry['length']),float(entry['n_samples']),
+                                         parser.getDecodePlan(),parser.channelWeights())
+                    pending.append((i,future))
+                while pending and (len(pending)>2*workers or i==len(archive)):
+                    j,future = pending.popleft()
+                    # The conditions of the measurement written, not of the last one submitted
+                    conditions = setMeasurement(parser,archive,j,configFile,mode)
+                    parser.setDecodedData(future.result())
+                    write(conditions)
+        return len(archive)
+    finally:
+        parser.closeRunFile()
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage='Usage: %prog [options] Run_####_Raw.bin')
+    parser.add_option('-c','--config',default=None,
+                      help='dataConfig.cfg to decode with [the one of each measurement]')
+    parser.add_option('-m','--mode',default=None,choices=list(modeNames),
+                      help='Arithmetic mode of every channel, from {0} [as recorded]'.format(', '.join(modeNames)))
+    parser.add_option('-w','--workers',type='int',default=0,
+                      help='Processes decoding the measurements, 0 to decode them as the GUI does [%default]')
+    parser.add_option('-o','--output',default=None,
+                      help='Output directory [Replay, next to the archive]')
+    parser.add_option('--csv',action='store_true',
+                      help='Also write the CSV files.')
+    options, args = parser.parse_args()
+    if len(args)!=1:
+        parser.error('One archive is needed')
+    outputDirectory = options.output or os.path.join(os.path.dirname(os.path.abspath(args[0])),'Replay')
+    nWritten = replay(args[0],outputDirectory,os.path.abspath(options.config) if options.config else None,
+                      options.mode,options.workers,options.csv)
+    print('{0} measurements written to {1}'.format(nWritten,outputDirectory))
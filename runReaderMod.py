@@ -0,0 +1,196 @@
+"""Reads the Run_####_Output.hdf5 files written by dataParser, for offline analysis.
+
+A run is opened once and its conditions are read as whole columns. The samples of a
+channel are only read when indexed, with one direct read per contiguous range of
+measurements, and are decoded to ADC counts with the SAR weights saved in the file:
+    with RunReader('data_files/Run_0012/Run_0012_Output.hdf5') as run:
+        pulses = run.select('coluta1','channel1',run_type='pulse',gain=[1,2])
+        adcCounts = run.channel('coluta1','channel1')[pulses]
+Both layouts are read, the run layout of RunWriter (hdf5_layout: run) and the legacy
+Measurement_# groups (hdf5_layout: legacy), whose measurements are read group by group.
+
+name: runReaderMod.py
+date: 17 October 2026
+"""
+
+import glob
+import h5py
+import numpy
+import dataParser
+
+# Datasets of a channel group that hold samples rather than conditions
+sampleDatasets = ('raw_data','samples','bits')
+
+def readColumn(dataset):
+    """Reads a 1-D dataset, strings as str"""
+    if h5py.check_string_dtype(dataset.dtype) is not None:
+        return numpy.array(dataset.asstr()[()],dtype=object)
+    return dataset[()]
+
+def packBits(bits):
+    """Packs (...,16) int8 bits, MSB first, into uint16 words. Inverse of dataParser.unpackRawData"""
+    bitShifts = numpy.arange(bits.shape[-1]-1,-1,-1,dtype=numpy.uint16)
+    return (bits.astype(numpy.uint16)<<bitShifts).sum(axis=-1,dtype=numpy.uint16)
+
+def contiguousRuns(indices):
+    """Splits sorted measurement indices into ranges of consecutive ones, as (start,stop) pairs"""
+    if len(indices)==0:
+        return []
+    breaks = numpy.flatnonzero(numpy.diff(indices)!=1)+1
+    starts = numpy.concatenate(([0],breaks))
+    stops = numpy.concatenate((breaks,[len(indices)]))
+    return [(int(indices[start]),int(indices[stop-1])+1) for start,stop in zip(starts,stops)]
+
+def matchCondition(column,value):
+    """Measurements whose condition equals value, or any of the values of a list"""
+    if isinstance(value,(list,tuple,set,numpy.ndarray)):
+        return numpy.isin(column,list(value))
+    return column==value
+
+class RunReader:
+    """One run file, with its conditions. channel() gives the samples of one channel"""
+
+    def __init__(self,filePath):
+        self.filePath = filePath
+        self.outFile = h5py.File(filePath,'r')
+        self.isLegacy = 'measurements' not in self.outFile
+        if self.isLegacy:
+            # Measurement_# groups, in the order they were taken
+            self.groupNames = sorted((name for name in self.outFile if name.startswith('Measurement_')),
+                                     key=lambda name:int(name.split('_')[1]))
+            self.nMeasurements = len(self.groupNames)
+            self.conditions = self.readLegacyConditions([self.outFile[name] for name in self.groupNames])
+        else:
+            self.nMeasurements = int(self.outFile.attrs.get('n_measurements',0))
+            self.conditions = {name:readColumn(column) for name,column in self.outFile['measurements'].items()}
+        self.channelReaders = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+    def close(self):
+        self.outFile.close()
+
+    def readLegacyConditions(self,groups):
+        """Columns of the attributes of groups, None where a group is missing or lacks one"""
+        names = sorted({name for group in groups if group is not None for name in group.attrs})
+        return {name:numpy.array([group.attrs.get(name) if group is not None else None for group in groups],dtype=object)
+                for name in names}
+
+    def channels(self):
+        """(coluta,channel) of every channel saved in the run"""
+        if self.isLegacy:
+            groups = [self.outFile[name] for name in self.groupNames]
+            return sorted({(coluta,channel) for group in groups for coluta in group for channel in group[coluta]})
+        return [(coluta,channel) for coluta in self.outFile if coluta.startswith('coluta')
+                for channel in self.outFile[coluta]]
+
+    def channel(self,coluta,channel):
+        if (coluta,channel) not in self.channelReaders:
+            self.channelReaders[(coluta,channel)] = ChannelReader(self,coluta,channel)
+        return self.channelReaders[(coluta,channel)]
+
+    def select(self,coluta=None,channel=None,**criteria):
+        """Indices of the measurements matching every criterion, e.g. run_type='pulse' or
+        pulser_amp=[100,200]. The conditions of a channel, e.g. gain, need the channel"""
+        conditions = dict(self.conditions)
+        if channel is not None:
+            conditions.update(self.channel(coluta,channel).conditions)
+        isSelected = numpy.ones(self.nMeasurements,dtype=bool)
+        for name,value in criteria.items():
+            if name not in conditions:
+                raise KeyError('RUN READER: no condition {0} in {1}'.format(name,self.filePath))
+            isSelected &= matchCondition(conditions[name][:self.nMeasurements],value)
+        return numpy.flatnonzero(isSelected)
+
+class ChannelReader:
+    """The samples of one channel, read when indexed: reader[i] is the ADC counts of
+    measurement i, reader[indices] a (measurement,sample) array padded with zeros
+    past the nSamples of each measurement. words() gives the raw 16-bit words"""
+
+    def __init__(self,run,coluta,channel):
+        self.run = run
+        self.coluta = coluta
+        self.channel = channel
+        weights = run.outFile.attrs.get('{0}_{1}_SAR_weights'.format(coluta,channel))
+        if weights is None:
+            raise KeyError('RUN READER: no SAR weights for {0} {1} in {2}'.format(coluta,channel,run.filePath))
+        # Files written before the overflow weights were saved decode every word with the SAR weights
+        overflowWeights = run.outFile.attrs.get('{0}_{1}_SAR_overflow_weights'.format(coluta,channel))
+        # ADC counts of every 16-bit word, so that decoding is one lookup per sample
+        self.lookup = dataParser.convertWords(numpy.arange(1<<16,dtype=numpy.uint32),weights,
+                                              overflowWeights).astype(numpy.int32)
+        if run.isLegacy:
+            self.datasets = [run.outFile[name][coluta][channel]['raw_data'] if channel in run.outFile[name].get(coluta,{}) else None
+                             for name in run.groupNames]
+            self.nSamples = numpy.array([len(dataset) if dataset is not None else 0 for dataset in self.datasets])
+            self.conditions = run.readLegacyConditions([dataset.parent if dataset is not None else None
+                                                        for dataset in self.datasets])
+        else:
+            group = run.outFile[coluta][channel]
+            self.dataset = group['raw_data']
+            self.conditions = {name:readColumn(column) for name,column in group.items()
+                               if name not in sampleDatasets and column.ndim==1}
+            self.nSamples = self.conditions['n_samples']
+
+    def __len__(self):
+        return self.run.nMeasurements
+
+    def __getitem__(self,key):
+        return self.lookup[self.words(key)]
+
+    def words(self,key):
+        """Raw 16-bit words of the measurements in key (an index, a slice or an array of indices)"""
+        if isinstance(key,(int,numpy.integer)):
+            return self.words(numpy.array([key]))[0]
+        indices = numpy.arange(len(self))[key] if isinstance(key,slice) else numpy.asarray(key,dtype=numpy.int64)
+        order = numpy.argsort(indices,kind='stable')
+        sortedIndices = indices[order]
+        words = self.readLegacy(sortedIndices) if self.run.isLegacy else self.readRows(sortedIndices)
+        if not numpy.array_equal(order,numpy.arange(len(order))):
+            words[order] = words.copy()
+        return words
+
+    def readRows(self,sortedIndices):
+        """One direct read of the raw_data rows of each range of consecutive measurements"""
+        rows = numpy.zeros((len(sortedIndices),)+self.dataset.shape[1:],dtype=self.dataset.dtype)
+        position = 0
+        for start,stop in contiguousRuns(sortedIndices):
+            self.dataset.read_direct(rows,source_sel=numpy.s_[start:stop],dest_sel=numpy.s_[position:position+stop-start])
+            position += stop-start
+        return rows if self.dataset.attrs.get('packing','')=='uint16' else packBits(rows)
+
+    def readLegacy(self,sortedIndices):
+        """Reads the raw_data of each Measurement_# group"""
+        words = numpy.zeros((len(sortedIndices),max(self.nSamples.max(initial=0),1)),dtype=numpy.uint16)
+        for row,index in enumerate(sortedIndices):
+            dataset = self.datasets[index]
+            if dataset is None:
+                continue
+            data = dataset[()]
+            words[row,:len(data)] = data if dataset.attrs.get('packing','')=='uint16' else packBits(data)
+        return words
+
+    def iterBlocks(self,indices=None,blockSize=64):
+        """Generator over the measurements (all, or the indices given) in blocks of blockSize,
+        yielding the indices and the ADC counts of each block"""
+        indices = numpy.arange(len(self)) if indices is None else numpy.asarray(indices)
+        for start in range(0,len(indices),blockSize):
+            blockIndices = indices[start:start+blockSize]
+            yield blockIndices,self[blockIndices]
+
+def scanRuns(filePaths,coluta,channel,blockSize=64,**criteria):
+    """Generator over the selected measurements of one channel in many runs, e.g. a campaign
+    given as a glob pattern, yielding the file path, the indices and the ADC counts of each block"""
+    if isinstance(filePaths,str):
+        filePaths = sorted(glob.glob(filePaths))
+    for filePath in filePaths:
+        with RunReader(filePath) as run:
+            if (coluta,channel) not in run.channels():
+                continue
+            indices = run.select(coluta,channel,**criteria)
+            for blockIndices,adcCounts in run.channel(coluta,channel).iterBlocks(indices,blockSize):
+                yield filePath,blockIndices,adcCounts
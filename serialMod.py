@@ -10,10 +10,13 @@ import serial
 import serial.tools.list_ports as LP
 import time
 import sys
+import configparser
+import threading
 from platform import system
 from PyQt5 import QtWidgets,QtCore
 from PyQt5.QtCore import QThread,QMutex
 import Thread
+import emulatorMod
 
 def findPorts(coluta):
     """Finds the locations of the USB chip in a platform-independent way."""
@@ -95,8 +98,19 @@ def setupSerials(coluta):
         coluta.showError('Unable to connect to chip.')
         return None
 
+def setupEmulator(coluta):
+    """Sets up the software test board in place of the Serial object."""
+    try:
+        return emulatorMod.TestBoardEmulator(coluta.emulatorConfigFile,coluta.dataParserConfig,
+                                             timeout=coluta.timeout)
+    except Exception as error:
+        coluta.showError('Unable to start the emulator: {}'.format(error))
+        return None
+
 def checkSerials(coluta):
     """Check validity of serial connections"""
+    if isinstance(coluta.serial,emulatorMod.TestBoardEmulator):
+        return True
     # For UNIX platforms, is serial.serialposix.Serial
     # For Windows platforms, is serial.serialwin32.Serial
     pf = coluta.platform
@@ -112,8 +126,37 @@ def checkSerials(coluta):
 
     return isPortConnected
 
-def writeToChip(coluta,port,message):
-    """Writes a given message into the given port."""
+# Pacing used when a board has no entry in config/serialConfig.cfg
+defaultPacing = {'status':0.0, 'payload':0.0, 'i2c':0.002, 'reset':0.1}
+
+def loadPacing(coluta,configFile):
+    """Reads the write pacing for the connected board. Falls back to the defaults."""
+    config = configparser.ConfigParser()
+    config.optionxform=str
+    config.read(configFile)
+    # Board sections inherit whatever they do not override from [DEFAULT]
+    boardName = str(coluta.serial_number)
+    section = config[boardName] if config.has_section(boardName) else config['DEFAULT']
+    coluta.drainWrites = section.getboolean('drain',fallback=True)
+    coluta.pacing = {operation:section.getfloat(operation+'_delay',fallback=delay)
+                     for operation,delay in defaultPacing.items()}
+    if coluta.debug:
+        print('SERIALMOD: pacing for {0}:'.format(boardName),coluta.pacing)
+
+def pace(coluta,fifo,operation):
+    """Waits until the FPGA can take the next message after an operation of the given type."""
+    if getattr(coluta,'drainWrites',True):
+        fifo.flush()
+    delay = getattr(coluta,'pacing',defaultPacing).get(operation,0)
+    if delay > 0:
+        time.sleep(delay)
+
+def writeToChip(coluta,port,message,operation=None):
+    """Writes a given message into the given port.
+
+    The operation names the pacing applied after the write (see config/serialConfig.cfg).
+    By default, status words to port B are paced as 'status' and data to port A as 'payload'.
+    """
     # Check message type and convert if necessary
     messageType = type(message)
     if messageType is type(bytearray()):
@@ -130,12 +173,6 @@ def writeToChip(coluta,port,message):
         coluta.showError('SERIALMOD: Message is not of a supported type.')
         return False
     
-    # Get the serial object corresponding to the correct channel
-    try:
-        fifo = coluta.serial
-    except Exception: 
-        fifo = None
-
     # Debug statements
     messageList = []
     for byteMessage in BAMessage:
@@ -143,6 +180,22 @@ def writeToChip(coluta,port,message):
     if coluta.debug:
         print('{} <-'.format(port)," ".join(messageList))
 
+    if operation is None:
+        operation = 'status' if port=='B' else 'payload'
+    # Inside a transaction the message is queued and sent together with the rest of it
+    transaction = getTransaction(coluta)
+    if transaction is not None:
+        return transaction.add(port,BAMessage,operation)
+    return sendToChip(coluta,port,BAMessage,operation)
+
+def sendToChip(coluta,port,BAMessage,operation):
+    """Writes a bytearray to the port in a single write, then paces the next one."""
+    # Get the serial object corresponding to the correct channel
+    try:
+        fifo = coluta.serial
+    except Exception: 
+        fifo = None
+
     if fifo==None:
         if coluta.pOptions.no_connect:
             return True
@@ -153,20 +206,28 @@ def writeToChip(coluta,port,message):
     # Block an unlocked thread before writing to chip
     # block = Thread.block()
     # coluta.logger.addTraceback("{0} <- {1}".format(port, " ".join(messageList)))
-    time.sleep(0.1)
     nBytesWritten = fifo.write(BAMessage)
-    time.sleep(0.01)
     assert nBytesWritten==len(BAMessage), "SERIALMOD: wrote {0} bytes, had to write {1} bytes".format(nBytesWritten,len(BAMessage))
+    pace(coluta,fifo,operation)
     # If an unlocked thread was blocked, release the lock
     # Thread.block(block)    
     return True
 
-def readFromChip(coluta,port,nBytes):
-    """Reads bytes from the chip."""
+def readFromChip(coluta,port,nBytes,buffer=None,timeout=None):
+    """Reads nBytes from the chip, waiting about timeout seconds for them to arrive.
+
+    pySerial reads the bytes and copies them into the buffer, which saves allocating the 
+    output of every read. If a buffer is given, a memoryview of the bytes read is returned 
+    so the caller can reuse the buffer. Otherwise a new bytearray is returned. Either is 
+    shorter than nBytes if the timeout passed first.
+    """
     # Check that positive number of bytes requested.
     if nBytes<=0:
         coluta.showError('SERIALMOD: Non-positive number of bytes requested.')
 
+    # Anything queued in a transaction has to reach the chip before its answer can be read
+    commitTransaction(coluta)
+
     # Get the serial object corresponding to the correct channel
     fifo = coluta.serial
 
@@ -179,38 +240,74 @@ def readFromChip(coluta,port,nBytes):
             coluta.showError('SERIALMOD: Port {} not connected.'.format(port))
             return False
 
-    # Create output array and reset the buffers
-    outputArray = bytearray()
+    if timeout is None:
+        timeout = coluta.timeout
+    isOwnBuffer = buffer is None
+    if isOwnBuffer:
+        buffer = bytearray(nBytes)
+    outputView = memoryview(buffer)[:nBytes]
 
-    # Block an unlocked thread before reading from chip
-    # block = Thread.block()
-    maxReadAttempts = 250
-    nTries   = 0
-    # print('nBytes',nBytes)
-    # print('in_waiting ',fifo.in_waiting)
-    
-    if fifo.in_waiting==0:
-        print('{} ->'.format(port),["{:02x}".format(x) for x in outputArray])
-        return outputArray
-
-    while len(outputArray) < nBytes:# and nTries<maxReadAttempts:
-        # TODO? add breakout after timeout?
-        nTries+=1
-        output = fifo.read(fifo.in_waiting)
-        # print(fifo.in_waiting)
-        for b in output: 
-            outputArray.append(b)
-    # coluta.logger.addTraceback("{0} -> {1}".format(port," ".join(["{:02x}".format(x) for x in outputArray])))
-    # If an unlocked thread was blocked, release the lock
-    # Thread.block(block)
+    # Block in the driver until the requested bytes arrive. The port timeout is only set for
+    # this call, to the time left before the deadline: a read returning nothing means it has
+    # passed without any more bytes
+    deadline = time.monotonic()+timeout
+    portTimeout = fifo.timeout
+    nBytesRead = 0
+    try:
+        while nBytesRead < nBytes and time.monotonic() < deadline:
+            fifo.timeout = max(0,deadline-time.monotonic())
+            nRead = fifo.readinto(outputView[nBytesRead:])
+            if nRead == 0: break
+            nBytesRead += nRead
+    finally:
+        fifo.timeout = portTimeout
+
+    if nBytesRead < nBytes and coluta.debug:
+        print('SERIALMOD: read {0} of {1} bytes before timeout'.format(nBytesRead,nBytes))
+
+    if isOwnBuffer:
+        # Trim the bytearray in place. The view must be released before it can be resized
+        outputView.release()
+        del buffer[nBytesRead:]
+        outputArray = buffer
+    else:
+        outputArray = outputView[:nBytesRead]
 
     if coluta.debug:
        print('{} ->'.format(port),["{:02x}".format(x) for x in outputArray])
 
     return outputArray
 
+# The transactions open in each thread, so that a thread never queues into another's
+threadState = threading.local()
+
+def getTransaction(coluta):
+    """The transaction the calling thread has open on coluta, None outside one."""
+    return getattr(threadState,'transactions',{}).get(id(coluta))
+
+def setTransaction(coluta,transaction):
+    """Opens (or with None, closes) the transaction of the calling thread on coluta."""
+    if not hasattr(threadState,'transactions'):
+        threadState.transactions = {}
+    if transaction is None:
+        threadState.transactions.pop(id(coluta),None)
+    else:
+        threadState.transactions[id(coluta)] = transaction
+
+def commitTransaction(coluta):
+    """Sends whatever the open transaction, if any, has queued so far."""
+    transaction = getTransaction(coluta)
+    if transaction is not None:
+        transaction.commit()
+
+def wait(coluta,seconds):
+    """Sleeps after sending any queued messages, e.g. to hold a reset inside a transaction."""
+    commitTransaction(coluta)
+    time.sleep(seconds)
+
 def flushBuffer(coluta):
     """ Flush the serial buffer to get rid of junk data"""
+    commitTransaction(coluta)
     fifo = coluta.serial
     if fifo is not None:
         fifo.reset_input_buffer()
@@ -7,6 +7,72 @@ date: 8 September 2018
 """
 import serialMod
 import time
+
+class Transaction:
+    """Queues the status words (FIFO B) and payloads (FIFO A) of a sequence of operations.
+
+    Opened with Status.transaction() as a context manager. Every writeToChip call made inside
+    the block is added to one buffer instead of being written, and the buffer is sent when 
+    the block ends, before a read or buffer flush, or after an operation whose pacing needs
+    the FPGA to catch up. Operations are triggered on rising edges, so a status word equal 
+    to the previous one does nothing and is dropped. Nested transactions join the outer one.
+    The transaction belongs to the thread that opened it, see serialMod.getTransaction, and
+    holds the serial lock of the board, if any, until it is sent.
+    """
+    def __init__(self,coluta):
+        self.coluta = coluta
+        self.buffer = bytearray()
+        self.operation = 'status' # pacing applied after the buffer is sent
+        self.lastStatus = None
+        self.isOuter = False
+        self.nWrites = 0
+        self.lock = None # the serial lock of the board, held by the outer transaction
+
+    def __enter__(self):
+        if serialMod.getTransaction(self.coluta) is None:
+            self.lock = getattr(self.coluta,'serialLock',None)
+            if self.lock is not None:
+                self.lock.acquire()
+            serialMod.setTransaction(self.coluta,self)
+            self.isOuter = True
+        return serialMod.getTransaction(self.coluta)
+
+    def __exit__(self,*exception):
+        if self.isOuter:
+            try:
+                self.commit()
+            finally:
+                serialMod.setTransaction(self.coluta,None)
+                if self.lock is not None:
+                    self.lock.release()
+            if self.coluta.debug:
+                print('STATUS: transaction sent in {} writes'.format(self.nWrites))
+        return False
+
+    def add(self,port,message,operation):
+        """Queue a message. Returns True, like writeToChip."""
+        if port=='B':
+            if message==self.lastStatus: return True
+            self.lastStatus = bytes(message)
+        self.buffer += message
+        self.operation = operation
+        # Close the write after anything the FPGA needs time to carry out
+        pacing = getattr(self.coluta,'pacing',serialMod.defaultPacing)
+        if pacing.get(operation,0) > 0:
+            self.commit()
+        return True
+
+    def commit(self):
+        """Send the queued messages in a single write."""
+        if len(self.buffer)==0: return True
+        serialResult = serialMod.sendToChip(self.coluta,'AB',self.buffer,self.operation)
+        self.buffer = bytearray()
+        self.operation = 'status'
+        # What follows is compared with nothing sent yet, so that it is never dropped
+        self.lastStatus = None
+        self.nWrites += 1
+        return serialResult
+
 class Status:
     """Status class definition."""
     def __init__(self,coluta):
@@ -40,9 +106,13 @@ class Status:
                  (self.startControlOperation)),
                 255]
 
-    def send(self,coluta):
+    def transaction(self,coluta):
+        """Coalesce the writes made inside a with-block into as few USB writes as possible."""
+        return Transaction(coluta)
+
+    def send(self,coluta,operation='status'):
         integerStatus = self.read()
-        serialMod.writeToChip(coluta,'B',integerStatus)
+        serialMod.writeToChip(coluta,'B',integerStatus,operation)
 
     # Ray Xu Feb 23, 2018: perform coluta reset
     # This is done by bringing status byte 2, bit 5 to high state then back to low state
@@ -51,8 +121,7 @@ class Status:
         print('Hard reset ... ')
         # coluta.logger.addEntry('ERROR','HARD RESET')
         self.colutaReset = 1
-        self.send(coluta)
-        time.sleep(0.1)
+        self.send(coluta,'reset')
         self.colutaReset = 0
         self.send(coluta)
 
@@ -88,13 +157,13 @@ class Status:
 
     def sendSoftwareReset(self,coluta):
         self.softwareReset = 1
-        self.send(coluta)
+        self.send(coluta,'reset')
         self.softwareReset = 0
 
     def sendI2Ccommand(self,coluta):
         self.startControlOperation = 1
         self.fifoAOperation = 1
-        self.send(coluta)
+        self.send(coluta,'i2c')
         self.startControlOperation = 0
         self.fifoAOperation = 0
 
@@ -117,10 +186,11 @@ class Status:
         self.readStatus = 0 
 
     def sendCalibrationPulse(self,coluta):
-        self.send(coluta)
-        self.resetTrigger = 1
-        self.startMeasurement = 1
-        self.send(coluta)
+        with self.transaction(coluta):
+            self.send(coluta)
+            self.resetTrigger = 1
+            self.startMeasurement = 1
+            self.send(coluta)
         self.resetTrigger = 0
         self.startMeasurement = 0 
 # end Status
\ No newline at end of file
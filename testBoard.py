@@ -6,14 +6,18 @@ email: burton@utexas.edu
 date: 7 August 2018
 """
 
-import sys,optparse
+import sys,optparse,multiprocessing
 from PyQt5 import QtWidgets,QtGui
 import testBoardGUI
 
 if __name__ == "__main__":
+    # The decoding processes of acquisitionMod are spawned, also from frozen executables
+    multiprocessing.freeze_support()
     parser = optparse.OptionParser(usage='Usage: %prog [options]')
     parser.add_option('-n','--no-connect',action='store_true',
                       help='For testing without a board.')
+    parser.add_option('-e','--emulate',action='store_true',
+                      help='Run against a software emulation of the board.')
     parser.add_option('-d','--debug',action='store_true',
                       help='Enter debug mode.')
     parser.add_option('-i','--instruments',action='store_true',
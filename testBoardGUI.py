@@ -26,6 +26,9 @@ import status
 import programClockChip
 from datetime import datetime
 import instrumentControlMod
+import acquisitionMod
+import qaMod
+import pulseMod
 
 qtCreatorFile = colutaMod.resourcePath('testboard.ui')
 Ui_MainWindow,QtBaseClass = uic.loadUiType(qtCreatorFile)
@@ -61,6 +64,8 @@ class testBoardGUI(QtWidgets.QMainWindow,Ui_MainWindow):
         self.stopbits = 1
         self.bytesize = 8
         self.timeout = 2
+        self.serialConfigFile = colutaMod.resourcePath('./config/serialConfig.cfg')
+        self.emulatorConfigFile = colutaMod.resourcePath('./config/emulatorConfig.cfg')
 
         # Default attributes for hdf5 output, overwritten by instrument control
         self.runType = 'sine'
@@ -77,14 +82,24 @@ class testBoardGUI(QtWidgets.QMainWindow,Ui_MainWindow):
         self.discarded = 0 # first N samples of readout are discarded by software (MSB end)
         self.dataWords = 32 # number of bytes for each data FPGA counter increment
         self.dualPortBufferDepth = 4095 # max number of samples 
+        self.readoutBuffer = bytearray(self.dataWords*self.dualPortBufferDepth) # reused by fifoAReadData
         self.controlWords = 8 # number of bytes for each control FPGA counter increment
+        self.readbackInterval = 0.5 # seconds between two polls of the DAC and link ready readbacks
         self.frequency = 40 # MHz clock frequency
+        # Repeated measurements are read and processed in parallel if pipelined
+        acquisitionMod.loadSettings(self,colutaMod.resourcePath('./config/acquisitionConfig.cfg'))
+        # Windowing and bins of the FFT quality metrics
+        qaMod.loadSettings(self,colutaMod.resourcePath('./config/qaConfig.cfg'))
+        self.spectrumAverage = None # spectra averaged over a repeat run, see startSpectrumAverage
+        # Folding of the pulse run captures saved with the run
+        pulseMod.loadSettings(self,colutaMod.resourcePath('./config/pulseConfig.cfg'))
         # Instance of the Status class. Communicates with FIFO B.
         self.status = status.Status(self)
 
         # Instance of the DataParser class.
-        dataParserConfig = colutaMod.resourcePath('./config/dataConfig.cfg')
-        self.ODP = dataParser.dataParser(self,dataParserConfig)
+        self.dataParserConfig = colutaMod.resourcePath('./config/dataConfig.cfg')
+        self.ODP = dataParser.dataParser(self,self.dataParserConfig,
+                                         outputDirectory=getattr(self.pOptions,'output_directory',None))
 
         # Configurations for each chip
         self.lpgbtConfigurations   = {}
@@ -128,6 +143,16 @@ class testBoardGUI(QtWidgets.QMainWindow,Ui_MainWindow):
         self.standardAmplitudesTakeSamplesBox.clicked.connect(self.takeStandardAmplitudes)
         self.standardAwgRun.clicked.connect(self.takeStandardAwg)
         self.pedestalRunBox.clicked.connect(self.takePedestal)
+        self.takeHistogramButton.clicked.connect(self.takeHistogramRepeat)
+        # The conditions saved with the data are read from these widgets again only after a change
+        for box in [self.controlSPIInstructionBox,self.lauroc1slowcontrolch1dacVdcLGBox,self.lauroc1slowcontrolch1dacVdcHGBox]:
+            box.textChanged.connect(self.ODP.markConditionsDirty)
+        self.controlLAUROCDynamicRangeBox.currentIndexChanged.connect(self.ODP.markConditionsDirty)
+        for group in ['coluta1','coluta2']:
+            for ch in ['ch1','ch2']:
+                getattr(self,group+ch+'GSBox').stateChanged.connect(self.ODP.markConditionsDirty)
+                getattr(self,group+ch+'MSBox').stateChanged.connect(self.ODP.markConditionsDirty)
+                getattr(self,group+ch+'ArithmeticModeBox').currentIndexChanged.connect(self.ODP.markConditionsDirty)
         # other buttons
         self.nSamplesBox.textChanged.connect(self.updateNSamples)
         self.sendCalibrationPulseBox.clicked.connect(lambda:self.status.sendCalibrationPulse(self))
@@ -264,14 +289,23 @@ class testBoardGUI(QtWidgets.QMainWindow,Ui_MainWindow):
             self.port = 'Placeholder A'
             self.serial = None
             self.serial_number = None
+            serialMod.loadPacing(self,self.serialConfigFile)
         else:
-            # Real startup routine when board is connected
-            # Find the port and store the names
-            portDict = serialMod.findPorts(self)
-            self.port = portDict['AB']
-            # Set up the serial connections to each port, pause, and test
-            self.serial = serialMod.setupSerials(self)
-            time.sleep(0.01)
+            if self.pOptions.emulate:
+                # Software test board standing in for the serial port
+                self.port = 'Emulator'
+                self.serial_number = 'EMULATOR'
+                self.serial = serialMod.setupEmulator(self)
+            else:
+                # Real startup routine when board is connected
+                # Find the port and store the names
+                portDict = serialMod.findPorts(self)
+                self.port = portDict['AB']
+                # Set up the serial connections to each port, pause, and test
+                self.serial = serialMod.setupSerials(self)
+                time.sleep(0.01)
+            # Pacing of the writes measured for this board, found by its serial number
+            serialMod.loadPacing(self,self.serialConfigFile)
             self.handshake()
             # Reset the status bits to zero, then reset the FPGA
             self.status.initializeUSB(self)
@@ -348,6 +382,8 @@ class testBoardGUI(QtWidgets.QMainWindow,Ui_MainWindow):
         """Close connection to serial ports."""
         if self.serial is not None and self.serial.isOpen():
             self.serial.close()
+        self.ODP.closeRunFile()
+        acquisitionMod.closeDecodePool(self)
 
         self.isConnected = False
 
@@ -383,11 +419,12 @@ class testBoardGUI(QtWidgets.QMainWindow,Ui_MainWindow):
         bits = "".join(bitsList)
         # N.B. "sendFifoAOperation" args are (GUI,operation,counter,address)
         # operaton '1' is control register write
-        self.status.sendFifoAOperation(self,1,nByte,address)
-        serialResult = serialMod.writeToChip(self,'A',bits)
-        self.status.sendStartControlOperation(self,1,address)
-        if reset: # reset the status bits again
-            self.status.send(self)
+        with self.status.transaction(self):
+            self.status.sendFifoAOperation(self,1,nByte,address)
+            serialResult = serialMod.writeToChip(self,'A',bits)
+            self.status.sendStartControlOperation(self,1,address)
+            if reset: # reset the status bits again
+                self.status.send(self)
         return serialResult
 
     def fifoAReadControl(self,chip,categoryName):
@@ -446,7 +483,7 @@ class testBoardGUI(QtWidgets.QMainWindow,Ui_MainWindow):
             self.status.send(self)
             bytesToString = colutaMod.byteArrayToString(controlBits)
             counter += 1
-            time.sleep(0.5)
+            if not bytesToString: time.sleep(self.readbackInterval)
         return [bytesToString[i*8:(i+1)*8] for i in range(nControlBytes)][::-1]
 
     def configureAndReadBackDAC(self):
@@ -481,7 +518,7 @@ class testBoardGUI(QtWidgets.QMainWindow,Ui_MainWindow):
             self.status.send(self)
             bytesToString = colutaMod.byteArrayToString(controlBits)
             counter += 1
-            time.sleep(0.5)
+            if not bytesToString: time.sleep(self.readbackInterval)
         print(bytesToString)
         if bytesToString:
             isReady = bytesToString[4]=='1'
@@ -511,28 +548,51 @@ class testBoardGUI(QtWidgets.QMainWindow,Ui_MainWindow):
             print('big success')
             print(counter)
 
-    def fifoAReadData(self,nSamples):
+    def fifoAReadData(self,nSamples,buffer=None):
         """Requests measurement, moves data to buffer, and performs read operation"""
 
         # 1) Send a start measurement command to the chip
         # 2) Clear the serial buffer (MANDATORY!!!!!) 
         # 3) Fill the serial buffer with data from the chip
         # 4) Read the data filled in the serial buffer
-        address = 1 # LpGBT address
-        self.status.send(self) # reset the rising edge
-        self.status.sendStartMeasurement(self)
-        serialMod.flushBuffer(self) # not sure if we need to flush buffer, D.P.
-        # One analog measurement will return 16 bytes, thus ask for 2*number of samples requested
-        self.status.sendFifoAOperation(self,2,int(2*(self.discarded+self.nSamples)),address=address)
-        time.sleep(0.01) # Wait for data to be filled in the USB buffer
-        dataByteArray = serialMod.readFromChip(self,'A',self.dataWords*(self.discarded+self.nSamples)) 
-        # dataByteArray = serialMod.readFromChip(self,'A',14)
-        self.status.send(self) # reset the rising edge
-        # return dataByteArray
-        first = self.discarded*self.dataWords
-        last = (self.discarded+self.nSamples)*self.dataWords
-        return dataByteArray[first:last]
+        # The reader thread of a pipelined run and the GUI thread take turns on the port
+        with self.serialLock:
+            address = 1 # LpGBT address
+            self.status.send(self) # reset the rising edge
+            self.status.sendStartMeasurement(self)
+            serialMod.flushBuffer(self) # not sure if we need to flush buffer, D.P.
+            # One analog measurement will return 16 bytes, thus ask for 2*number of samples requested
+            self.status.sendFifoAOperation(self,2,int(2*(self.discarded+self.nSamples)),address=address)
+            # Read straight into the readout buffer, which is reused between measurements
+            nBytes = int(self.dataWords*(self.discarded+self.nSamples))
+            if buffer is None:
+                if len(self.readoutBuffer) < nBytes:
+                    self.readoutBuffer = bytearray(nBytes)
+                buffer = self.readoutBuffer
+            dataByteArray = serialMod.readFromChip(self,'A',nBytes,buffer=buffer)
+            # dataByteArray = serialMod.readFromChip(self,'A',14)
+            self.status.send(self) # reset the rising edge
+            # return dataByteArray
+            first = self.discarded*self.dataWords
+            last = int((self.discarded+self.nSamples)*self.dataWords)
+            return dataByteArray[first:last]
     
+    def fifoAReadHistogram(self):
+        """Requests a measurement and reads the histogram buffer of the FPGA"""
+        histogramSettings = self.ODP.histogram
+        address = self.ODP.getHistogramAddress()
+        nWords = int(histogramSettings.getSetting('n_words'))
+        # The reader thread of a pipelined run and the GUI thread take turns on the port
+        with self.serialLock:
+            self.status.send(self) # reset the rising edge
+            self.status.sendStartMeasurement(self)
+            serialMod.flushBuffer(self)
+            # A control register read returns 8 bytes per count, one histogram word
+            self.status.sendFifoAOperation(self,2,nWords,address=address)
+            dataByteArray = serialMod.readFromChip(self,'A',nWords*self.ODP.getHistogramLayout().bytesPerWord)
+            self.status.send(self) # reset the rising edge
+            return dataByteArray
+
     def updateNSamples(self):
         try:
             self.nSamples = int(self.nSamplesBox.toPlainText())
@@ -563,17 +623,29 @@ class testBoardGUI(QtWidgets.QMainWindow,Ui_MainWindow):
 
         if self.pOptions.no_connect: return
         self.updateStatusBar('Writing data')
-        # Display the data on the GUI window in groups of 32 bits and in groups on 16 bits on the 
-        # terminal window for Jaro
+        self.displayReadout(dataByteArray)
+
+        conditions = self.ODP.getRunConditions()
+        self.ODP.parseData('coluta',self.nSamples,dataByteArray)
+        self.ODP.writeDataToFile(writeHDF5File=saveHDF5,writeCSVFile=csv,conditions=conditions)
+        self.ODP.archiveCapture(dataByteArray,conditions)
+        self.addToSpectrumAverage()
+
+        self.drawData(doDraw,doFFT)
+        self.updateStatusBar()
+        self.updateAlignment()
+
+    def displayReadout(self,dataByteArray):
+        """Shows the readout on the GUI window in groups of 32 bits"""
+        # and in groups on 16 bits on the terminal window for Jaro
         dataString = colutaMod.byteArrayToString(dataByteArray)
         dataStringByteChunks = "\n".join([dataString[i:i+32] for i in range(0,len(dataString),32)])
         dataStringByteChunks16 = "\n".join([dataString[i:i+16] for i in range(0,len(dataString),16)])
         if self.debug: print(dataStringByteChunks16)
         self.controlTextBox.setPlainText(dataStringByteChunks)
 
-        self.ODP.parseData('coluta',self.nSamples,dataString)
-        self.ODP.writeDataToFile(writeHDF5File=saveHDF5,writeCSVFile=csv)
-
+    def drawData(self,doDraw=True,doFFT=False):
+        """Plots the selected channel of the last parsed measurement, and its FFT"""
         plotChip = self.plotChipBox.currentText().lower()
         plotChannel = self.plotChannelBox.currentText()
         channelsRead = getattr(self.ODP,plotChip).getSetting('data_channels')
@@ -587,17 +659,106 @@ class testBoardGUI(QtWidgets.QMainWindow,Ui_MainWindow):
             adcData = decimalDict[plotChannel]
             self.dataDisplay.updateFigure(adcData,np.arange(len(adcData)))
             if doFFT:
-                freq,psd,QA = colutaMod.doFFT(self,adcData)
-                QAList = [plotChannel.upper(),
+                # During a repeat run, the spectrum averaged over the captures so far
+                averaged = self.spectrumAverage.spectrum((plotChip,plotChannel)) if self.spectrumAverage else None
+                if averaged is not None:
+                    freq,psd,QA = averaged
+                    title = '{0} (average of {1})'.format(plotChannel.upper(),self.spectrumAverage.nCaptures)
+                else:
+                    freq,psd,QA = colutaMod.doFFT(self,adcData)
+                    title = plotChannel.upper()
+                QAList = [title,
                           'ENOB: {:2f}'.format(QA['ENOB']),
                           'SNR: {:2f} dB'.format(QA['SNR']),
                           'SFDR: {:2f} dB'.format(QA['SFDR']),
                           'SINAD: {:2f} dB'.format(QA['SINAD'])]
+                sineFit = self.ODP.getSineFit(plotChip,plotChannel) if self.doSineFit else None
+                if sineFit is not None:
+                    QAList += ['Sine fit ENOB: {:2f}'.format(sineFit['ENOB']),
+                               'Sine fit SINAD: {:2f} dB'.format(sineFit['SINAD']),
+                               'Sine fit frequency: {:6f} MHz'.format(sineFit['frequency'])]
                 QAStr = '\n'.join(QAList)
                 self.controlTextBox.setPlainText(QAStr)
                 self.fftDisplay.updateFigure(psd,freq)
 
+    def takeSamplesPipelined(self,nReads,trigger=None):
+        """Takes nReads measurements, reading the next one while the last one is parsed and saved"""
+        doFFT = self.doFFTBox.isChecked()
+        saveHDF5 = self.saveHDF5Box.isChecked()
+        csv = self.saveCSVBox.isChecked()
+        if not self.isConnected:
+            self.showError('Chip is not connected.')
+            return
+        throttle = acquisitionMod.PlotThrottle(self.plotInterval)
+
+        def process(measurementTime,dataByteArray,isLast):
+            self.measurementTime = measurementTime
+            self.ODP.parseData('coluta',self.nSamples,dataByteArray)
+            self.ODP.writeDataToFile(writeHDF5File=saveHDF5,writeCSVFile=csv,conditions=self.ODP.getRunConditions())
+            self.addToSpectrumAverage()
+            # Only redraw at the display rate, the file has every measurement
+            if throttle.isDue(isLast):
+                self.displayReadout(dataByteArray)
+                self.drawData(doFFT=doFFT)
+
+        def processDecoded(measurementTime,decoded,isLast):
+            self.measurementTime = measurementTime
+            self.ODP.setDecodedData(decoded)
+            self.ODP.writeDataToFile(writeHDF5File=saveHDF5,writeCSVFile=csv,conditions=self.ODP.getRunConditions())
+            self.addToSpectrumAverage()
+            if throttle.isDue(isLast):
+                self.drawData(doFFT=doFFT)
+
+        self.updateStatusBar('Taking data')
+        try:
+            if self.decodeWorkers > 0:
+                # The captures are decoded by a pool of processes, see config/acquisitionConfig.cfg
+                acquisition = acquisitionMod.ParallelAcquisition(self,nReads,processDecoded,
+                                                                 acquisitionMod.getDecodePool(self),
+                                                                 self.ODP.getDecodePlan(),
+                                                                 self.ODP.channelWeights(),trigger=trigger,
+                                                                 queueDepth=self.queueDepth,
+                                                                 archive=self.ODP.archiveCapture)
+            else:
+                acquisition = acquisitionMod.PipelinedAcquisition(self,nReads,process,trigger=trigger,
+                                                                  queueDepth=self.queueDepth,
+                                                                  archive=self.ODP.archiveCapture)
+            acquisition.run()
+        except Exception as error:
+            self.showError('Data taking stopped: {}'.format(error))
         self.updateStatusBar()
+        self.updateAlignment()
+
+    def updateAlignment(self):
+        """Saves the channel rolls the parser found on the last captures for this board, and
+        shows what it reported about the alignment, see [ALIGNMENT] in config/dataConfig.cfg"""
+        if self.ODP.alignmentChanged:
+            self.ODP.saveAlignment()
+        if self.ODP.alignmentStatus is not None:
+            self.updateStatusBar(self.ODP.alignmentStatus)
+            self.ODP.alignmentStatus = None
+
+    def usePipeline(self):
+        """Repeated data taking is pipelined when enabled in config/acquisitionConfig.cfg"""
+        return self.pipelined and not self.pOptions.no_connect
+
+    def startSpectrumAverage(self):
+        """With "Do FFT" checked, the spectra of the captures of a repeat run are averaged"""
+        if self.doFFTBox.isChecked():
+            self.spectrumAverage = qaMod.SpectrumAverage(self.frequency,self.qaSettings,self.qaMaxHold)
+
+    def addToSpectrumAverage(self):
+        if self.spectrumAverage is not None:
+            channels = self.ODP.dataChannels()
+            samples = self.ODP.getChannelSamples(channels)
+            if samples is not None:
+                self.spectrumAverage.add(channels,samples)
+
+    def finishSpectrumAverage(self):
+        """Saves the averaged spectra with the run when "Save HDF5" is checked"""
+        if self.spectrumAverage is not None and self.spectrumAverage.nCaptures and self.saveHDF5Box.isChecked():
+            self.ODP.writeSpectrumToFile(self.spectrumAverage)
+        self.spectrumAverage = None
 
     def takeSamplesRepeat(self):
         """Repeats data taking N times without sending trigger"""
@@ -606,11 +767,55 @@ class testBoardGUI(QtWidgets.QMainWindow,Ui_MainWindow):
         except:
             self.showError('Invalid entry in repeat data box')
             return
-        for i in range(nReads):
-            self.takeSamples()
-            time.sleep(0.1)
+        self.startSpectrumAverage()
+        if self.usePipeline():
+            self.takeSamplesPipelined(nReads)
+        else:
+            for i in range(nReads):
+                self.takeSamples()
+                time.sleep(0.1)
+        self.finishSpectrumAverage()
         print("Done taking repeat samples")
 
+    def takeHistogramRepeat(self):
+        """Sums the FPGA histograms of N reads, then draws and saves the sum"""
+        try:
+            nReads = int(self.repeatDataBox.toPlainText())
+        except:
+            self.showError('Invalid entry in repeat data box')
+            return
+        if not self.isConnected and not self.pOptions.no_connect:
+            self.showError('Chip is not connected.')
+            return
+        try:
+            address = self.ODP.getHistogramAddress()
+        except ValueError as error:
+            self.showError(str(error))
+            return
+        if address is None:
+            self.showError('No FPGA histogram address: set fpga_address in [HISTOGRAM] of config/dataConfig.cfg')
+            return
+        self.updateStatusBar('Taking histogram')
+        nWords = int(self.ODP.histogram.getSetting('n_words'))
+        self.ODP.resetHistogram()
+        for i in range(nReads):
+            self.measurementTime = datetime.now().strftime("%y_%m_%d_%H_%M_%S.%f")
+            dataByteArray = self.fifoAReadHistogram()
+            if self.pOptions.no_connect: return
+            self.ODP.parseData('histogram',nWords,dataByteArray)
+        if self.saveHDF5Box.isChecked():
+            self.ODP.writeHistogramToFile()
+
+        # Draw the bins between the first and last filled ones
+        filledBins = np.flatnonzero(self.ODP.histogramSum)
+        self.dataDisplay.resetData()
+        self.fftDisplay.resetData()
+        if len(filledBins):
+            bins = np.arange(filledBins[0],filledBins[-1]+1)
+            self.dataDisplay.updateFigure(self.ODP.histogramSum[bins],bins)
+        self.updateStatusBar()
+        print("Done taking histogram")
+
     def takeAWGSamplesRepeat(self):
         """Repeats data taking N number of times"""
         try:
@@ -619,9 +824,15 @@ class testBoardGUI(QtWidgets.QMainWindow,Ui_MainWindow):
             self.showError('Invalid entry in repeat data box')
             return
         if self.pOptions.instruments:
-            for i in range(nReads):
-                self.sendAFGPulseTakeSamples()
-                time.sleep(0.1)
+            self.startSpectrumAverage()
+            if self.usePipeline():
+                self.setPulseRun('pulse')
+                self.takeSamplesPipelined(nReads,trigger=self.function_generator.sendTriggeredPulse)
+            else:
+                for i in range(nReads):
+                    self.sendAFGPulseTakeSamples()
+                    time.sleep(0.1)
+            self.finishSpectrumAverage()
             print("Done taking repeat samples")
         else:
             self.showError("ERROR: No external AWG found")
@@ -635,9 +846,13 @@ class testBoardGUI(QtWidgets.QMainWindow,Ui_MainWindow):
             self.showError('Invalid entry in repeat data box')
             return
         self.configureDAC()
-        for i in range(nReads):
-            self.sendPulseTakeSamples()
-            time.sleep(0.1)
+        if self.usePipeline():
+            self.setPulseRun('onboard')
+            self.takeSamplesPipelined(nReads,trigger=lambda:self.status.sendCalibrationPulse(self))
+        else:
+            for i in range(nReads):
+                self.sendPulseTakeSamples()
+                time.sleep(0.1)
         self.configureDAC(reset=True)
         print("Done taking repeat samples")
 
@@ -680,8 +895,11 @@ class testBoardGUI(QtWidgets.QMainWindow,Ui_MainWindow):
             self.showError('Invalid entry in repeat data box')
             return
         self.runType = 'pedestal'
-        for i in range(nReads):
-            self.takeSamples()
+        if self.usePipeline():
+            self.takeSamplesPipelined(nReads)
+        else:
+            for i in range(nReads):
+                self.takeSamples()
         print("Done taking repeat pedestal")
 
     def selectI2Cinterface(self,fifoOperation,auxRegAddress,reset=False):
@@ -692,11 +910,12 @@ class testBoardGUI(QtWidgets.QMainWindow,Ui_MainWindow):
         bitsSplit = [bits[i:i+8] for i in range(0,len(bits),8)][::-1]
         bits = "".join(bitsSplit)
         # bits = "0000101000001010"
-        self.status.send(self) # Reset for rising edge
-        self.status.sendFifoAOperation(self,fifoOperation,counter=2,address=6)
-        serialResult = serialMod.writeToChip(self,'A',bits)
-        if reset:
-            self.status.send(self)
+        with self.status.transaction(self):
+            self.status.send(self) # Reset for rising edge
+            self.status.sendFifoAOperation(self,fifoOperation,counter=2,address=6)
+            serialResult = serialMod.writeToChip(self,'A',bits)
+            if reset:
+                self.status.send(self)
         return serialResult
 
     def selectI2CinterfaceAndCalPulses(self,fifoOperation=1,auxRegAddress=None,reset=False):
@@ -712,11 +931,12 @@ class testBoardGUI(QtWidgets.QMainWindow,Ui_MainWindow):
         bitsSplit = [bits[i:i+8] for i in range(0,len(bits),8)][::-1]
         bits = "".join(bitsSplit)
 
-        self.status.send(self) # Reset for rising edge
-        self.status.sendFifoAOperation(self,fifoOperation,counter=2,address=6)
-        serialResult = serialMod.writeToChip(self,'A',bits)
-        if reset:
-            self.status.send(self)
+        with self.status.transaction(self):
+            self.status.send(self) # Reset for rising edge
+            self.status.sendFifoAOperation(self,fifoOperation,counter=2,address=6)
+            serialResult = serialMod.writeToChip(self,'A',bits)
+            if reset:
+                self.status.send(self)
         return serialResult
 
     def setupConfigurations(self,configDict,cfgFile,tabName):
@@ -879,9 +1099,9 @@ class testBoardGUI(QtWidgets.QMainWindow,Ui_MainWindow):
         """Initial configuration of the LpGBT registers"""
         print('Configuring LpGBT')
         self.LpGBTControl(lpgbtRstb='1',linkResetPulse='0')
-        time.sleep(0.1)
+        serialMod.wait(self,0.1)
         self.LpGBTControl(lpgbtRstb='0',linkResetPulse='0')
-        time.sleep(0.1)
+        serialMod.wait(self,0.1)
         self.LpGBTControl(lpgbtRstb='1',linkResetPulse='0')
         # serialResult = colutaMod.i2cWrite(self,'lpgbt','psdllconfig')
         for catName in self.lpgbtConfigurations:
@@ -889,7 +1109,7 @@ class testBoardGUI(QtWidgets.QMainWindow,Ui_MainWindow):
            #      '{0:02x}'.format(int(str(self.lpgbtConfigurations[catName].bits),2)))
             colutaMod.i2cWrite(self, 'lpgbt', catName)
             # self.readLpGBT(catName)
-        time.sleep(2)
+        serialMod.wait(self,2)
         self.LpGBTControl(linkResetPulse='1')
 
     def readLpGBT(self,category):
@@ -951,10 +1171,11 @@ class testBoardGUI(QtWidgets.QMainWindow,Ui_MainWindow):
         bits = "".join(bitsSplit)
         nBits = len(bits)
         nByte = int(nBits/8)
-        self.status.sendFifoAOperation(self,1,nByte,address)
-        serialResult = serialMod.writeToChip(self,'A',bits)
-        self.status.sendStartControlOperation(self,1,address)
-        self.status.send(self)
+        with self.status.transaction(self):
+            self.status.sendFifoAOperation(self,1,nByte,address)
+            serialResult = serialMod.writeToChip(self,'A',bits)
+            self.status.sendStartControlOperation(self,1,address)
+            self.status.send(self)
 
     def configureColuta(self,chip):
         print('Configuring {}'.format(chip.upper()))
@@ -979,9 +1200,10 @@ class testBoardGUI(QtWidgets.QMainWindow,Ui_MainWindow):
         dataBitsSplit = [dataBits[i:i+8] for i in range(0,len(dataBits),8)][::-1]
         dataBitsToSend = "".join(dataBitsSplit)
         
-        self.status.sendFifoAOperation(self,operation=1,counter=2,address=5)
-        serialMod.writeToChip(self,'A',dataBitsToSend)
-        self.status.sendStartControlOperation(self,operation=1,address=5)
+        with self.status.transaction(self):
+            self.status.sendFifoAOperation(self,operation=1,counter=2,address=5)
+            serialMod.writeToChip(self,'A',dataBitsToSend)
+            self.status.sendStartControlOperation(self,operation=1,address=5)
 
 
     def LpGBTControl(self,linkResetPulse='0',lpgbtRstb='1',lpgbtMode='1001'):
@@ -1018,11 +1240,12 @@ class testBoardGUI(QtWidgets.QMainWindow,Ui_MainWindow):
         # dataBitsToSend = "1000000010010110000111100".zfill(64)
         dataBitsSplit = [dataBitsToSend[i:i+8] for i in range(0,len(dataBitsToSend),8)][::-1]
         dataBitsToSend = "".join(dataBitsSplit)
-        self.status.send(self)
-        self.status.sendFifoAOperation(self,operation=1,counter=7,address=1)
-        serialMod.writeToChip(self,'A',dataBitsToSend)
-        self.status.sendStartControlOperation(self,operation=1,address=1)
-        self.status.send(self)
+        with self.status.transaction(self):
+            self.status.send(self)
+            self.status.sendFifoAOperation(self,operation=1,counter=7,address=1)
+            serialMod.writeToChip(self,'A',dataBitsToSend)
+            self.status.sendStartControlOperation(self,operation=1,address=1)
+            self.status.send(self)
 
     def configureDAC(self,startup=False,reset=False):
         if self.debug:
@@ -1054,11 +1277,12 @@ class testBoardGUI(QtWidgets.QMainWindow,Ui_MainWindow):
 
         dataBitsSplit = [dataBitsToSend[i:i+8] for i in range(0,len(dataBitsToSend),8)][::-1]
         dataBitsToSend = "".join(dataBitsSplit)
-        self.status.sendFifoAOperation(self,operation=1,counter=4,address=2)
-        serialMod.writeToChip(self,'A',dataBitsToSend)
-        self.status.sendStartControlOperation(self,operation=1,address=2)
-        # self.status.sendCalibrationPulse(self)
-        self.status.send(self)
+        with self.status.transaction(self):
+            self.status.sendFifoAOperation(self,operation=1,counter=4,address=2)
+            serialMod.writeToChip(self,'A',dataBitsToSend)
+            self.status.sendStartControlOperation(self,operation=1,address=2)
+            # self.status.sendCalibrationPulse(self)
+            self.status.send(self)
         if startup: 
             # puts a reasonable pulse height in the text box after startup is done
             self.controlSPIInstructionBox.document().setPlainText('256')
@@ -1088,15 +1312,24 @@ class testBoardGUI(QtWidgets.QMainWindow,Ui_MainWindow):
         dataBitsSplit = [dataBitsToSend[i:i+8] for i in range(0,len(dataBitsToSend),8)][::-1]
         dataBitsToSend = "".join(dataBitsSplit)
 
-        self.status.send(self) # Reset for rising edge
-        self.status.sendFifoAOperation(self,1,counter=2,address=6)
-        serialMod.writeToChip(self,'A',dataBitsToSend)
+        with self.status.transaction(self):
+            self.status.send(self) # Reset for rising edge
+            self.status.sendFifoAOperation(self,1,counter=2,address=6)
+            serialMod.writeToChip(self,'A',dataBitsToSend)
+
+    def setPulseRun(self,runType):
+        '''Sets the run attributes saved with pulses from the on-board pulser or the external AWG'''
+        if runType=='onboard':
+            self.awgFreq = 320
+            self.pulseLength = 440 
+        else:
+            self.awgFreq = 1200
+            self.pulseLength = 64
+        self.runType = runType
 
     def sendPulseTakeSamples(self):
         '''Sends calibration pulse and take samples'''
-        self.awgFreq = 320
-        self.pulseLength = 440 
-        self.runType = 'onboard'
+        self.setPulseRun('onboard')
         self.status.sendCalibrationPulse(self)
         self.takeSamples()
 
@@ -1115,9 +1348,7 @@ class testBoardGUI(QtWidgets.QMainWindow,Ui_MainWindow):
     def sendAFGPulseTakeSamples(self):
         # self.updateNSamplesBurstMode()
         if self.pOptions.instruments:
-            self.awgFreq = 1200
-            self.pulseLength = 64
-            self.runType = 'pulse'
+            self.setPulseRun('pulse')
             self.function_generator.sendTriggeredPulse()
             self.takeSamples()
         else:
@@ -1125,9 +1356,10 @@ class testBoardGUI(QtWidgets.QMainWindow,Ui_MainWindow):
             return
 
     def sendExternalTrigger(self):
-        self.status.send(self)
-        self.status.updatePulseDelay(self)
-        self.status.send(self)
+        with self.status.transaction(self):
+            self.status.send(self)
+            self.status.updatePulseDelay(self)
+            self.status.send(self)
 
     def configureLAUROCDynamicRange(self):
         """Set the default dynamic range values for the two LAUROC chips"""
@@ -0,0 +1,85 @@
+"""Shared fixtures of the tests. The modules are imported from the repository root, as the GUI does."""
+
+import os
+import sys
+import optparse
+import threading
+import pytest
+
+repositoryDirectory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,repositoryDirectory)
+
+import dataParser
+import emulatorMod
+
+configDirectory = os.path.join(repositoryDirectory,'config')
+dataConfigFile = os.path.join(configDirectory,'dataConfig.cfg')
+emulatorConfigFile = os.path.join(configDirectory,'emulatorConfig.cfg')
+
+class Board:
+    """Stands in for the GUI: the attributes the parser reads"""
+    def __init__(self):
+        self.debug = False
+        self.serial_number = 'EMULATOR'
+        self.frequency = 40.
+        self.nSamples = 0
+        self.measurementTime = ''
+        self.sineFitIterations = 4
+
+    def showError(self,message):
+        raise AssertionError(message)
+
+@pytest.fixture
+def configFile():
+    return dataConfigFile
+
+@pytest.fixture
+def board():
+    return Board()
+
+@pytest.fixture
+def emulator():
+    return emulatorMod.TestBoardEmulator(emulatorConfigFile,dataConfigFile)
+
+@pytest.fixture
+def parser(board,tmp_path):
+    """A parser writing to tmp_path, decoding every channel in normal mode"""
+    dataParserInstance = dataParser.dataParser(board,dataConfigFile,outputDirectory=str(tmp_path))
+    dataParserInstance.arithmeticModes = {(slot.chip,slot.channel):'normal_mode'
+                                          for slot in dataParserInstance.getDecodePlan().channels}
+    yield dataParserInstance
+    dataParserInstance.closeRunFile()
+
+@pytest.fixture(scope='session')
+def gui(tmp_path_factory):
+    """The GUI on the emulated board, drawn offscreen, as benchmark.py creates it"""
+    os.environ.setdefault('QT_QPA_PLATFORM','offscreen')
+    from PyQt5 import QtWidgets
+    import testBoardGUI
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    options = optparse.Values({'no_connect':False,'emulate':True,'debug':False,'instruments':False,
+                               'output_directory':str(tmp_path_factory.mktemp('gui'))})
+    guiInstance = testBoardGUI.testBoardGUI(app,options,[])
+    yield guiInstance
+    guiInstance.ODP.closeRunFile()
+    guiInstance.closeConnections()
+
+class SerialBoard(Board):
+    """Stands in for the GUI on the serial port: the emulated board, recording every write"""
+    def __init__(self,emulator):
+        super().__init__()
+        self.serial = emulator
+        self.timeout = 0.5
+        self.pacing = {'status':0.0,'payload':0.0,'i2c':0.0,'reset':0.0}
+        self.serialLock = threading.RLock()
+        self.pOptions = optparse.Values({'no_connect':False})
+        self.writes = []
+        write = emulator.write
+        def recordWrite(data):
+            self.writes.append(bytes(data))
+            return write(data)
+        emulator.write = recordWrite
+
+@pytest.fixture
+def serialBoard(emulator):
+    return SerialBoard(emulator)
@@ -0,0 +1,143 @@
+"""Pipelined data taking with a reader thread, on a board that counts its reads."""
+
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+import numpy
+import pytest
+import acquisitionMod
+
+class CountingBoard:
+    """Stands in for the GUI: each read fills the buffer with the number of the capture"""
+    def __init__(self,readTime=0.):
+        self.dataWords = 32
+        self.dualPortBufferDepth = 4
+        self.nSamples = 4
+        self.discarded = 0
+        self.serialLock = threading.RLock()
+        self.readTime = readTime
+        self.nReads = 0
+        self.nTriggers = 0
+
+    def fifoAReadData(self,nSamples,buffer=None):
+        time.sleep(self.readTime)
+        view = memoryview(buffer)[:8]
+        view[:] = self.nReads.to_bytes(8,'little')
+        self.nReads += 1
+        return view
+
+    def trigger(self):
+        self.nTriggers += 1
+
+class YieldingQueue(queue.Queue):
+    """Lets the other threads run after each buffer handed back, as a busy GUI thread would"""
+    def put(self,item,*args,**kwargs):
+        super().put(item,*args,**kwargs)
+        time.sleep(0.01)
+
+def test_captures_are_processed_in_order():
+    board = CountingBoard()
+    processed = []
+    def process(measurementTime,capture,isLast):
+        processed.append((int.from_bytes(capture,'little'),isLast))
+    archived = []
+    acquisition = acquisitionMod.PipelinedAcquisition(board,20,process,trigger=board.trigger,queueDepth=3,
+                                                      archive=lambda capture:archived.append(bytes(capture)))
+    assert acquisition.run()==20
+    assert processed==[(i,i==19) for i in range(20)]
+    assert [int.from_bytes(capture,'little') for capture in archived]==list(range(20))
+    assert board.nReads==board.nTriggers==20
+
+@pytest.mark.parametrize('queueDepth',[2,4])
+def test_reader_stays_within_the_queue_depth(queueDepth):
+    board = CountingBoard()
+    nProcessed = []
+    pending = []
+    read = board.fifoAReadData
+    def fifoAReadData(nSamples,buffer=None):
+        # Captures read and not processed yet, including this one
+        pending.append(board.nReads+1-len(nProcessed))
+        return read(nSamples,buffer)
+    board.fifoAReadData = fifoAReadData
+    def process(measurementTime,capture,isLast):
+        time.sleep(0.01)
+        nProcessed.append(capture)
+    acquisitionMod.PipelinedAcquisition(board,12,process,queueDepth=queueDepth).run()
+    assert max(pending)==queueDepth
+
+def test_error_in_process_stops_the_reads():
+    board = CountingBoard()
+    readsAtError = []
+    def process(measurementTime,capture,isLast):
+        if int.from_bytes(capture,'little')==2:
+            # Let the reader fill every free buffer and wait for the next one
+            time.sleep(0.05)
+            readsAtError.append(board.nReads)
+            raise RuntimeError('failed')
+    acquisition = acquisitionMod.PipelinedAcquisition(board,20,process,trigger=board.trigger,queueDepth=2)
+    freeBuffers,acquisition.freeBuffers = acquisition.freeBuffers,YieldingQueue()
+    while not freeBuffers.empty():
+        acquisition.freeBuffers.put(freeBuffers.get())
+    with pytest.raises(RuntimeError):
+        acquisition.run()
+    assert not acquisition.reader.is_alive()
+    assert board.nReads==board.nTriggers==readsAtError[0]
+
+def test_error_in_the_reader_is_raised():
+    board = CountingBoard()
+    def trigger():
+        if board.nReads==3:
+            raise IOError('port closed')
+    processed = []
+    with pytest.raises(IOError):
+        acquisitionMod.PipelinedAcquisition(board,10,lambda *capture:processed.append(capture),trigger=trigger).run()
+    assert len(processed)==3 and board.nReads==3
+
+def test_plot_throttle():
+    throttle = acquisitionMod.PlotThrottle(10.)
+    assert throttle.isDue()
+    assert not throttle.isDue()
+    assert throttle.isDue(isLast=True)
+
+@pytest.fixture
+def decodingGUI(gui):
+    """The GUI with two decoding processes, closed afterwards"""
+    decodeWorkers = gui.decodeWorkers
+    gui.decodeWorkers = 2
+    gui.nSamples = 256
+    yield gui
+    acquisitionMod.closeDecodePool(gui)
+    gui.decodeWorkers = decodeWorkers
+
+def parallelAcquisition(gui,nCaptures,process,archive=None):
+    return acquisitionMod.ParallelAcquisition(gui,nCaptures,process,acquisitionMod.getDecodePool(gui),
+                                              gui.ODP.getDecodePlan(),gui.ODP.channelWeights(),
+                                              queueDepth=3,archive=archive)
+
+def test_parallel_decoding_matches_parseData(decodingGUI):
+    gui = decodingGUI
+    decodedCaptures,readouts = [],[]
+    def process(measurementTime,decoded,isLast):
+        decodedCaptures.append(decoded)
+    acquisition = parallelAcquisition(gui,8,process,archive=lambda capture:readouts.append(bytes(capture)))
+    assert acquisition.run()==8
+    assert len(decodedCaptures)==len(readouts)==8
+    # Each capture is decoded as the GUI thread parses it, and comes back in the order read
+    for decoded,readout in zip(decodedCaptures,readouts):
+        gui.ODP.parseData('coluta',gui.nSamples,readout)
+        for (chip,channel),(words,decimals) in decoded.items():
+            assert numpy.array_equal(words,getattr(gui.ODP,chip+'WordDict')[channel])
+            assert list(decimals)==getattr(gui.ODP,chip+'DecimalDict')[channel]
+    assert len({readout for readout in readouts})==8
+
+def test_parallel_decoding_frees_the_shared_memory_after_an_error(decodingGUI):
+    def process(measurementTime,decoded,isLast):
+        raise RuntimeError('failed')
+    acquisition = parallelAcquisition(decodingGUI,8,process)
+    names = [block.name for block in acquisition.buffers]
+    with pytest.raises(RuntimeError):
+        acquisition.run()
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
@@ -0,0 +1,73 @@
+"""The raw archive of a run and the run file written again from it by replayArchive.py."""
+
+import glob
+import os
+import h5py
+import numpy
+import pytest
+import dataParser
+import archiveMod
+import replayArchive
+
+channels = [('coluta1','channel1'),('coluta1','channel2'),('coluta2','channel1'),('coluta2','channel2')]
+nSamples = 500
+
+def readFile(filePath):
+    """The datasets and attributes of an HDF5 file, by path"""
+    contents = {}
+    def visit(name,item):
+        contents[name+'@attrs'] = {key:item.attrs[key] for key in item.attrs}
+        if isinstance(item,h5py.Dataset):
+            contents[name] = item[()]
+    with h5py.File(filePath,'r') as hdf5File:
+        hdf5File.visititems(visit)
+    return contents
+
+def assertSameContents(first,second):
+    assert sorted(first)==sorted(second)
+    for name,value in first.items():
+        if isinstance(value,dict):
+            assert sorted(value)==sorted(second[name]),name
+            for key in value:
+                assert numpy.array_equal(value[key],second[name][key]),(name,key)
+        else:
+            assert numpy.array_equal(value,second[name]),name
+
+@pytest.fixture
+def archivedRun(parser,board,emulator):
+    """Takes three measurements with the raw archive on. Returns the readouts and the run file"""
+    parser.general.settings['raw_archive'] = '1'
+    readouts = []
+    for i in range(3):
+        dataFromChip = bytes(emulator.makeFrames(32*nSamples))
+        board.nSamples = nSamples
+        board.measurementTime = 'measurement {}'.format(i)
+        conditions = dataParser.RunConditions(dict(run_type='sine',n_samples=nSamples,pulser_amp=0),
+                                              {key:dict(gain=i,run_mode='Normal Mode',laurocGain='1') for key in channels},
+                                              {key:'normal_mode' for key in channels})
+        parser.parseData('coluta',nSamples,dataFromChip)
+        parser.writeDataToFile(writeHDF5File=True,conditions=conditions)
+        parser.archiveCapture(dataFromChip,conditions)
+        readouts.append(dataFromChip)
+    parser.closeRunFile()
+    return readouts,glob.glob(os.path.join(parser.outputDirectory,'*_Output.hdf5'))[0]
+
+def test_archive_keeps_the_readouts(parser,archivedRun):
+    readouts,_ = archivedRun
+    archive = archiveMod.RawArchive(glob.glob(os.path.join(parser.outputDirectory,'*_Raw.bin'))[0])
+    assert len(archive)==len(readouts)
+    for i,dataFromChip in enumerate(readouts):
+        assert bytes(archive[i])==dataFromChip
+        assert archive.index[i]['n_samples']==nSamples
+        assert archive.records[i]['channels']['coluta1/channel1']['gain']==i
+        assert os.path.exists(archive.configFile(archive.index[i]['config_hash']))
+
+@pytest.mark.parametrize('workers',[0,2])
+def test_replay_writes_the_same_run_file(parser,archivedRun,tmp_path,workers):
+    _,runFile = archivedRun
+    archivePath = glob.glob(os.path.join(parser.outputDirectory,'*_Raw.bin'))[0]
+    outputDirectory = str(tmp_path/'Replay')
+    assert replayArchive.replay(archivePath,outputDirectory,workers=workers)==3
+    replayedFile = glob.glob(os.path.join(outputDirectory,'*_Output.hdf5'))[0]
+    assert os.path.basename(replayedFile)==os.path.basename(runFile)
+    assertSameContents(readFile(runFile),readFile(replayedFile))
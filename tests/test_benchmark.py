@@ -0,0 +1,21 @@
+"""Cases of benchmark.py run on the GUI fixture."""
+
+import os
+import pytest
+import benchmark
+
+@pytest.mark.parametrize('pipelined',[False,True])
+def test_runCase_with_several_channel_counts(gui,tmp_path,pipelined):
+    savedChannels = gui.ODP.coluta1.getSetting('data_channels')
+    outputDirectory = gui.ODP.outputDirectory
+    try:
+        for nChannels in (1,2,3):
+            result = benchmark.runCase(gui,256,nChannels,'hdf5',2,str(tmp_path),pipelined=pipelined)
+            assert result['n_channels']==nChannels and result['n_captures']==2
+            assert result['bytes_written']>0
+            assert all(len(times['per_capture'])==2 for times in result['stages'].values())
+            assert os.path.isdir(os.path.join(str(tmp_path),'256_{}_hdf5'.format(nChannels)))
+        assert gui.ODP.coluta1.getSetting('data_channels')==savedChannels
+    finally:
+        gui.ODP.closeRunFile()
+        gui.ODP.outputDirectory = outputDirectory
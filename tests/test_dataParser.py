@@ -0,0 +1,241 @@
+"""The array decoding of dataParser against the string parser it replaced."""
+
+import glob
+import os
+import h5py
+import numpy
+import pytest
+import dataParser
+
+nSamples = 1000
+
+def baselineRoll(binaryWords,shift):
+    """stringRoll of the original parser: rolls the concatenated bits of the samples"""
+    stream = ''.join(binaryWords)
+    shift %= max(len(stream),1)
+    stream = stream[len(stream)-shift:]+stream[:len(stream)-shift]
+    nBits = len(binaryWords[0]) if binaryWords else 0
+    return [stream[i:i+nBits] for i in range(0,len(stream),nBits)]
+
+def baselineConvert(binaryWord,weights,overflowWeights):
+    """convertColutaBits of the original parser"""
+    bits = [int(bit) for bit in binaryWord]
+    return int(numpy.dot(bits,overflowWeights if bits[2] else weights))
+
+def baselineParse(parser,dataFromChip,nFrames,weights,overflowWeights):
+    """parseData and parseADC of the original parser, on the bits of the readout as a string"""
+    bitString = ''.join(format(byte,'08b') for byte in bytes(dataFromChip))
+    frameBits = int(parser.general.getSetting('word_length'))
+    wordBits = int(parser.rootGroup.getSetting('total_bits'))
+    frames = [bitString[i:i+frameBits] for i in range(0,len(bitString),frameBits)][:nFrames]
+    samples = [frame[i:i+wordBits] for frame in frames for i in range(0,len(frame),wordBits)]
+    groups = parser.general.getSetting('data_words')
+    binary = {}
+    for frameSamples in zip(*[samples[i::8] for i in range(8)]):
+        frameSamples = frameSamples[1:4]
+        if all(sample=='0'*wordBits for sample in frameSamples): continue
+        for sample,group in zip(frameSamples,groups):
+            settings = getattr(parser,group).settings
+            for chip,channel,lsb,msb in zip(settings['data_chips'],settings['data_channels'],settings['lsb'],settings['msb']):
+                binary.setdefault((chip,channel),[]).append(sample[int(lsb):int(msb)])
+    decimals = {}
+    for group in groups:
+        settings = getattr(parser,group).settings
+        for chip,channel,roll in zip(settings['data_chips'],settings['data_channels'],settings['roll']):
+            binary[(chip,channel)] = baselineRoll(binary[(chip,channel)],int(roll))
+            decimals[(chip,channel)] = [baselineConvert(word,weights,overflowWeights) for word in binary[(chip,channel)]]
+    return binary,decimals
+
+def test_parseData_matches_string_parser(parser,emulator):
+    dataFromChip = emulator.makeFrames(32*nSamples)
+    parser.parseData('coluta',nSamples,dataFromChip)
+    weights,overflowWeights = parser.getChannelWeights('coluta1','channel1')
+    binary,decimals = baselineParse(parser,dataFromChip,nSamples,weights,overflowWeights)
+    for (chip,channel),binaryWords in binary.items():
+        assert getattr(parser,chip+'BinaryDict')[channel]==binaryWords
+        assert list(getattr(parser,chip+'DecimalDict')[channel])==decimals[(chip,channel)]
+
+@pytest.mark.parametrize('shift',[0,1,-1,7,15,16,17,-31,40])
+def test_rollWords_matches_stringRoll(shift):
+    words = numpy.random.default_rng(shift%7).integers(0,1<<16,size=64,dtype=numpy.uint16)
+    binaryWords = dataParser.wordsToBinaryStrings(words)
+    rolled = dataParser.rollWords(words,shift)
+    assert dataParser.wordsToBinaryStrings(rolled)==dataParser.stringRoll(binaryWords,shift)
+    assert dataParser.wordsToBinaryStrings(rolled)==baselineRoll(binaryWords,shift)
+
+@pytest.mark.parametrize('order',sorted(dataParser.barrelOrders))
+def test_barrelWords_matches_string_barrel(order):
+    words = numpy.random.default_rng(1).integers(0,1<<16,size=64,dtype=numpy.uint16)
+    binaryWords = dataParser.wordsToBinaryStrings(words)
+    # The halves of each sample and of the next one joined by barrelRoll, '0:8' the first
+    halves = {'lsbmsb':(slice(0,8),slice(8,16)),'msblsb':(slice(8,16),slice(0,8)),
+              'lsblsb':(slice(0,8),slice(0,8)),'msbmsb':(slice(8,16),slice(8,16))}[order]
+    expected = [first[halves[0]]+second[halves[1]] for first,second in zip(binaryWords,binaryWords[1:]+binaryWords[:1])]
+    assert dataParser.wordsToBinaryStrings(dataParser.barrelWords(words,order))==expected
+
+def test_convertWords_uses_overflow_weights(parser):
+    weights,overflowWeights = parser.getChannelWeights('coluta1','channel1')
+    words = numpy.array([0x2000|5,0x1234,0xffff,0x0001],dtype=numpy.uint16)
+    expected = [baselineConvert(word,weights,overflowWeights) for word in dataParser.wordsToBinaryStrings(words)]
+    assert dataParser.convertWords(words,weights,overflowWeights).tolist()==expected
+    assert expected[0]==4095
+
+def test_streamData_matches_parseData_away_from_the_ends(parser,emulator):
+    dataFromChip = bytes(emulator.makeFrames(32*nSamples))
+    parser.parseData('coluta',nSamples,dataFromChip)
+    blocks = [dataFromChip[i:i+999] for i in range(0,len(dataFromChip),999)]
+    streamed = {}
+    for decoded in parser.streamData(blocks):
+        for key,(words,_) in decoded.items():
+            streamed.setdefault(key,[]).append(words)
+    for slot in parser.getDecodePlan().channels:
+        words = numpy.concatenate(streamed[(slot.chip,slot.channel)])
+        nEnd = abs(slot.roll)//slot.nBits+1+(slot.barrel!='none')
+        assert numpy.array_equal(words[nEnd:-nEnd],getattr(parser,slot.chip+'WordDict')[slot.channel][nEnd:-nEnd])
+
+def test_decoding_needs_no_run_conditions(board,configFile,tmp_path,emulator):
+    """The parser reads the mode boxes only, without the widgets of the run conditions"""
+    parser = dataParser.dataParser(board,configFile,outputDirectory=str(tmp_path))
+    parser.parseData('coluta',nSamples,emulator.makeFrames(32*nSamples))
+    assert parser.getArithmeticMode('coluta1','channel1')=='raw_data'
+    assert len(parser.coluta1DecimalDict['channel1'])==nSamples
+
+def test_run_conditions_follow_the_channels_written(gui):
+    """The snapshot is taken again when data_channels changes, and holds every channel written"""
+    settings = gui.ODP.coluta1.settings
+    savedChannels = settings['data_channels']
+    try:
+        settings['data_channels'] = ['channel1','frame']
+        conditions = gui.ODP.getRunConditions()
+        assert ('coluta1','channel1') in conditions.channels and ('coluta1','channel2') not in conditions.channels
+        assert gui.ODP.getRunConditions() is conditions
+        settings['data_channels'] = ['channel1','channel2','frame']
+        conditions = gui.ODP.getRunConditions()
+        assert ('coluta1','channel2') in conditions.channels
+        assert ('coluta1','channel2') in conditions.modes
+    finally:
+        settings['data_channels'] = savedChannels
+        gui.ODP.markConditionsDirty()
+
+def test_write_reads_a_channel_missing_from_the_snapshot(gui):
+    gui.nSamples = 64
+    gui.ODP.parseData('coluta',gui.nSamples,gui.fifoAReadData(gui.nSamples))
+    conditions = gui.ODP.getRunConditions()
+    partial = dataParser.RunConditions(conditions.run,{key:value for key,value in conditions.channels.items()
+                                                       if key!=('coluta1','channel2')},conditions.modes)
+    gui.ODP.writeDataToFile(writeHDF5File=True,conditions=partial)
+    gui.ODP.closeRunFile()
+    filePath = glob.glob(os.path.join(gui.ODP.outputDirectory,'*_Output.hdf5'))[0]
+    with h5py.File(filePath,'r') as hdf5File:
+        channel = hdf5File['Measurement_{}/coluta1/channel2'.format(hdf5File.attrs['n_measurements']-1)]
+        assert dict(channel.attrs)==gui.ODP.collectChannelConditions('coluta1','channel2')
+
+def histogramWords(bins,counts,padding=0):
+    """Packs histogram words with the [HISTOGRAM] layout: count in bits [42:64] from the MSB,
+    the lowest 22 bits, then the bin number in the next 12 bits"""
+    bins,counts = numpy.asarray(bins,dtype=numpy.uint64),numpy.asarray(counts,dtype=numpy.uint64)
+    return (counts|(bins<<numpy.uint64(22))|(numpy.uint64(padding)<<numpy.uint64(34))).astype('<u8')
+
+def test_decodeHistogramWords(parser):
+    # A repeated word is counted once, empty words and bin 0 are skipped
+    words = histogramWords([5,7,7,0,9,3000],[10,(1<<22)-1,(1<<22)-1,4,0,2],padding=0x3ffffff)
+    bins,counts = dataParser.decodeHistogramWords(words.tobytes(),len(words),parser.getHistogramLayout())
+    assert sorted(zip(bins.tolist(),counts.tolist()))==[(5,10),(7,(1<<22)-1),(3000,2)]
+    # Only the first nWords words of the buffer are read
+    bins,counts = dataParser.decodeHistogramWords(words.tobytes(),1,parser.getHistogramLayout())
+    assert bins.tolist()==[5] and counts.tolist()==[10]
+
+def test_histogram_reads_are_summed(parser):
+    parser.resetHistogram()
+    first = histogramWords([1,2,4095],[3,4,5]).tobytes()
+    second = histogramWords([2,100],[6,7]).tobytes()
+    parser.parseData('histogram',3,first)
+    parser.parseData('histogram',2,second)
+    assert parser.histogramReads==2
+    assert len(parser.histogramSum)==int(parser.histogram.getSetting('n_bins'))
+    assert {bin:int(parser.histogramSum[bin]) for bin in numpy.flatnonzero(parser.histogramSum)}=={1:3,2:10,100:7,4095:5}
+    parser.resetHistogram()
+    assert not parser.histogramSum.any() and parser.histogramReads==0
+
+def test_getHistogramAddress(parser):
+    settings = parser.histogram.settings
+    for address,expected in [('',None),('3',3),('0x7',7),('0',0)]:
+        settings['fpga_address'] = address
+        assert parser.getHistogramAddress()==expected
+    for address in ['8','-1','zero']:
+        settings['fpga_address'] = address
+        with pytest.raises(ValueError):
+            parser.getHistogramAddress()
+    del parser.histogram
+    assert parser.getHistogramAddress() is None
+
+def driftEmulator(emulator,shift):
+    """Misaligns every channel of the emulated board by shift more bits than configured"""
+    emulator.channels = [(wordIndex,chip,channel,roll+shift,lsb,msb,wordLength)
+                         for (wordIndex,chip,channel,roll,lsb,msb,wordLength) in emulator.channels]
+    return {(chip,channel):roll for (_,chip,channel,roll,_,_,_) in emulator.channels}
+
+@pytest.fixture
+def autoAligned(parser,tmp_path):
+    """The parser checking the alignment of every capture, with its cache in tmp_path"""
+    parser.alignment.settings['auto'] = '1'
+    parser.alignment.settings['cache_file'] = str(tmp_path/'alignment.cfg')
+    parser.arithmeticModes = {(slot.chip,slot.channel):'raw_data' for slot in parser.getDecodePlan().channels}
+    return parser
+
+@pytest.mark.parametrize('shift',[3,-5])
+def test_findAlignment_finds_the_rolls_of_a_misaligned_board(autoAligned,emulator,configFile,shift):
+    parser = autoAligned
+    # The same samples are drawn for both captures
+    emulator.rng = numpy.random.default_rng(1)
+    parser.parseData('coluta',nSamples,emulator.makeFrames(32*nSamples))
+    expected = {group:dict(getattr(parser,group+'WordDict')) for group in ('coluta1','coluta2')}
+    assert not parser.alignmentChanged and parser.alignmentStatus is None
+
+    rolls = driftEmulator(emulator,shift)
+    emulator.rng = numpy.random.default_rng(1)
+    parser.parseData('coluta',nSamples,emulator.makeFrames(32*nSamples))
+    assert {(slot.chip,slot.channel):slot.roll for slot in parser.getDecodePlan().channels}==rolls
+    for group,channels in expected.items():
+        for channel,words in channels.items():
+            assert numpy.array_equal(getattr(parser,group+'WordDict')[channel],words)
+    assert parser.alignmentChanged and parser.alignmentStatus.startswith('New alignment for board EMULATOR')
+    # Parsing leaves the cache to the GUI
+    alignmentFile = parser.getAlignmentFile()
+    assert not os.path.exists(alignmentFile)
+    parser.saveAlignment()
+    assert not parser.alignmentChanged
+
+    # The rolls saved are loaded for the same board
+    otherParser = dataParser.dataParser(parser.coluta,configFile,outputDirectory=parser.outputDirectory)
+    otherParser.alignment.settings.update(parser.alignment.settings)
+    otherParser.loadAlignment('EMULATOR')
+    assert {(slot.chip,slot.channel):slot.roll for slot in otherParser.getDecodePlan().channels}==rolls
+
+def test_findAlignment_keeps_the_rolls_without_the_frame_pattern(autoAligned,emulator):
+    parser = autoAligned
+    plan = parser.getDecodePlan()
+    emulator.framePattern = 0x1234
+    parser.parseData('coluta',nSamples,emulator.makeFrames(32*nSamples))
+    assert parser.getDecodePlan()==plan
+    assert not parser.alignmentChanged
+    assert parser.alignmentStatus.startswith('No alignment of')
+    assert not os.path.exists(parser.getAlignmentFile())
+
+def test_gui_saves_the_alignment_after_the_capture(gui,tmp_path):
+    alignment = gui.ODP.alignment.settings
+    savedSettings,savedChannels = dict(alignment),list(gui.serial.channels)
+    try:
+        alignment['auto'] = '1'
+        alignment['cache_file'] = str(tmp_path/'alignment.cfg')
+        rolls = driftEmulator(gui.serial,2)
+        gui.nSamples = 256
+        gui.takeSamples(doDraw=False)
+        assert os.path.exists(alignment['cache_file'])
+        assert 'New alignment' in gui.statusBar.currentMessage()
+        assert {(slot.chip,slot.channel):slot.roll for slot in gui.ODP.getDecodePlan().channels}==rolls
+    finally:
+        alignment.clear()
+        alignment.update(savedSettings)
+        gui.serial.channels = savedChannels
+        gui.ODP.loadAlignment(str(gui.serial_number))
@@ -0,0 +1,27 @@
+"""The serial protocol as decoded by the emulated board."""
+
+import pytest
+
+def statusWord(operation=0,address=0,counter=0,status4=0):
+    """Status word of a FIFO A operation: 254, status1, counter, status4, 255"""
+    return bytes([254,(address<<2)|operation,counter&0xff,counter>>8,status4,255])
+
+def writeRegister(emulator,address,payload):
+    emulator.write(statusWord()+statusWord(1,address,len(payload),0x40)+payload+statusWord())
+
+def readRegister(emulator,address,counter):
+    emulator.write(statusWord(2,address,counter,0x40)+statusWord())
+    return emulator.read(counter*8)
+
+def test_register_write_and_read(emulator):
+    writeRegister(emulator,3,bytes(range(1,9)))
+    assert readRegister(emulator,3,1)==bytes(range(1,9))
+
+@pytest.mark.parametrize('split',[1,5,9,13])
+def test_payload_holding_a_status_word_is_payload(emulator,split):
+    # As a status word, the first six bytes would raise softwareReset and clear the registers
+    payload = bytes(statusWord(status4=0x20))+bytes([7,9])
+    stream = statusWord()+statusWord(1,3,len(payload),0x40)+payload+statusWord()
+    emulator.write(stream[:split])
+    emulator.write(stream[split:])
+    assert readRegister(emulator,3,1)==payload
@@ -0,0 +1,51 @@
+"""Folding of synthetic periodic pulses."""
+
+import numpy
+import pytest
+import pulseMod
+
+period = pulseMod.pulsePeriod(40,40.)
+pedestal = 120.
+height = 900.
+
+def pulseCapture(nSamples,peakSample,heights=None):
+    """Gaussian pulses every period samples, the first peaking at peakSample, on a pedestal"""
+    nPulses = nSamples//period+2
+    heights = numpy.full(nPulses,height) if heights is None else heights
+    capture = numpy.full(nSamples,pedestal)
+    sample = numpy.arange(nSamples)
+    for i in range(nPulses):
+        capture += heights[i]*numpy.exp(-0.5*((sample-peakSample-(i-1)*period)/1.5)**2)
+    return capture
+
+def test_pulsePeriod():
+    assert period==40
+    assert pulseMod.pulsePeriod(40,20.)==20
+
+@pytest.mark.parametrize('peakSample',[0,5,16,33])
+def test_foldPulses_finds_the_pulses(peakSample):
+    capture = pulseCapture(1000,peakSample)
+    folded = pulseMod.foldPulses(capture,period)
+    settings = pulseMod.defaultSettings
+    assert folded.offset==(peakSample-settings.peakOffset)%period
+    assert len(folded.peak)==(1000-period+1)//period
+    assert numpy.allclose(folded.pedestal,pedestal)
+    assert numpy.allclose(folded.peak,height)
+    assert numpy.allclose(folded.peakTime,settings.peakOffset)
+    assert numpy.argmax(folded.meanPulse)==settings.peakOffset
+
+def test_foldPulses_of_a_batch():
+    heights = numpy.linspace(100,1000,30)
+    captures = numpy.stack([[pulseCapture(1000,peakSample,heights) for peakSample in (3,20)] for _ in range(2)])
+    folded = pulseMod.foldPulses(captures,period)
+    assert folded.offset.shape==(2,2)
+    assert folded.peak.shape==(2,2,24)
+    # Pulse i peaks at peakSample+(i-1)*period: folding starts at the first peak past peakOffset
+    assert numpy.allclose(folded.peak[:,0],heights[2:26])
+    assert numpy.allclose(folded.peak[:,1],heights[1:25])
+
+def test_foldPulses_needs_a_whole_pulse():
+    with pytest.raises(ValueError):
+        pulseMod.foldPulses(numpy.zeros(50),period)
+    with pytest.raises(ValueError):
+        pulseMod.foldPulses(numpy.zeros(1000),4)
@@ -0,0 +1,81 @@
+"""FFT metrics and sine fits of synthetic captures whose ENOB is known."""
+
+import warnings
+import numpy
+import qaMod
+
+fs = 40.
+nSamples = 4096
+nBits = 12
+
+def sineCapture(frequency,noise=0.,seed=0):
+    """Full scale sine quantized to nBits, with Gaussian noise of rms noise counts added before"""
+    time = numpy.arange(nSamples)/fs
+    amplitude = (2**nBits-1)/2
+    samples = amplitude*numpy.sin(2*numpy.pi*frequency*time+0.3)+amplitude
+    samples += numpy.random.default_rng(seed).normal(0,noise,nSamples)
+    return numpy.clip(numpy.round(samples),0,2**nBits-1)
+
+def expectedENOB(noise):
+    """ENOB of a full scale sine with quantization noise and Gaussian noise of rms noise counts"""
+    sinad = 20*numpy.log10((2**nBits-1)/2/numpy.sqrt(2)/numpy.sqrt(1/12+noise**2))
+    return (sinad-1.76)/6.02
+
+# 127 cycles in the capture, prime to nSamples: coherent, every code sampled
+coherentFrequency = 127*fs/nSamples
+# Not a whole number of cycles: the FFT leaks, the fit does not
+incoherentFrequency = 127.37*fs/nSamples
+
+def test_analyzeSpectrum_gives_the_ENOB_of_a_coherent_sine():
+    for noise in (0.,2.,8.):
+        freq,psd,QA = qaMod.analyzeSpectrum(sineCapture(coherentFrequency,noise),fs)
+        assert abs(QA['ENOB']-expectedENOB(noise))<0.1
+        assert QA['fundamental']==freq[numpy.argmax(psd)]==coherentFrequency
+        assert abs(QA['amplitude']-(2**nBits-1)/2)<1
+        assert QA['SNR']>=QA['SINAD']
+
+def test_flat_capture_gives_NaN():
+    flat = numpy.full(nSamples,2048.)
+    _,_,QA = qaMod.analyzeSpectrum(flat,fs)
+    assert all(numpy.isnan(value) for value in QA.values())
+
+def test_analyzeBatch_matches_analyzeSpectrum():
+    captures = numpy.stack([[sineCapture(coherentFrequency,noise,seed) for noise in (0.,4.)] for seed in range(3)])
+    table = qaMod.analyzeBatch(captures,fs)
+    assert table.shape==(3,2)
+    for index in numpy.ndindex(table.shape):
+        _,_,QA = qaMod.analyzeSpectrum(captures[index],fs)
+        for name in qaMod.qaDtype.names:
+            assert numpy.isclose(table[index][name],QA[name],rtol=1e-5)
+
+def test_analyzeBatch_gives_NaN_for_flat_captures_only():
+    table = qaMod.analyzeBatch(numpy.stack([numpy.full(nSamples,2048.),sineCapture(coherentFrequency)]),fs)
+    assert numpy.isnan(table[0]['ENOB']) and not numpy.isnan(table[1]['ENOB'])
+
+def test_sineFit_gives_the_ENOB_without_coherent_sampling():
+    for noise in (0.,2.,8.):
+        capture = sineCapture(incoherentFrequency,noise)
+        fit = qaMod.sineFit(capture,fs)
+        assert abs(fit['ENOB']-expectedENOB(noise))<0.1
+        assert abs(fit['frequency']-incoherentFrequency)<1e-6
+        assert abs(fit['amplitude']-(2**nBits-1)/2)<1
+        assert abs(fit['offset']-(2**nBits-1)/2)<1
+    # The FFT of the same capture, without a window, loses bits to the leakage
+    _,_,QA = qaMod.analyzeSpectrum(sineCapture(incoherentFrequency),fs)
+    assert QA['ENOB']<expectedENOB(0.)-2
+
+def test_sineFit_of_a_batch():
+    captures = numpy.stack([sineCapture(incoherentFrequency,noise,seed) for seed in range(4) for noise in (1.,3.)]).reshape(4,2,nSamples)
+    table = qaMod.sineFit(captures,fs,blockSize=3)
+    assert table.shape==(4,2)
+    assert numpy.all(numpy.abs(table['ENOB']-[expectedENOB(1.),expectedENOB(3.)])<0.1)
+
+def test_sineFit_of_flat_captures_gives_NaN_without_warnings():
+    captures = numpy.stack([numpy.zeros(nSamples),sineCapture(incoherentFrequency),numpy.full(nSamples,2048.)])
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        table = qaMod.sineFit(captures,fs,blockSize=1)
+    assert numpy.isnan(table['ENOB'][[0,2]]).all() and numpy.isnan(table['frequency'][[0,2]]).all()
+    assert numpy.array_equal(table['amplitude'][[0,2]],[0,0])
+    assert numpy.array_equal(table['offset'][[0,2]],[0,2048])
+    assert table[1]==qaMod.sineFit(captures[1],fs)
@@ -0,0 +1,60 @@
+"""Measurements written by dataParser and read back by runReaderMod, in both layouts."""
+
+import glob
+import os
+import h5py
+import numpy
+import pytest
+import dataParser
+import runReaderMod
+
+channels = [('coluta1','channel1'),('coluta1','channel2'),('coluta2','channel1'),('coluta2','channel2')]
+
+def writeMeasurements(parser,board,words,runTypes):
+    """Writes one measurement per run type, each with the words given for every channel"""
+    for i,runType in enumerate(runTypes):
+        decoded = {}
+        for chip,channel in channels+[('coluta1','frame'),('coluta2','frame')]:
+            weights,overflowWeights = parser.getChannelWeights(chip,channel)
+            decoded[(chip,channel)] = (words,dataParser.convertWords(words,weights,overflowWeights))
+        parser.setDecodedData(decoded)
+        board.nSamples = len(words)
+        board.measurementTime = 'measurement {}'.format(i)
+        conditions = dataParser.RunConditions(dict(run_type=runType,n_samples=len(words),pulser_amp=100*i),
+                                              {key:dict(gain=0,run_mode='Normal Mode',laurocGain='1') for key in channels},
+                                              {key:'normal_mode' for key in channels})
+        parser.writeDataToFile(writeHDF5File=True,conditions=conditions)
+    parser.closeRunFile()
+    return glob.glob(os.path.join(parser.outputDirectory,'*_Output.hdf5'))[0]
+
+@pytest.mark.parametrize('layout,storage',[('legacy','bits'),('run','bits'),('run','packed')])
+def test_round_trip_with_overflowing_samples(parser,board,layout,storage):
+    parser.general.settings['hdf5_layout'] = layout
+    parser.general.settings['hdf5_storage'] = storage
+    # The first and third words have the overflow bit set, and read 4095 in normal mode
+    words = numpy.array([0x2000|5,0x1234,0xffff,0x0001,0x0fff],dtype=numpy.uint16)
+    weights,overflowWeights = parser.getChannelWeights('coluta1','channel1')
+    expected = dataParser.convertWords(words,weights,overflowWeights)
+    assert expected[0]==4095 and expected[2]==4095
+
+    filePath = writeMeasurements(parser,board,words,['sine','pulse','sine'])
+    with runReaderMod.RunReader(filePath) as run:
+        assert run.nMeasurements==3
+        assert numpy.array_equal(run.select('coluta1','channel1',run_type='sine'),[0,2])
+        for chip,channel in channels:
+            reader = run.channel(chip,channel)
+            assert numpy.array_equal(reader[1],expected)
+            assert numpy.array_equal(reader[[0,2]],numpy.stack([expected,expected]))
+            assert numpy.array_equal(reader.words(1),words)
+
+@pytest.mark.parametrize('layout,shuffle,expected',[('legacy','',False),('run','',True),
+                                                    ('legacy','1',True),('run','0',False)])
+def test_compression_filters(parser,board,layout,shuffle,expected):
+    parser.general.settings['hdf5_layout'] = layout
+    parser.general.settings['hdf5_shuffle'] = shuffle
+    filePath = writeMeasurements(parser,board,numpy.arange(64,dtype=numpy.uint16),['sine'])
+    datasetName = 'Measurement_0/coluta1/channel1/raw_data' if layout=='legacy' else 'coluta1/channel1/raw_data'
+    with h5py.File(filePath,'r') as hdf5File:
+        dataset = hdf5File[datasetName]
+        assert dataset.compression=='gzip' and dataset.compression_opts==4
+        assert dataset.shuffle==expected
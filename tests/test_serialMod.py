@@ -0,0 +1,26 @@
+"""Reads from the emulated board through serialMod."""
+
+import time
+import serialMod
+
+def test_readFromChip_returns_the_bytes_waiting(serialBoard):
+    serialBoard.serial.outputBuffer += bytes(range(100))
+    buffer = bytearray(200)
+    data = serialMod.readFromChip(serialBoard,'A',100,buffer=buffer)
+    assert bytes(data)==bytes(range(100))
+    assert data.obj is buffer
+
+def test_short_read_stops_at_the_deadline(serialBoard):
+    """The bytes waiting take most of the timeout to arrive, then none follow"""
+    emulator = serialBoard.serial
+    emulator.usbRate,emulator.usbLatency = 1000.,0.
+    emulator.outputBuffer += bytes(150)
+    portTimeout = emulator.timeout
+    timeout = 0.2
+    start = time.monotonic()
+    data = serialMod.readFromChip(serialBoard,'A',1000,timeout=timeout)
+    elapsed = time.monotonic()-start
+    assert len(data)==150
+    # Each readinto waits only for the time left, not for the whole timeout again
+    assert elapsed<1.25*timeout
+    assert emulator.timeout==portTimeout
@@ -0,0 +1,93 @@
+"""Status words and payloads coalesced by status.Transaction, as they reach the emulated board."""
+
+import threading
+import pytest
+import serialMod
+import status
+
+def statusBytes(statusObject):
+    return bytes(statusObject.read())
+
+def test_transaction_sends_one_write(serialBoard):
+    statusObject = status.Status(serialBoard)
+    with statusObject.transaction(serialBoard):
+        statusObject.send(serialBoard)
+        statusObject.sendFifoAOperation(serialBoard,1,8,address=3)
+        serialMod.writeToChip(serialBoard,'A',bytearray(range(1,9)))
+        statusObject.send(serialBoard)
+        assert serialBoard.writes==[]
+    assert len(serialBoard.writes)==1
+    statusObject.sendFifoAOperation(serialBoard,2,1,address=3)
+    statusObject.send(serialBoard)
+    assert serialMod.readFromChip(serialBoard,'A',8)==bytearray(range(1,9))
+
+def test_repeated_status_word_is_dropped(serialBoard):
+    statusObject = status.Status(serialBoard)
+    word = statusBytes(statusObject)
+    with statusObject.transaction(serialBoard):
+        statusObject.send(serialBoard)
+        statusObject.send(serialBoard)
+        serialMod.writeToChip(serialBoard,'A',bytearray([1,2]))
+        statusObject.send(serialBoard)
+    # The status bits are unchanged by the payload, so the last word is dropped too
+    assert serialBoard.writes==[word+bytes([1,2])]
+
+def test_status_word_after_a_commit_is_sent(serialBoard):
+    statusObject = status.Status(serialBoard)
+    word = statusBytes(statusObject)
+    with statusObject.transaction(serialBoard):
+        statusObject.send(serialBoard)
+        serialMod.commitTransaction(serialBoard)
+        statusObject.send(serialBoard)
+    assert serialBoard.writes==[word,word]
+
+def test_paced_operation_closes_the_write(serialBoard):
+    statusObject = status.Status(serialBoard)
+    serialBoard.pacing['i2c'] = 1e-4
+    with statusObject.transaction(serialBoard):
+        statusObject.send(serialBoard)
+        statusObject.sendI2Ccommand(serialBoard)
+        statusObject.send(serialBoard)
+    assert len(serialBoard.writes)==2
+
+def test_nested_transactions_join_the_outer_one(serialBoard):
+    statusObject = status.Status(serialBoard)
+    with statusObject.transaction(serialBoard) as outer:
+        with statusObject.transaction(serialBoard) as inner:
+            assert inner is outer
+            statusObject.sendStartMeasurement(serialBoard)
+        assert serialBoard.writes==[]
+        statusObject.send(serialBoard)
+    assert len(serialBoard.writes)==1
+    assert serialMod.getTransaction(serialBoard) is None
+
+def test_transaction_holds_the_serial_lock(serialBoard):
+    statusObject = status.Status(serialBoard)
+    entered = threading.Event()
+    def otherThread():
+        with statusObject.transaction(serialBoard):
+            entered.set()
+            statusObject.sendStartMeasurement(serialBoard)
+    with statusObject.transaction(serialBoard):
+        # The lock is reentrant for the thread holding it
+        with serialBoard.serialLock:
+            statusObject.send(serialBoard)
+        thread = threading.Thread(target=otherThread)
+        thread.start()
+        assert not entered.wait(0.1)
+        # The other thread queues into its own transaction, not this one
+        assert len(serialBoard.writes)==0
+    thread.join(1)
+    assert entered.is_set()
+    assert len(serialBoard.writes)==2
+
+def test_lock_is_released_after_an_error(serialBoard):
+    statusObject = status.Status(serialBoard)
+    with pytest.raises(RuntimeError):
+        with statusObject.transaction(serialBoard):
+            statusObject.send(serialBoard)
+            raise RuntimeError('failed')
+    assert serialMod.getTransaction(serialBoard) is None
+    assert serialBoard.serialLock.acquire(blocking=False)
+    serialBoard.serialLock.release()
+    assert len(serialBoard.writes)==1